@@ -13,45 +13,32 @@ Objetivos:
 Se utilizan técnicas de reducción de dimensionalidad (PCA, UMAP) y visualizaciones estadísticas.
 """
 
-import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler
-import umap
+from UserStore import open_users
+from Analysis import classify, type_names, fit_pca, pca_transform, umap_embedding
 
 # -----------------------------
 # Cargar datos
 # -----------------------------
-df = pd.read_csv("diverse_users_100k.csv")
+# CSV (se convierte una vez a un almacén binario a su lado) o almacén .npy (ver UserStore.py)
+users = open_users("diverse_users_100k.csv")
+df = users.to_frame()
 
 # Lista de géneros (columnas de gusto)
 GENRES = df.columns[1:19]
-X = df[GENRES].values  # Matriz de vectores de usuarios
+X = users.X  # Matriz de vectores de usuarios (float32, mapeada en memoria)
 
 # -----------------------------
 # Inferir tipo de usuario (por si no se guardó en el CSV)
 # -----------------------------
 # Clasificamos a cada usuario automáticamente según su perfil de gustos.
 # Esto nos permite colorearlos más adelante en los gráficos.
-# Lo hacemos a partir del número de gustos fuertes (>0.6) y no nulos (>0.05).
+# Lo hacemos a partir del número de gustos fuertes (>0.6) y no nulos (>0.05),
+# para todos los usuarios a la vez (ver Analysis.classify).
 
-def infer_user_type(row):
-    num_high = sum(row > 0.6)
-    num_nonzero = sum(row > 0.05)
-    if num_high == 1 and num_nonzero == 1:
-        return 'Extreme'
-    elif num_high == 1 and num_nonzero <= 3:
-        return 'Semi-extreme'
-    elif 2 <= num_high <= 4:
-        return 'Combined'
-    elif num_nonzero > 10:
-        return 'Mixed'
-    else:
-        return 'Rare'
-
-df['UserType'] = df[GENRES].apply(infer_user_type, axis=1)
+user_types = classify(users)
+df['UserType'] = type_names(user_types)
 
 # -----------------------------
 # Reducción de dimensionalidad con PCA
@@ -60,11 +47,10 @@ df['UserType'] = df[GENRES].apply(infer_user_type, axis=1)
 # de la variación entre usuarios. Nos permite ver si existen grupos naturales,
 # si los usuarios extremos se alejan del resto, etc.
 
-scaler = StandardScaler()
-X_scaled = scaler.fit_transform(X)  # Escalamos los datos para igualar la influencia de cada género
-
-pca = PCA(n_components=2)
-X_pca = pca.fit_transform(X_scaled)
+# Escalamos los datos para igualar la influencia de cada género. Escalado y PCA se ajustan
+# por trozos (IncrementalPCA), así que sirven para almacenes de cualquier tamaño.
+scaler, pca = fit_pca(users, n_components=2)
+X_pca = pca_transform(users, scaler, pca)
 
 df['PCA1'] = X_pca[:, 0]
 df['PCA2'] = X_pca[:, 1]
@@ -92,9 +78,14 @@ plt.show()
 # Mientras PCA busca maximizar la varianza global, UMAP intenta mantener la 
 # estructura de vecindad local. Es útil para ver "microgrupos" de usuarios 
 # similares o detectar clústeres no lineales.
-
-reducer = umap.UMAP(random_state=42)
-X_umap = reducer.fit_transform(X_scaled)
+#
+# UMAP se ajusta sobre una muestra estratificada (todos los tipos representados) y el modelo
+# se guarda en UMAP_CACHE junto con las coordenadas de cada usuario: al volver a ejecutar el
+# análisis solo se proyectan los usuarios nuevos (transform fuera de muestra).
+
+UMAP_CACHE = "analysis_cache"
+UMAP_SAMPLE = 20_000
+X_umap = umap_embedding(users, user_types, UMAP_CACHE, UMAP_SAMPLE)
 df['UMAP1'] = X_umap[:, 0]
 df['UMAP2'] = X_umap[:, 1]
 
@@ -157,4 +148,4 @@ plt.show()
 # ¿Hay grupos de usuarios claramente separados? → Mira los clusters en PCA o UMAP.
 # ¿Hay géneros dominantes o ignorados? → Revisa los histogramas.
 # ¿Varía mucho el gusto entre tipos de usuario? → Observa los boxplots.
-# ¿Los extremos realmente son únicos? → Mira su posición y densidad en los scatter plots.
\ No newline at end of file
+# ¿Los extremos realmente son únicos? → Mira su posición y densidad en los scatter plots.
\ No newline at end of file
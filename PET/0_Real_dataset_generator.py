@@ -1,119 +1,230 @@
-"""
-Script para generar un conjunto sintético de usuarios con la máxima diversidad de gustos musicales posible.
-
-Cada usuario está representado por un vector de 18 dimensiones (una por género/estilo musical), 
-con valores entre 0 y 1 que indican la afinidad hacia ese estilo. 
-El objetivo es cubrir todos los perfiles de usuario posibles: desde los que tienen un único gusto dominante 
-hasta aquellos con combinaciones caóticas o repartidas.
-
-Se generan 100.000 usuarios divididos en 5 tipos distintos:
-
-1. Extremos puros (2%): un solo estilo al 100%, el resto a 0.
-2. Semi-extremos (13%): un estilo dominante al 100%, y algunos secundarios bajos (0.1-0.3).
-3. Combinados medios (25%): 2-4 estilos dominantes con valores entre 0.3 y 0.8.
-4. Mezclados suaves (50%): afinidad repartida entre muchos estilos, valores entre 0.1 y 0.9.
-5. Raros o caóticos (10%): combinaciones inusuales de 5 estilos con valores entre 0.2 y 1.0.
-
-Los vectores no están normalizados ni tienen que sumar 1, para reflejar mejor la naturaleza libre 
-de los perfiles de usuario reales.
-
-El resultado se guarda en un archivo CSV llamado 'diverse_users_100k.csv'.
-
-"""
-
-import numpy as np
-import pandas as pd
-from typing import List
-
-# --- Configuración global ---
-
-NUM_USERS = 100_000
-GENRES = [
-    'Comedy', 'Art', 'Chill', 'Food', 'Social', 'Rock', 'Pop',
-    'Soul', 'Jazz', 'Electronic', 'Folk', 'Reggae', 'Hip-hop',
-    'Punk', 'Rap', 'Classical', 'Indie', 'Other'
-]
-
-# Porcentajes por tipo de usuario (suma 100%)
-PROFILE_DISTRIBUTION = {
-    'extreme': 0.02,
-    'semi_extreme': 0.13,
-    'combined': 0.25,
-    'mixed': 0.50,
-    'rare': 0.10
-}
-
-np.random.seed(42)  # Reproducibilidad
-
-
-# --- Funciones generadoras de cada tipo de usuario ---
-
-def generate_extreme_user() -> List[float]:
-    """Usuario con solo un estilo al 100%."""
-    vec = np.zeros(len(GENRES))
-    vec[np.random.randint(0, len(GENRES))] = 1.0
-    return vec.tolist()
-
-
-def generate_semi_extreme_user() -> List[float]:
-    """Usuario con un estilo dominante y algunos secundarios bajos."""
-    vec = np.random.uniform(0, 0.3, len(GENRES))
-    main_genre = np.random.randint(0, len(GENRES))
-    vec[main_genre] = 1.0
-    return vec.tolist()
-
-
-def generate_combined_user() -> List[float]:
-    """Usuario con 2–4 estilos dominantes."""
-    vec = np.zeros(len(GENRES))
-    indices = np.random.choice(len(GENRES), size=np.random.randint(2, 5), replace=False)
-    values = np.random.uniform(0.3, 0.8, len(indices))
-    vec[indices] = values
-    return vec.tolist()
-
-
-def generate_mixed_user() -> List[float]:
-    """Usuario con afinidades repartidas en muchos estilos."""
-    vec = np.random.uniform(0.1, 0.9, len(GENRES))
-    return vec.tolist()
-
-
-def generate_rare_user() -> List[float]:
-    """Usuario con combinaciones caóticas e inesperadas."""
-    vec = np.zeros(len(GENRES))
-    indices = np.random.choice(len(GENRES), size=5, replace=False)
-    values = np.random.uniform(0.2, 1.0, len(indices))
-    vec[indices] = values
-    return vec.tolist()
-
-
-# --- Función principal para generar todos los usuarios ---
-
-def generate_all_users(num_users: int) -> pd.DataFrame:
-    """Genera el conjunto completo de usuarios según las proporciones y los tipos definidos."""
-    users = []
-    generators = {
-        'extreme': generate_extreme_user,
-        'semi_extreme': generate_semi_extreme_user,
-        'combined': generate_combined_user,
-        'mixed': generate_mixed_user,
-        'rare': generate_rare_user
-    }
-
-    for profile_type, fraction in PROFILE_DISTRIBUTION.items():
-        count = int(num_users * fraction)
-        print(f"Generating {count} '{profile_type}' users...")
-        for _ in range(count):
-            users.append(generators[profile_type]())
-
-    df = pd.DataFrame(users, columns=GENRES)
-    df.insert(0, 'UserID', [f"user_{i+1}" for i in range(len(users))])
-    return df
-
-
-# --- Ejecutar y guardar el resultado ---
-
-if __name__ == "__main__":
-    df_users = generate_all_users(NUM_USERS)
-    df_users.to_csv("Diverse_users_100k.csv", index=False)
-    print("✅ Archivo 'diverse_users_100k.csv' generado con éxito.")
+"""
+Script para generar un conjunto sintético de usuarios con la máxima diversidad de gustos musicales posible.
+
+Cada usuario está representado por un vector de 18 dimensiones (una por género/estilo musical),
+con valores entre 0 y 1 que indican la afinidad hacia ese estilo.
+El objetivo es cubrir todos los perfiles de usuario posibles: desde los que tienen un único gusto dominante
+hasta aquellos con combinaciones caóticas o repartidas.
+
+Se generan 100.000 usuarios divididos en 5 tipos distintos:
+
+1. Extremos puros (2%): un solo estilo al 100%, el resto a 0.
+2. Semi-extremos (13%): un estilo dominante al 100%, y algunos secundarios bajos (0.1-0.3).
+3. Combinados medios (25%): 2-4 estilos dominantes con valores entre 0.3 y 0.8.
+4. Mezclados suaves (50%): afinidad repartida entre muchos estilos, valores entre 0.1 y 0.9.
+5. Raros o caóticos (10%): combinaciones inusuales de 5 estilos con valores entre 0.2 y 1.0.
+
+Los vectores no están normalizados ni tienen que sumar 1, para reflejar mejor la naturaleza libre
+de los perfiles de usuario reales.
+
+Cada tipo se genera por bloques vectorizados de SEED_BLOCK usuarios. Cada bloque tiene su propio
+generador aleatorio, derivado de (semilla, tipo, número de bloque), así que el resultado depende
+solo de la semilla y del número de usuarios, nunca del tamaño de los trozos que se escriben.
+Los usuarios se escriben en disco por trozos (memoria acotada, válido para 10M-100M usuarios):
+
+    Diverse_users_100k.npy     matriz float32 (usuarios x 18) en orden de columnas (Fortran),
+                               escrita con `np.lib.format.open_memmap`
+    Diverse_users_100k.json    géneros, número de filas y esquema de UserID ('user_<fila + 1>')
+    Diverse_users_100k.csv     mismo contenido en CSV (UserID + un género por columna), opcional
+
+Uso:
+    python 0_Real_dataset_generator.py
+    python 0_Real_dataset_generator.py --users 10000000 --no-csv
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+# --- Configuración global ---
+
+NUM_USERS = 100_000
+GENRES = [
+    'Comedy', 'Art', 'Chill', 'Food', 'Social', 'Rock', 'Pop',
+    'Soul', 'Jazz', 'Electronic', 'Folk', 'Reggae', 'Hip-hop',
+    'Punk', 'Rap', 'Classical', 'Indie', 'Other'
+]
+
+# Porcentajes por tipo de usuario (suma 100%)
+PROFILE_DISTRIBUTION = {
+    'extreme': 0.02,
+    'semi_extreme': 0.13,
+    'combined': 0.25,
+    'mixed': 0.50,
+    'rare': 0.10
+}
+
+SEED = 42  # Reproducibilidad
+SEED_BLOCK = 65_536  # Usuarios por generador aleatorio (fijo: define el resultado de cada semilla)
+CHUNK_SIZE = 1_000_000  # Usuarios por escritura en disco (no cambia el resultado)
+
+OUTPUT_NPY = "Diverse_users_100k.npy"
+OUTPUT_CSV = "Diverse_users_100k.csv"
+ID_PREFIX = "user_"
+FORMAT_VERSION = 1
+
+
+# --- Generadores vectorizados de cada tipo de usuario (n usuarios por llamada) ---
+
+def _pick(rng, n, k):
+    """Máscara (n, 18) con k[i] estilos distintos elegidos al azar en cada fila."""
+    keys = rng.random((n, len(GENRES)))
+    kth = np.take_along_axis(np.sort(keys, axis=1), (np.asarray(k) - 1).reshape(-1, 1), axis=1)
+    return keys <= kth
+
+
+def generate_extreme_users(rng, n):
+    """Usuarios con solo un estilo al 100%."""
+    X = np.zeros((n, len(GENRES)), dtype=np.float32)
+    X[np.arange(n), rng.integers(0, len(GENRES), n)] = 1.0
+    return X
+
+
+def generate_semi_extreme_users(rng, n):
+    """Usuarios con un estilo dominante y algunos secundarios bajos."""
+    X = rng.uniform(0, 0.3, (n, len(GENRES))).astype(np.float32)
+    X[np.arange(n), rng.integers(0, len(GENRES), n)] = 1.0
+    return X
+
+
+def generate_combined_users(rng, n):
+    """Usuarios con 2–4 estilos dominantes."""
+    mask = _pick(rng, n, rng.integers(2, 5, n))
+    return np.where(mask, rng.uniform(0.3, 0.8, (n, len(GENRES))), 0).astype(np.float32)
+
+
+def generate_mixed_users(rng, n):
+    """Usuarios con afinidades repartidas en muchos estilos."""
+    return rng.uniform(0.1, 0.9, (n, len(GENRES))).astype(np.float32)
+
+
+def generate_rare_users(rng, n):
+    """Usuarios con combinaciones caóticas e inesperadas."""
+    mask = _pick(rng, n, np.full(n, 5))
+    return np.where(mask, rng.uniform(0.2, 1.0, (n, len(GENRES))), 0).astype(np.float32)
+
+
+GENERATORS = {
+    'extreme': generate_extreme_users,
+    'semi_extreme': generate_semi_extreme_users,
+    'combined': generate_combined_users,
+    'mixed': generate_mixed_users,
+    'rare': generate_rare_users
+}
+
+
+# --- Generación por trozos ---
+
+def profile_counts(num_users):
+    """Número de usuarios de cada tipo, en el orden en que se escriben."""
+    return {profile: int(num_users * fraction) for profile, fraction in PROFILE_DISTRIBUTION.items()}
+
+
+def _block(profile, index, count, seed):
+    """Bloque `index` de los `count` usuarios de un tipo, con su propio generador."""
+    p = list(GENERATORS).index(profile)
+    start = index * SEED_BLOCK
+    rng = np.random.default_rng([seed, p, index])
+    return GENERATORS[profile](rng, min(SEED_BLOCK, count - start))
+
+
+def iter_chunks(num_users, chunk_size=CHUNK_SIZE, seed=SEED):
+    """
+    Usuarios en trozos consecutivos de `chunk_size` filas.
+
+    Devuelve:
+        iterador de (fila inicial, matriz float32 del trozo, tipo de cada fila).
+    """
+    segments, first = [], 0
+    for profile, count in profile_counts(num_users).items():
+        segments.append((profile, first, count))
+        first += count
+    total = first
+
+    cached_key, cached = None, None
+    for start in range(0, total, chunk_size):
+        stop = min(start + chunk_size, total)
+        parts, types = [], []
+        for profile, first, count in segments:
+            lo, hi = max(start, first) - first, min(stop, first + count) - first
+            while lo < hi:
+                b = lo // SEED_BLOCK
+                if cached_key != (profile, b):
+                    cached_key, cached = (profile, b), _block(profile, b, count, seed)
+                take = min(hi, (b + 1) * SEED_BLOCK) - lo
+                parts.append(cached[lo - b * SEED_BLOCK:lo - b * SEED_BLOCK + take])
+                types.append(np.full(take, profile, dtype=object))
+                lo += take
+        yield start, np.concatenate(parts), np.concatenate(types)
+
+
+def user_ids(start, n):
+    return [f"{ID_PREFIX}{i + 1}" for i in range(start, start + n)]
+
+
+def generate_all_users(num_users: int, seed: int = SEED) -> pd.DataFrame:
+    """Genera el conjunto completo de usuarios según las proporciones y los tipos definidos."""
+    for profile, count in profile_counts(num_users).items():
+        print(f"Generating {count} '{profile}' users...")
+    X = np.concatenate([chunk for _, chunk, _ in iter_chunks(num_users, CHUNK_SIZE, seed)])
+    df = pd.DataFrame(X, columns=GENRES)
+    df.insert(0, 'UserID', user_ids(0, len(df)))
+    return df
+
+
+def write_users(num_users, npy_path=OUTPUT_NPY, csv_path=OUTPUT_CSV, chunk_size=CHUNK_SIZE, seed=SEED):
+    """
+    Escribe los usuarios por trozos: matriz .npy (memmap, orden de columnas) + metadatos .json,
+    y CSV si `csv_path` no es None. En memoria solo hay un trozo a la vez.
+
+    Devuelve:
+        dict: Metadatos escritos junto a la matriz.
+    """
+    counts = profile_counts(num_users)
+    total = sum(counts.values())
+    tmp_npy = npy_path + '.tmp'
+    matrix = np.lib.format.open_memmap(tmp_npy, mode='w+', dtype=np.float32,
+                                       shape=(total, len(GENRES)), fortran_order=True)
+    tmp_csv = csv_path + '.tmp' if csv_path else None
+    if tmp_csv:
+        pd.DataFrame(columns=['UserID'] + GENRES).to_csv(tmp_csv, index=False)
+
+    for start, X, _ in iter_chunks(num_users, chunk_size, seed):
+        matrix[start:start + len(X)] = X
+        if tmp_csv:
+            chunk = pd.DataFrame(X, columns=GENRES)
+            chunk.insert(0, 'UserID', user_ids(start, len(X)))
+            chunk.to_csv(tmp_csv, mode='a', header=False, index=False, float_format='%.9g')
+        print(f"{start + len(X)} / {total} users written")
+
+    matrix.flush()
+    del matrix
+    os.replace(tmp_npy, npy_path)
+    if tmp_csv:
+        os.replace(tmp_csv, csv_path)
+
+    meta = {'version': FORMAT_VERSION, 'genres': GENRES, 'rows': total, 'order': 'F',
+            'id_prefix': ID_PREFIX, 'id_start': 1, 'seed': seed, 'profiles': counts}
+    meta_path = os.path.splitext(npy_path)[0] + '.json'
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+    return meta
+
+
+# --- Ejecutar y guardar el resultado ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generador sintético de usuarios PET')
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--npy', default=OUTPUT_NPY)
+    parser.add_argument('--csv', default=OUTPUT_CSV)
+    parser.add_argument('--no-csv', action='store_true', help='Solo el formato binario')
+    opts = parser.parse_args()
+
+    write_users(opts.users, opts.npy, None if opts.no_csv else opts.csv, opts.chunk_size, opts.seed)
+    print(f"✅ Archivo '{opts.npy}' generado con éxito.")
@@ -1,118 +1,84 @@
 import pandas as pd
 from PIL import Image
 import os
-import matplotlib.pyplot as plt
-
-csv_path = '1_DResultados2.csv'
-df = pd.read_csv(csv_path)
-
-# =============================
-# Load accessory image by name
-# =============================
-def load_image_from_folder(accessory_name, folder_path):
-    # Remove the prefix like '(Torso) ' from the name
-    accessory_name = accessory_name.split(') ')[-1]
-    image_path = os.path.join(folder_path, accessory_name)
-    return Image.open(image_path)
+import time
+import tempfile
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from Pyramid import SpritePyramid
+from PetCache import PetCache, CACHE_DIR
+from Chart import chart_for, SERIES_5, SERIES_2
+from Output import OutputSpec, ImageWriter
+from Catalog import AccessoryCatalog
+from UserStore import open_users
+from Results import iter_results, accessory_vectors, user_vectors
+
+# Results of 1_TopN.py (one row per user, see Results.py); the genre vectors are joined from
+# the catalog and the users the search ran on, loaded by the main process only
+RESULTS_PATH = '1_DResultados.csv'
+CATALOG_PATH = '1_AccessoryDataset.csv'
+USERS_PATH = '0_Diverse_users_100k.csv'
+
+# Output files: format, optional downscale and name of each kind (see Output.py), e.g.
+# OutputSpec('jpeg', 'combined_image_{user_id}.{ext}') or OutputSpec('png', ..., compress_level=1)
+OUTPUTS = {
+    'pet': OutputSpec('png', 'Pet_{user_id}.{ext}'),
+    'chart': OutputSpec('png', 'genre_comparison_{user_id}.{ext}'),
+    'combined': OutputSpec('png', 'combined_image_{user_id}.{ext}'),
+}
 
 # ================================
 # Generate pet image for a user
 # ================================
-def create_pet_image(user_id, torso_name, head_name, face_name):
-    base_image_path = 'Synthesis/Synthesis/ToyPet/Data/Body/RockyBoi.png'
-    base_image = Image.open(base_image_path)
-
-    # Load accessory images
-    torso_image = load_image_from_folder(torso_name, 'Synthesis/Synthesis/ToyPet/Data/Torso')
-    head_image = load_image_from_folder(head_name, 'Synthesis/Synthesis/ToyPet/Data/Head')
-    face_image = load_image_from_folder(face_name, 'Synthesis/Synthesis/ToyPet/Data/Face')
-
-    # Paste accessories on top of base image (positions can be adjusted if needed)
-    base_image.paste(torso_image, (0, 0), torso_image)
-    base_image.paste(head_image, (0, 0), head_image)
-    base_image.paste(face_image, (0, 0), face_image)
-
-    # Save the resulting pet image
-    pet_image_name = f'Pet_{user_id}.png'
-    base_image.save(pet_image_name)
+
+# Layers are decoded once and cropped to their visible area (see Compositor.py); smaller
+# sizes are composited from the prebuilt resolution pyramid (see Pyramid.py)
+PET_SIZE = None  # Output width/height in pixels; None keeps the 3780 px sources
+
+# Renderer and pet cache of the process rendering users, created by init_worker()
+renderer = pet_cache = None
+
+# Composed pets are stored once per (accessories, size, asset versions); per-user files link to
+# them when the pet output is a full-size PNG, and are encoded with OUTPUTS['pet'] otherwise
+def make_pet_cache(cache_dir=CACHE_DIR):
+    return PetCache(cache_dir, save_options=OUTPUTS['pet'].options if OUTPUTS['pet'].linkable else None)
+
+def create_pet_image(user_id, torso_name, head_name, face_name, size=PET_SIZE):
+    cached_path, base_image = pet_cache.get_or_render(head_name, torso_name, face_name, size, renderer.compose)
+
+    # Per-user reference to the cached pet image
+    pet_image_name = OUTPUTS['pet'].path(user_id)
+    if OUTPUTS['pet'].linkable:
+        pet_cache.link(cached_path, pet_image_name, base_image)
     return pet_image_name, base_image
 
 # =====================================================
 # Plot bar chart: user, each accessory, and the average
 # =====================================================
-def plot_genres_5(user_genres, torso_genres, head_genres, face_genres, accessory_genres, user_id):
-    user_genres = pd.DataFrame([user_genres])  # Ensure it's a DataFrame
-
-    genres = user_genres.columns
-    user_values = user_genres.values.flatten()
-    torso_values = torso_genres.values.flatten()
-    head_values = head_genres.values.flatten()
-    face_values = face_genres.values.flatten()
-    accessory_values = accessory_genres.values.flatten()
-
-    # Plot bar chart
-    fig, ax = plt.subplots(figsize=(12, 6))
-    index = range(len(genres))
-    bar_width = 0.15
-
-    ax.bar(index, user_values, bar_width, label='User', color='b')
-    ax.bar([i + bar_width for i in index], accessory_values, bar_width, label='Torso', color='r')
-    ax.bar([i + 2 * bar_width for i in index], head_values, bar_width, label='Head', color='y')
-    ax.bar([i + 3 * bar_width for i in index], face_values, bar_width, label='Face', color='purple')
-    ax.bar([i + 4 * bar_width for i in index], accessory_values, bar_width, label='Accessories (Avg)', color='g')
-
-    ax.set_xlabel('Genres')
-    ax.set_ylabel('Values')
-    ax.set_title('Comparison of User and Accessory Genres')
-    ax.set_xticks([i + 2 * bar_width for i in index])
-    ax.set_xticklabels(genres, rotation=90)
-    ax.legend()
-
-    # Save and return path
-    plt.tight_layout()
-    graph_path = f'genre_comparison_{user_id}.png'
-    plt.savefig(graph_path)
-    return graph_path
+
+# Charts are drawn on axes, labels and legend pre-rendered once per genre list and width
+# (see Chart.py), so no matplotlib figure is created per user
+def plot_genres_5(user_genres, torso_genres, head_genres, face_genres, accessory_genres, width=None):
+    chart = chart_for(user_genres.index, SERIES_5, width)
+    return chart.render(user_genres.values, torso_genres.values, head_genres.values,
+                        face_genres.values, accessory_genres.values)
 
 # ==============================================
 # Plot bar chart: user vs. average accessories
 # ==============================================
-def plot_genres_2(user_genres, accessory_genres, user_id):
-    user_genres = pd.DataFrame([user_genres])  # Ensure it's a DataFrame
-
-    genres = user_genres.columns
-    user_values = user_genres.values.flatten()
-    accessory_values = accessory_genres.values.flatten()
-
-    fig, ax = plt.subplots(figsize=(10, 6))
-    index = range(len(genres))
-    bar_width = 0.35
-
-    ax.bar(index, user_values, bar_width, label='User', color='b')
-    ax.bar([i + bar_width for i in index], accessory_values, bar_width, label='Accessories', color='r')
-
-    ax.set_xlabel('Genres')
-    ax.set_ylabel('Values')
-    ax.set_title('Comparison of User and Accessory Genres')
-    ax.set_xticks([i + 2 * bar_width for i in index])
-    ax.set_xticklabels(genres, rotation=90)
-    ax.legend()
-
-    plt.tight_layout()
-    graph_path = f'genre_comparison_{user_id}.png'
-    plt.savefig(graph_path)
-    return graph_path
+def plot_genres_2(user_genres, accessory_genres, width=None):
+    chart = chart_for(user_genres.index, SERIES_2, width)
+    return chart.render(user_genres.values, accessory_genres.values)
 
 # ===========================================
 # Combine pet image with genre bar chart
 # ===========================================
-def combine_images(graph_path, pet_image, user_id):
-    graph_image = Image.open(graph_path)
-
-    # Resize graph to match pet image height
+def combine_images(graph_image, pet_image):
+    # Resize graph to 60% of the pet width (charts drawn at that width are used as they are)
     graph_width = int(pet_image.width * 0.6)
-    graph_height = int(graph_image.height * (graph_width / graph_image.width))
-    graph_image = graph_image.resize((graph_width, graph_height))
+    if graph_image.width != graph_width:
+        graph_height = int(graph_image.height * (graph_width / graph_image.width))
+        graph_image = graph_image.resize((graph_width, graph_height))
 
     # Create a new blank image wide enough to place both
     total_width = pet_image.width + graph_image.width
@@ -123,34 +89,157 @@ def combine_images(graph_path, pet_image, user_id):
     combined_image.paste(pet_image, (0, 0))
     combined_image.paste(graph_image, (pet_image.width, 0))
 
-    combined_image_path = f'combined_image_{user_id}.png'
-    combined_image.save(combined_image_path)
-    return combined_image_path
+    return combined_image
 
 # ============================================
-# Process each user and generate visual output
+# Render one user (runs in a worker process)
 # ============================================
-for i in range(0, len(df), 4):
-    user_id = df.iloc[i, 0]
-    user_genres = df.iloc[i, 1:]
-
-    torso_name = df.iloc[i+1, 0]
-    head_name = df.iloc[i+2, 0]
-    face_name = df.iloc[i+3, 0]
+def output_names(user_id):
+    return tuple(OUTPUTS[kind].path(user_id) for kind in ('pet', 'chart', 'combined'))
+
+def render_user(task, encode=True):
+    # Output files are encoded here when running in a worker process (encode=True), or
+    # returned as images for the background writer of the main process
+    # task: UserID, (head, torso, face) names and the genre vectors (User, Head, Torso, Face rows)
+    # A slot left unserved (sold out, see Assignment.py) has an empty name and NaN genres: the
+    # pet is composed without that layer and the accessory average skips it
+    user_id, (head_name, torso_name, face_name), vectors = task
+    user_genres = vectors.loc['User']
 
     # Generate pet image
     pet_image_name, pet_image = create_pet_image(user_id, torso_name, head_name, face_name)
 
     # Get genre vectors for each accessory
-    torso_genres = df.iloc[i+1, 1:]
-    head_genres = df.iloc[i+2, 1:]
-    face_genres = df.iloc[i+3, 1:]
-    accessory_genres = df.iloc[i+1:i+4, 1:].mean(axis=0)
+    torso_genres = vectors.loc['Torso']
+    head_genres = vectors.loc['Head']
+    face_genres = vectors.loc['Face']
+    accessory_genres = vectors.loc[['Head', 'Torso', 'Face']].mean(axis=0)
+
+    # Generate genre comparison graph and combine it with the pet, both in memory
+    vectors = (user_genres, torso_genres, head_genres, face_genres, accessory_genres)
+    graph_image = plot_genres_5(*vectors)
+    combined_image = combine_images(plot_genres_5(*vectors, width=int(pet_image.width * 0.6)), pet_image)
+
+    _, graph_path, combined_image_path = output_names(user_id)
+    files = {graph_path: (graph_image, OUTPUTS['chart']), combined_image_path: (combined_image, OUTPUTS['combined'])}
+    if not OUTPUTS['pet'].linkable:
+        files[pet_image_name] = (pet_image, OUTPUTS['pet'])
+    if encode:
+        files = {name: spec.encode(image) for name, (image, spec) in files.items()}
+    return user_id, files, (os.getpid(), pet_cache.stats())
+
+def init_worker(cache_dir=CACHE_DIR):
+    # Assets are loaded once per rendering process (each worker, or the main process when
+    # rendering serially) and reused for all its users
+    global renderer, pet_cache
+    renderer = SpritePyramid()
+    pet_cache = make_pet_cache(cache_dir)
 
-    # Generate genre comparison graph
-    graph_path = plot_genres_5(user_genres, torso_genres, head_genres, face_genres, accessory_genres, user_id)
-
-    # Combine pet + graph
-    combined_image_path = combine_images(graph_path, pet_image, user_id)
-
-    print(f'Combined image for user {user_id} saved as {combined_image_path}')
+# ============================================
+# Process every user and write the outputs
+# ============================================
+WORKERS = os.cpu_count()
+QUEUE_SIZE = 2 * WORKERS  # Rendered users waiting to be written, at most
+WRITER_THREADS = 2  # Background threads encoding and writing the output files
+RESUME = True  # Skip users whose outputs already exist
+SCALING_USERS = 0  # If > 0, only measure users/s on that many users for 1..WORKERS workers
+
+def user_tasks(results_path=RESULTS_PATH, resume=RESUME, chunk_size=10_000,
+               catalog_path=CATALOG_PATH, users_path=USERS_PATH):
+    # Result rows read in chunks, with the vectors of each chunk joined in one lookup
+    catalog = AccessoryCatalog.from_csv(catalog_path)
+    users = open_users(users_path)
+    for df in iter_results(results_path, chunk_size, catalog):
+        accessories = accessory_vectors(df, catalog)
+        user_genres = user_vectors(df, users, catalog.genres)
+        for i, user_id in enumerate(df['UserID']):
+            if resume and all(os.path.exists(name) for name in output_names(user_id)):
+                continue
+            rows = [user_genres[i]] + [accessories[slot][i] for slot in ('Head', 'Torso', 'Face')]
+            vectors = pd.DataFrame(rows, index=['User', 'Head', 'Torso', 'Face'], columns=catalog.genres)
+            yield user_id, (df['Head'].iat[i], df['Torso'].iat[i], df['Face'].iat[i]), vectors
+
+def write_outputs(result, cache_stats, writer):
+    # Files are queued on the background writer (atomic, so resuming trusts what exists)
+    user_id, files, (pid, stats) = result
+    for name, payload in files.items():
+        if isinstance(payload, bytes):
+            writer.submit(name, payload)
+        else:
+            writer.submit(name, *payload)
+    # Counters are cumulative per worker; results can arrive out of order
+    lookups = lambda st: st['hot_hits'] + st['disk_hits'] + st['misses']
+    if pid not in cache_stats or lookups(stats) > lookups(cache_stats[pid]):
+        cache_stats[pid] = stats
+    return user_id
+
+def render_all(tasks, workers=WORKERS, queue_size=QUEUE_SIZE, cache_dir=CACHE_DIR, verbose=True):
+    """
+    Render the tasks with a pool of worker processes.
+
+    Returns:
+        tuple: Number of users written, the pet cache hits / misses over all workers and
+        the statistics of the output writer.
+    """
+    done = 0
+    cache_stats = {}
+    writer = ImageWriter(WRITER_THREADS, queue_size)
+
+    def finish(result):
+        nonlocal done
+        user_id = write_outputs(result, cache_stats, writer)
+        done += 1
+        if verbose:
+            print(f'Combined image for user {user_id} saved')
+
+    if workers <= 1:
+        init_worker(cache_dir)
+        for task in tasks:
+            finish(render_user(task, encode=False))
+    else:
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(cache_dir,)) as pool:
+            pending = set()
+            for task in tasks:
+                # Bounded queue: wait for finished users before submitting more
+                while len(pending) >= queue_size:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        finish(future.result())
+                pending.add(pool.submit(render_user, task))
+            for future in pending:
+                finish(future.result())
+    writer.close()
+
+    totals = {k: sum(s[k] for s in cache_stats.values()) for k in ('hot_hits', 'disk_hits', 'misses')}
+    lookups = sum(totals.values())
+    totals['hit_rate'] = (totals['hot_hits'] + totals['disk_hits']) / lookups if lookups else 0.0
+    return done, totals, writer.stats()
+
+def scaling_report(n_users, max_workers=WORKERS):
+    # Users/s from 1 to max_workers workers, each run from scratch in a temporary folder
+    report = []
+    tasks = list(islice(user_tasks(resume=False), n_users))
+    counts = sorted({min(2 ** k, max_workers) for k in range(max_workers.bit_length() + 1)})
+    cwd = os.getcwd()
+    for workers in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                start = time.perf_counter()
+                count, _, _ = render_all(tasks, workers, cache_dir=os.path.join(tmp, 'pet_cache'), verbose=False)
+                seconds = time.perf_counter() - start
+            finally:
+                os.chdir(cwd)
+        report.append({'workers': workers, 'users': count, 'seconds': seconds, 'users_per_s': count / seconds})
+        print(report[-1])
+    return pd.DataFrame(report)
+
+if __name__ == '__main__':
+    if SCALING_USERS:
+        scaling_report(SCALING_USERS)
+    else:
+        start = time.perf_counter()
+        count, cache_stats, writer_stats = render_all(user_tasks())
+        print(f'{count} users rendered in {time.perf_counter() - start:.1f}s')
+        print(f'Pet cache: {cache_stats}')
+        print(f'Output writer: {writer_stats}')
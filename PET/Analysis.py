@@ -0,0 +1,230 @@
+"""
+Scalable analysis of the user population, for 0.5_Dataset_analysis.py.
+
+- `classify()` labels every user with one of `USER_TYPES` from their number of strong
+  (> 0.6) and non-zero (> 0.05) genres: the rules of the former row-wise `infer_user_type()`,
+  evaluated on whole chunks with NumPy.
+- `fit_pca()` streams a user store (or any matrix) twice in chunks: a `StandardScaler` and
+  then an `IncrementalPCA` are fitted with `partial_fit`, so memory does not grow with the
+  population. `pca_transform()` projects it chunk by chunk.
+- `umap_embedding()` fits UMAP on a stratified sample (every user type represented, the
+  rest proportional), caches the model, its scaler and the projection of every user on disk,
+  and projects users added since the last run with the model's out-of-sample `transform`.
+  The cache is refitted only when its settings change or the sampled users themselves do.
+  Users are expected to be appended, as the generator and `convert_csv()` do.
+
+UMAP comes from the `umap-learn` package, imported only when an embedding is computed.
+
+Usage:
+    python Analysis.py users.npy --cache analysis_cache
+"""
+
+import os
+import time
+import json
+import hashlib
+import argparse
+import numpy as np
+import joblib
+from sklearn.preprocessing import StandardScaler
+from sklearn.decomposition import IncrementalPCA
+
+USER_TYPES = ('Extreme', 'Semi-extreme', 'Combined', 'Mixed', 'Rare')
+HIGH = 0.6  # Strong liking
+NONZERO = 0.05  # Any liking
+
+CACHE_DIR = 'analysis_cache'
+FORMAT_VERSION = 1
+
+
+def _matrix(users):
+    # Users matrix of a UserStore, or the array itself
+    return users.X if hasattr(users, 'X') else users
+
+
+def _chunks(X, chunk_size):
+    for start in range(0, len(X), chunk_size):
+        yield start, np.asarray(X[start:start + chunk_size], dtype=np.float32)
+
+
+# ----------------------------------------------------------------------
+# User types
+# ----------------------------------------------------------------------
+def classify(users, chunk_size=1_000_000):
+    """
+    User type of every row.
+
+    Returns:
+        np.ndarray: int8 index into `USER_TYPES` per user.
+    """
+    X = _matrix(users)
+    codes = np.empty(len(X), dtype=np.int8)
+    for start, block in _chunks(X, chunk_size):
+        num_high = (block > HIGH).sum(1)
+        num_nonzero = (block > NONZERO).sum(1)
+        codes[start:start + len(block)] = np.select(
+            [(num_high == 1) & (num_nonzero == 1),
+             (num_high == 1) & (num_nonzero <= 3),
+             (num_high >= 2) & (num_high <= 4),
+             num_nonzero > 10],
+            [0, 1, 2, 3], default=4)
+    return codes
+
+
+def type_names(codes):
+    return np.array(USER_TYPES, dtype=object)[codes]
+
+
+def stratified_sample(codes, size, min_per_type=500, seed=42):
+    """
+    Sorted rows of a sample with every type represented: `min_per_type` users of each (or all
+    of them if fewer) and the rest of `size` split in proportion to the type counts.
+    """
+    rng = np.random.default_rng(seed)
+    counts = np.bincount(codes, minlength=len(USER_TYPES))
+    if size >= len(codes):
+        return np.arange(len(codes))
+    base = np.minimum(counts, min_per_type)
+    extra = np.floor((size - base.sum()) * counts / counts.sum()).astype(int) if size > base.sum() else 0
+    take = np.minimum(counts, base + extra)
+    rows = [rng.choice(np.flatnonzero(codes == t), take[t], replace=False)
+            for t in range(len(USER_TYPES)) if take[t]]
+    return np.sort(np.concatenate(rows))
+
+
+# ----------------------------------------------------------------------
+# PCA
+# ----------------------------------------------------------------------
+def fit_pca(users, n_components=2, chunk_size=100_000):
+    """
+    Standardize and fit PCA in two streaming passes.
+
+    Returns:
+        tuple: (StandardScaler, IncrementalPCA).
+    """
+    X = _matrix(users)
+    scaler = StandardScaler()
+    for _, block in _chunks(X, chunk_size):
+        scaler.partial_fit(block)
+    pca = IncrementalPCA(n_components=n_components)
+    for _, block in _chunks(X, chunk_size):
+        # partial_fit needs at least n_components rows
+        if len(block) >= n_components:
+            pca.partial_fit(scaler.transform(block))
+    return scaler, pca
+
+
+def pca_transform(users, scaler, pca, chunk_size=100_000):
+    X = _matrix(users)
+    out = np.empty((len(X), pca.n_components_), dtype=np.float32)
+    for start, block in _chunks(X, chunk_size):
+        out[start:start + len(block)] = pca.transform(scaler.transform(block))
+    return out
+
+
+# ----------------------------------------------------------------------
+# UMAP
+# ----------------------------------------------------------------------
+def _digest(X, rows):
+    return hashlib.sha256(np.ascontiguousarray(X[rows], dtype=np.float32).tobytes()).hexdigest()
+
+
+def umap_embedding(users, codes=None, cache_dir=CACHE_DIR, sample_size=20_000, min_per_type=500,
+                   seed=42, chunk_size=100_000, verbose=True, **umap_params):
+    """
+    2D UMAP coordinates of every user, fitted on a stratified sample and cached.
+
+    Parameters:
+        users (UserStore or np.ndarray): Users matrix.
+        codes (np.ndarray, optional): `classify()` output, computed when missing.
+        cache_dir (str): Folder of the fitted model (umap.joblib) and the projections
+            (umap_embedding.npy).
+        **umap_params: Extra `umap.UMAP` arguments (part of the cache key).
+
+    Returns:
+        np.ndarray: (n, 2) float32 embedding.
+    """
+    X = _matrix(users)
+    os.makedirs(cache_dir, exist_ok=True)
+    model_path = os.path.join(cache_dir, 'umap.joblib')
+    embedding_path = os.path.join(cache_dir, 'umap_embedding.npy')
+    key = {'version': FORMAT_VERSION, 'genres': int(X.shape[1]), 'sample_size': sample_size,
+           'min_per_type': min_per_type, 'seed': seed, 'params': umap_params}
+
+    cache = joblib.load(model_path) if os.path.exists(model_path) else None
+    if cache is not None:
+        sample = cache['sample']
+        if json.dumps(cache['key'], sort_keys=True) != json.dumps(key, sort_keys=True) \
+                or sample.max(initial=-1) >= len(X) or _digest(X, sample) != cache['digest'] \
+                or not os.path.exists(embedding_path):
+            cache = None
+
+    if cache is None:
+        import umap
+
+        t0 = time.perf_counter()
+        codes = classify(X) if codes is None else codes
+        sample = stratified_sample(codes, sample_size, min_per_type, seed)
+        scaler = StandardScaler().fit(np.asarray(X[sample], dtype=np.float32))
+        reducer = umap.UMAP(random_state=seed, **umap_params)
+        reducer.fit(scaler.transform(np.asarray(X[sample], dtype=np.float32)))
+        cache = {'key': key, 'sample': sample, 'digest': _digest(X, sample),
+                 'scaler': scaler, 'reducer': reducer}
+        joblib.dump(cache, model_path + '.tmp')
+        os.replace(model_path + '.tmp', model_path)
+        embedding = np.empty((0, 2), dtype=np.float32)
+        if verbose:
+            print(f"UMAP fitted on {len(sample)} sampled users in {time.perf_counter() - t0:.1f}s")
+    else:
+        embedding = np.load(embedding_path)
+        if len(embedding) > len(X):
+            embedding = embedding[:0]  # users were removed: project everyone again
+
+    # Project the users not in the cached embedding, out of sample
+    done = len(embedding)
+    if done < len(X):
+        t0 = time.perf_counter()
+        new = np.empty((len(X) - done, 2), dtype=np.float32)
+        sample, fitted = cache['sample'], cache['reducer'].embedding_
+        for start in range(done, len(X), chunk_size):
+            block = np.asarray(X[start:start + chunk_size], dtype=np.float32)
+            # Sampled users keep their fitted coordinates (the sample rows are sorted)
+            rows = np.arange(start, start + len(block))
+            pos = np.minimum(np.searchsorted(sample, rows), len(sample) - 1)
+            in_sample = sample[pos] == rows
+            coords = np.empty((len(block), 2), dtype=np.float32)
+            if in_sample.any():
+                coords[in_sample] = fitted[pos[in_sample]]
+            if (~in_sample).any():
+                coords[~in_sample] = cache['reducer'].transform(cache['scaler'].transform(block[~in_sample]))
+            new[start - done:start - done + len(block)] = coords
+        embedding = np.concatenate([embedding, new])
+        np.save(embedding_path + '.tmp.npy', embedding)
+        os.replace(embedding_path + '.tmp.npy', embedding_path)
+        if verbose:
+            print(f"UMAP projected {len(new)} users in {time.perf_counter() - t0:.1f}s")
+    return embedding
+
+
+if __name__ == '__main__':
+    from UserStore import open_users
+
+    parser = argparse.ArgumentParser(description='User types, streaming PCA and cached UMAP of a user store')
+    parser.add_argument('users', help='Users CSV or user store .npy')
+    parser.add_argument('--cache', default=CACHE_DIR)
+    parser.add_argument('--sample', type=int, default=20_000)
+    parser.add_argument('--no-umap', action='store_true')
+    opts = parser.parse_args()
+
+    store = open_users(opts.users)
+    t0 = time.perf_counter()
+    codes = classify(store)
+    print(dict(zip(USER_TYPES, np.bincount(codes, minlength=len(USER_TYPES)).tolist())),
+          f"({time.perf_counter() - t0:.2f}s)")
+    t0 = time.perf_counter()
+    scaler, pca = fit_pca(store)
+    coords = pca_transform(store, scaler, pca)
+    print(f"PCA explained variance {pca.explained_variance_ratio_.round(3).tolist()} "
+          f"({time.perf_counter() - t0:.2f}s)")
+    if not opts.no_umap:
+        umap_embedding(store, codes, opts.cache, opts.sample)
@@ -0,0 +1,287 @@
+"""
+Population-wide accessory assignment under per-accessory inventory caps.
+
+When an accessory can only be handed out K times, picking every user's best triple
+independently overbooks the popular items. This module maximizes the total score over all
+users subject to the caps, within each user's best `C` candidate triples (the Top-N
+combinations ranked by score):
+
+1. Prices: every accessory gets a price; each user picks the candidate maximizing
+   score - price(head) - price(torso) - price(face), and prices of overbooked accessories
+   rise (projected subgradient on the Lagrangian dual, i.e. an auction with a shrinking
+   step). The dual value is an upper bound on the capped optimum over the candidate sets.
+2. Repair: users are served in order of regret (how much they lose by moving to their next
+   candidate) and get their best price-adjusted candidate that still fits in the remaining
+   stock. Users whose candidates are all sold out get, per slot, the most cosine-similar
+   accessory with stock left.
+
+`assignment_report()` compares the result with the unconstrained optimum.
+
+Usage:
+    python Assignment.py users.csv --cap 4000 --out assignment.csv
+"""
+
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from Catalog import AccessoryCatalog, SLOTS, CATALOG_PATH
+from Scoring import WEIGHTS, top_n_indices, score_block, combine, similarities
+from UserStore import open_users
+
+
+def candidate_triples(users, catalog, N=10, C=64, weights=WEIGHTS, block_size=64):
+    """
+    Best `C` Top-N triples of every user.
+
+    Returns:
+        tuple: (U, C, 3) int32 slot rows and (U, C) float32 scores, best first. Invalid
+        candidates (NaN scores) get -inf.
+    """
+    head, torso, face = catalog.matrices()
+    C = min(C, min(N, len(head)) * min(N, len(torso)) * min(N, len(face)))
+    triples = np.empty((len(users), C, 3), dtype=np.int32)
+    scores = np.empty((len(users), C), dtype=np.float32)
+    for start in range(0, len(users), block_size):
+        block = users[start:start + block_size]
+        sl = slice(start, start + len(block))
+        idx = [top_n_indices(block, slot, N) for slot in (head, torso, face)]
+        score = combine(score_block(block, *idx, head, torso, face), weights)
+        shape = score.shape[1:]
+        flat = np.where(np.isnan(score), -np.inf, score).reshape(len(block), -1)
+
+        # Best C per user; the stable sort keeps the Top-N order among ties
+        part = np.argpartition(-flat, C - 1, axis=1)[:, :C] if C < flat.shape[1] \
+            else np.broadcast_to(np.arange(flat.shape[1]), flat.shape)
+        part = np.take_along_axis(part, np.argsort(part, axis=1), axis=1)
+        order = np.argsort(-np.take_along_axis(flat, part, axis=1), axis=1, kind='stable')
+        best = np.take_along_axis(part, order, axis=1)
+        rows = np.arange(len(block))[:, None]
+        i, j, k = np.unravel_index(best, shape)
+        triples[sl] = np.stack([idx[0][rows, i], idx[1][rows, j], idx[2][rows, k]], axis=-1)
+        scores[sl] = flat[rows, best]
+    return triples, scores
+
+
+def _caps_vector(caps, catalog):
+    # Per-accessory caps in global order (Head rows, then Torso, then Face)
+    sizes = [len(catalog.slots[slot]) for slot in SLOTS]
+    if np.isscalar(caps):
+        return np.full(sum(sizes), caps, dtype=np.int64)
+    if isinstance(caps, dict):
+        default = caps.get('default', np.iinfo(np.int32).max)
+        return np.array([caps.get(f, default) for slot in SLOTS for f in catalog.slots[slot].files],
+                        dtype=np.int64)
+    caps = np.asarray(caps, dtype=np.int64)
+    if len(caps) != sum(sizes):
+        raise ValueError(f"Expected {sum(sizes)} caps, got {len(caps)}")
+    return caps
+
+
+def _adjusted(scores, slot_ids, prices):
+    # Price-adjusted candidate scores. Gathering one contiguous id array per slot is much
+    # faster than summing over a trailing axis of 3.
+    adjusted = scores - prices[slot_ids[0]]
+    adjusted -= prices[slot_ids[1]]
+    adjusted -= prices[slot_ids[2]]
+    return adjusted
+
+
+def _dual_value(scores, slot_ids, caps, prices):
+    # Lagrangian dual: an upper bound on the capped optimum for any prices >= 0
+    adjusted = _adjusted(scores, slot_ids, prices)
+    return float(adjusted.max(axis=1).sum(dtype=np.float64) + prices @ caps)
+
+
+def _price_iterations(scores, slot_ids, caps, n_iter, step):
+    # Projected subgradient on the dual; returns the prices with the lowest dual value
+    prices = np.zeros(len(caps), dtype=np.float32)
+    best_prices, best_value = prices, np.inf
+    rows = np.arange(len(scores))
+    for it in range(n_iter):
+        adjusted = _adjusted(scores, slot_ids, prices)
+        choice = adjusted.argmax(axis=1)
+        value = float(adjusted[rows, choice].sum(dtype=np.float64) + prices @ caps)
+        if value < best_value:
+            best_prices, best_value = prices, value
+
+        load = sum(np.bincount(ids[rows, choice], minlength=len(caps)) for ids in slot_ids)
+        if (load <= caps).all() and (prices[load < caps] == 0).all():
+            break  # complementary slackness: the priced choice is optimal
+        excess = np.clip((load - caps) / np.maximum(caps, 1), -1, 1)
+        prices = np.maximum(prices + step / np.sqrt(it + 1) * excess, 0).astype(np.float32)
+    return best_prices
+
+
+def assign(users, catalog, caps, N=10, C=64, weights=WEIGHTS, n_iter=50, step=0.03, price_candidates=16,
+           candidates=None):
+    """
+    Capped assignment of one (head, torso, face) triple per user.
+
+    Parameters:
+        users (np.ndarray): (U, G) user vectors.
+        catalog (AccessoryCatalog): Accessory catalog.
+        caps (int, dict or array): Copies of each accessory; an int for all of them, a dict
+            of file name -> cap (optional 'default' key), or an array in global
+            (Head, Torso, Face) row order.
+        N (int): Top-N candidates per slot.
+        C (int): Candidate triples kept per user.
+        weights (tuple): Score weights.
+        n_iter (int): Maximum price iterations.
+        step (float): Initial price step, in score units.
+        price_candidates (int): Best candidates per user seen by the price iterations (the
+            repair and the bound use all `C`).
+        candidates (tuple, optional): Precomputed `candidate_triples()` output.
+
+    Returns:
+        dict: 'head', 'torso', 'face' rows (-1 where a slot is sold out), 'score',
+        'candidate_rank' (-1 for fallback picks), 'prices' and the dual 'bound'.
+    """
+    users = np.atleast_2d(users)
+    triples, scores = candidates if candidates is not None else \
+        candidate_triples(users, catalog, N, C, weights)
+    caps = _caps_vector(caps, catalog)
+    offsets = np.cumsum([0] + [len(catalog.slots[slot]) for slot in SLOTS[:-1]])
+    for s, slot in enumerate(SLOTS):
+        stock = caps[offsets[s]:offsets[s] + len(catalog.slots[slot])].sum()
+        if stock < len(users):
+            raise ValueError(f"{slot} caps allow {stock} accessories for {len(users)} users")
+    slot_ids = [np.ascontiguousarray(triples[:, :, s] + offsets[s]) for s in range(len(SLOTS))]
+
+    # Users with invalid candidates only (constant vectors) can take anything
+    scorable = np.isfinite(scores).any(axis=1)
+    scores = np.where(scorable[:, None], scores, np.float32(0))
+    P = min(price_candidates, scores.shape[1])
+    prices = _price_iterations(np.ascontiguousarray(scores[:, :P]),
+                               [np.ascontiguousarray(ids[:, :P]) for ids in slot_ids], caps, n_iter, step)
+    bound = _dual_value(scores, slot_ids, caps, prices)
+
+    # Repair to a feasible assignment, highest regret first
+    adjusted = _adjusted(scores, slot_ids, prices)
+    order = np.argsort(-adjusted, axis=1, kind='stable')
+    top2 = np.take_along_axis(adjusted, order[:, :2], axis=1)
+    regret = top2[:, 0] - (top2[:, 1] if top2.shape[1] > 1 else -np.inf)
+    regret = np.where(np.isfinite(regret), regret, np.inf)
+
+    remaining = caps.tolist()
+    rank = np.full(len(users), -1, dtype=np.int64)
+    valid = np.isfinite(scores)
+    first_rank = order[:, 0].tolist()
+    first = np.stack([np.take_along_axis(ids, order[:, :1], axis=1)[:, 0] for ids in slot_ids], 1).tolist()
+    for u in np.argsort(-regret, kind='stable').tolist():
+        h, t, f = first[u]
+        if remaining[h] > 0 and remaining[t] > 0 and remaining[f] > 0:
+            remaining[h] -= 1
+            remaining[t] -= 1
+            remaining[f] -= 1
+            rank[u] = first_rank[u]
+            continue
+        # Best choice sold out: walk down the user's candidates
+        ranked = order[u][valid[u, order[u]]]
+        for c, (h, t, f) in zip(ranked.tolist(), np.stack([ids[u, ranked] for ids in slot_ids], 1).tolist()):
+            if remaining[h] > 0 and remaining[t] > 0 and remaining[f] > 0:
+                remaining[h] -= 1
+                remaining[t] -= 1
+                remaining[f] -= 1
+                rank[u] = c
+                break
+
+    result = {slot.lower(): np.full(len(users), -1, dtype=np.int64) for slot in SLOTS}
+    served = rank >= 0
+    chosen = triples[served, rank[served]]
+    for s, slot in enumerate(SLOTS):
+        result[slot.lower()][served] = chosen[:, s]
+    result['score'] = np.full(len(users), np.nan)
+    result['score'][served] = scores[served, rank[served]]
+    result['score'][~scorable] = np.nan
+
+    # Fallback: most similar accessory with stock left, slot by slot
+    stranded = np.flatnonzero(~served)
+    if len(stranded):
+        remaining = np.array(remaining)
+        for s, slot in enumerate(SLOTS):
+            sims = similarities(users[stranded], catalog.slots[slot])
+            for row, u in enumerate(stranded):
+                stock = remaining[offsets[s]:offsets[s] + sims.shape[1]]
+                options = np.flatnonzero(stock > 0)
+                if len(options):
+                    pick = options[sims[row, options].argmax()]
+                    stock[pick] -= 1
+                    result[slot.lower()][u] = pick
+        picks = [result[slot.lower()][stranded] for slot in SLOTS]
+        complete = np.min(picks, axis=0) >= 0
+        if complete.any():
+            score = combine(score_block(users[stranded[complete]], *(p[complete, None] for p in picks),
+                                        *catalog.matrices()), weights)
+            result['score'][stranded[complete]] = score[:, 0, 0, 0]
+
+    result['candidate_rank'] = rank
+    result['prices'] = prices
+    result['bound'] = bound
+    return result
+
+
+def assignment_report(result, scores, caps, catalog):
+    """
+    Quality of a capped assignment against the unconstrained optimum.
+
+    Parameters:
+        result (dict): Output of `assign()`.
+        scores (np.ndarray): (U, C) candidate scores; column 0 is each user's best.
+
+    Returns:
+        dict: Totals, ratios and usage statistics.
+    """
+    caps = _caps_vector(caps, catalog)
+    unconstrained = np.where(np.isfinite(scores[:, 0]), scores[:, 0], np.nan)
+    assigned = result['score']
+    rank = result['candidate_rank']
+    offsets = np.cumsum([0] + [len(catalog.slots[slot]) for slot in SLOTS[:-1]])
+    load = np.zeros(len(caps), dtype=np.int64)
+    for s, slot in enumerate(SLOTS):
+        picks = result[slot.lower()]
+        load += np.bincount(picks[picks >= 0] + offsets[s], minlength=len(caps))
+    return {
+        'users': int(len(assigned)),
+        'unconstrained_total': float(np.nansum(unconstrained)),
+        'assigned_total': float(np.nansum(assigned)),
+        'dual_bound': float(result['bound']),
+        'ratio_to_unconstrained': float(np.nansum(assigned) / np.nansum(unconstrained)),
+        'ratio_to_bound': float(np.nansum(assigned) / result['bound']),
+        'mean_loss': float(np.nanmean(unconstrained - assigned)),
+        'kept_best': float((rank == 0).mean()),
+        'fallback_users': int((rank < 0).sum()),
+        'incomplete_users': int((np.stack([result[s.lower()] for s in SLOTS]) < 0).any(0).sum()),
+        'max_load_ratio': float((load / np.maximum(caps, 1)).max()),
+        'accessories_used': int((load > 0).sum()),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Assign PET accessories under inventory caps')
+    parser.add_argument('users', help='Users CSV (UserID + one column per genre) or user store .npy')
+    parser.add_argument('--catalog', default=CATALOG_PATH)
+    parser.add_argument('--cap', type=int, required=True, help='Copies of every accessory')
+    parser.add_argument('--N', type=int, default=10)
+    parser.add_argument('--C', type=int, default=64, help='Candidate triples per user')
+    parser.add_argument('--out', default='assignment.csv')
+    opts = parser.parse_args()
+
+    store = open_users(opts.users)
+    users = store.X
+    catalog = AccessoryCatalog.from_csv(opts.catalog)
+
+    t0 = time.perf_counter()
+    triples, scores = candidate_triples(users, catalog, opts.N, opts.C)
+    t1 = time.perf_counter()
+    result = assign(users, catalog, opts.cap, candidates=(triples, scores))
+    t2 = time.perf_counter()
+    print(f"Candidates: {t1 - t0:.1f}s, assignment: {t2 - t1:.1f}s")
+    for k, v in assignment_report(result, scores, opts.cap, catalog).items():
+        print(f"{k}: {v}")
+
+    out = pd.DataFrame({'UserID': store.ids, 'score': result['score']})
+    for slot in SLOTS:
+        picks = result[slot.lower()]
+        out[slot] = np.where(picks >= 0, catalog.slots[slot].files[np.maximum(picks, 0)], '')
+    out.to_csv(opts.out, index=False)
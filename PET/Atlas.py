@@ -0,0 +1,169 @@
+"""
+Packed sprite atlas of the PET layers, for memory-mapped rendering.
+
+`pack_atlas()` trims every accessory PNG under Data/{Head,Torso,Face} to the bounding box of
+its alpha channel and writes all of them, plus the full body canvas, into one uncompressed
+file of raw RGBA bytes:
+
+    Data/atlas.rgba    sprites back to back, each starting on a 4 KiB page boundary
+    Data/atlas.json    key ('Slot|File') -> byte offset, (h, w), anchor (x, y) on the canvas,
+                       and the source file size / mtime it was packed from
+
+Each sprite is one contiguous block rather than a rectangle of a 2D sheet, so a renderer can
+wrap its slice of an `np.memmap` in a PIL image without copying. Every process maps the same
+file, so the pages are decoded zero times and shared through the page cache. The body keeps
+its full canvas (its transparent pixels still carry color that pasting blends with), so the
+output is byte-identical to compositing the PNGs.
+
+Usage:
+    python Atlas.py pack
+    python Atlas.py check
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+from PIL import Image
+from Catalog import DATA_DIR
+from Compositor import BODY, LAYER_ORDER, Layer, PetCompositor, accessory_file
+
+ATLAS_PATH = os.path.join(DATA_DIR, 'atlas.rgba')
+FORMAT_VERSION = 1
+_PAGE = 4096
+
+
+def _index_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def _key(slot, file_name):
+    return f'{slot}|{file_name}'
+
+
+def _sources(data_dir):
+    yield 'Body', os.path.basename(BODY), os.path.join(data_dir, BODY)
+    for slot in LAYER_ORDER:
+        folder = os.path.join(data_dir, slot)
+        for f in sorted(os.listdir(folder)):
+            if f.lower().endswith('.png'):
+                yield slot, f, os.path.join(folder, f)
+
+
+def pack_atlas(data_dir=DATA_DIR, path=ATLAS_PATH):
+    """
+    Trim and pack every layer into one raw RGBA file.
+
+    Returns:
+        dict: The index written next to the atlas.
+    """
+    index = {'version': FORMAT_VERSION, 'sprites': {}}
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as out:
+        for slot, file_name, source in _sources(data_dir):
+            with Image.open(source) as im:
+                im = im.convert('RGBA')
+                canvas = im.size
+                bbox = (0, 0) + canvas if slot == 'Body' else im.getchannel('A').getbbox()
+                pixels = np.asarray(im.crop(bbox)) if bbox else np.zeros((0, 0, 4), dtype=np.uint8)
+            offset = out.tell()
+            out.write(np.ascontiguousarray(pixels).tobytes())
+            out.write(b'\0' * (-out.tell() % _PAGE))
+            stat = os.stat(source)
+            index['sprites'][_key(slot, file_name)] = {
+                'offset': offset, 'shape': list(pixels.shape[:2]), 'anchor': list(bbox[:2]) if bbox else [0, 0],
+                'canvas': list(canvas), 'source_bytes': stat.st_size, 'source_mtime': stat.st_mtime}
+        index['bytes'] = out.tell()
+    os.replace(tmp, path)
+    with open(_index_path(path) + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(_index_path(path) + '.tmp', _index_path(path))
+    return index
+
+
+class SpriteAtlas:
+    """
+    Read-only, memory-mapped view of a packed atlas.
+
+    Parameters:
+        path (str): Atlas file written by `pack_atlas()`.
+    """
+
+    def __init__(self, path=ATLAS_PATH):
+        self.path = path
+        with open(_index_path(path)) as f:
+            self.index = json.load(f)
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+
+    def __contains__(self, key):
+        return key in self.index['sprites']
+
+    def array(self, key):
+        # (h, w, 4) uint8 view into the mapped file
+        entry = self.index['sprites'][key]
+        h, w = entry['shape']
+        return self.data[entry['offset']:entry['offset'] + h * w * 4].reshape(h, w, 4)
+
+    def image(self, key):
+        # PIL image sharing the mapped bytes (no copy, no decode)
+        entry = self.index['sprites'][key]
+        h, w = entry['shape']
+        if not h or not w:
+            return None
+        buf = self.data[entry['offset']:entry['offset'] + h * w * 4]
+        return Image.frombuffer('RGBA', (w, h), buf, 'raw', 'RGBA', 0, 1)
+
+    def stale(self, data_dir=DATA_DIR):
+        # Sources added, removed or modified since the atlas was packed
+        changed = []
+        current = {_key(slot, f): path for slot, f, path in _sources(data_dir)}
+        for key, path in current.items():
+            entry = self.index['sprites'].get(key)
+            stat = os.stat(path)
+            if entry is None or entry['source_bytes'] != stat.st_size or entry['source_mtime'] != stat.st_mtime:
+                changed.append(key)
+        changed += [key for key in self.index['sprites'] if key not in current]
+        return changed
+
+
+class AtlasCompositor(PetCompositor):
+    """
+    `PetCompositor` reading its layers from a memory-mapped atlas instead of PNG files.
+
+    Parameters:
+        atlas (SpriteAtlas or str): Atlas or its path.
+    """
+
+    def __init__(self, atlas=ATLAS_PATH, data_dir=DATA_DIR):
+        super().__init__(data_dir)
+        self.atlas = atlas if isinstance(atlas, SpriteAtlas) else SpriteAtlas(atlas)
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = self.atlas.image(_key('Body', os.path.basename(BODY)))
+        return self._body
+
+    def layer(self, slot, name):
+        key = _key(slot, accessory_file(name))
+        layer = self.layers.get(key)
+        if layer is None:
+            if key not in self.atlas:
+                raise FileNotFoundError(f"{key} is not in the atlas; repack it with Atlas.py pack")
+            entry = self.atlas.index['sprites'][key]
+            layer = Layer(self.atlas.image(key), tuple(entry['anchor']), tuple(entry['canvas']))
+            self.layers[key] = layer
+        return layer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Packed sprite atlas of the PET layers')
+    parser.add_argument('command', choices=['pack', 'check'])
+    opts = parser.parse_args()
+
+    if opts.command == 'pack':
+        index = pack_atlas()
+        print(f"Packed {len(index['sprites'])} sprites, {index['bytes'] / 2 ** 20:.0f} MB")
+    else:
+        stale = SpriteAtlas().stale()
+        print("Atlas is current" if not stale else f"Stale sprites: {stale}")
@@ -0,0 +1,279 @@
+"""
+Benchmark suite of the PET pipeline.
+
+For every population size (default 1k / 100k / 1M users) and catalog size (accessories per
+slot), the suite generates deterministic users with the profile mix of
+0_Real_dataset_generator.py (loaded with importlib, as its name is not importable) and a
+`synthetic_catalog()` of that size, then times each stage on its own:
+
+    generate          write the users to a binary user store (.npy, see UserStore.py)
+    user_load         open the store and read every vector
+    topn_retrieval    Top-N accessories of every user in each slot
+    combination_search  score the Top-N combinations and keep the best, per user
+    pet_compositing   pets from the real assets, at --pet-size (per pet)
+    chart_rendering   genre charts (Chart.py), per user
+    encoding          pet and combined image files (Output.py), per image
+
+Combination search costs about 1000 combinations per user, so it is timed on at most
+--search-users users of each population; the image stages do not depend on the population
+and run once per catalog size on --images items. Every record holds the stage, population,
+catalog size, items timed, the best seconds of --repeat runs and the derived rates. Results go to
+JSON (with the environment: versions, CPU count, git commit) and CSV, rewritten after every
+group of stages so an interrupted run keeps what it measured, and `--compare` prints the ratio
+of every timing against an earlier JSON. A group that fails is recorded with its error (and no
+timing) and the suite moves on.
+
+Usage:
+    python Benchmark.py --users 1000 100000 1000000 --catalog 35 100 --out bench
+    python Benchmark.py --users 1000 --compare bench.json --out bench_new
+"""
+
+import io
+import os
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import importlib.util
+import numpy as np
+import pandas as pd
+from Catalog import AccessoryCatalog, CATALOG_PATH, synthetic_catalog
+from Scoring import WEIGHTS, top_n_indices, score_block, combine
+from UserStore import UserStore
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GENERATOR_PATH = os.path.join(HERE, '0_Real_dataset_generator.py')
+
+USER_SIZES = (1_000, 100_000, 1_000_000)
+CATALOG_SIZES = (35,)
+FIELDS = ('stage', 'users', 'catalog_per_slot', 'items', 'seconds', 'per_item_us', 'items_per_s', 'error')
+
+
+def load_generator():
+    # 0_Real_dataset_generator.py as a module (its file name starts with a digit)
+    spec = importlib.util.spec_from_file_location('dataset_generator', GENERATOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _best_of(repeat, fn):
+    # Minimum seconds over `repeat` runs, and the last result
+    best, result = np.inf, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _record(stage, users, catalog_size, items, seconds):
+    return {'stage': stage, 'users': users, 'catalog_per_slot': catalog_size, 'items': items,
+            'seconds': seconds, 'per_item_us': seconds / items * 1e6 if items else None,
+            'items_per_s': items / seconds if seconds > 0 else None}
+
+
+def _error(stage, users, catalog_size, error):
+    return {'stage': stage, 'users': users, 'catalog_per_slot': catalog_size, 'items': 0,
+            'seconds': None, 'per_item_us': None, 'items_per_s': None, 'error': f'{type(error).__name__}: {error}'}
+
+
+def search(users, candidates, slots, weights=WEIGHTS, block_size=64):
+    # Best combination per user from precomputed Top-N candidates (best_combinations without
+    # its retrieval step, so both stages are timed apart)
+    best = np.empty(len(users), dtype=np.intp)
+    for start in range(0, len(users), block_size):
+        block = users[start:start + block_size]
+        idx = tuple(c[start:start + block_size] for c in candidates)
+        score = combine(score_block(block, *idx, *slots), weights)
+        best[start:start + len(block)] = np.where(np.isnan(score), -np.inf, score).reshape(len(block), -1).argmax(1)
+    return best
+
+
+def population_stages(generator, n_users, catalog, catalog_size, work_dir, N=10, search_users=20_000,
+                      repeat=1, seed=42):
+    """
+    Records of the stages that depend on the population.
+
+    Returns:
+        list: One dict per stage.
+    """
+    path = os.path.join(work_dir, f'users_{n_users}.npy')
+    records = []
+
+    def generate():
+        with contextlib.redirect_stdout(io.StringIO()):
+            generator.write_users(n_users, path, None, seed=seed)
+
+    seconds, _ = _best_of(repeat, generate)
+    records.append(_record('generate', n_users, catalog_size, n_users, seconds))
+
+    def load():
+        store = UserStore(path)
+        X = np.ascontiguousarray(store.vectors(catalog.genres), dtype=np.float64)
+        return store, X
+
+    seconds, (store, X) = _best_of(repeat, load)
+    records.append(_record('user_load', len(store), catalog_size, len(store), seconds))
+
+    slots = catalog.matrices()
+    seconds, candidates = _best_of(repeat, lambda: [top_n_indices(X, slot, N) for slot in slots])
+    records.append(_record('topn_retrieval', len(X), catalog_size, len(X), seconds))
+
+    n = min(len(X), search_users)
+    sub = [c[:n] for c in candidates]
+    seconds, _ = _best_of(repeat, lambda: search(X[:n], sub, slots))
+    records.append(_record('combination_search', len(X), catalog_size, n, seconds))
+    return records
+
+
+def image_stages(catalog_size, n_images=20, pet_size=512, repeat=1):
+    """
+    Records of pet compositing, chart rendering and encoding, on the real assets.
+
+    Returns:
+        list: One dict per stage.
+    """
+    from Pyramid import SpritePyramid
+    from Chart import chart_for, SERIES_5
+    from Output import OutputSpec
+
+    real = AccessoryCatalog.from_csv(CATALOG_PATH)
+    renderer = SpritePyramid()
+    available = {}
+    for slot in ('Head', 'Torso', 'Face'):
+        folder = os.path.join(os.path.dirname(CATALOG_PATH), slot)
+        available[slot] = [f for f in real.slots[slot].files if os.path.exists(os.path.join(folder, f))]
+    rng = np.random.default_rng(0)
+    triples = [tuple(available[s][rng.integers(len(available[s]))] for s in ('Head', 'Torso', 'Face'))
+               for _ in range(n_images)]
+    records = []
+
+    seconds, pets = _best_of(repeat, lambda: [renderer.compose(*t, size=pet_size) for t in triples])
+    records.append(_record('pet_compositing', 0, catalog_size, len(triples), seconds))
+
+    chart = chart_for(real.genres, SERIES_5, int(pets[0].width * 0.6))
+    vectors = rng.uniform(0, 1, (n_images, len(SERIES_5), len(real.genres)))
+    seconds, charts = _best_of(repeat, lambda: [chart.render(*v) for v in vectors])
+    records.append(_record('chart_rendering', 0, catalog_size, len(charts), seconds))
+
+    png, jpeg = OutputSpec('png'), OutputSpec('jpeg')
+    seconds, _ = _best_of(repeat, lambda: [(png.encode(p), jpeg.encode(c)) for p, c in zip(pets, charts)])
+    records.append(_record('encoding', 0, catalog_size, 2 * len(pets), seconds))
+    return records
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run_suite(user_sizes=USER_SIZES, catalog_sizes=CATALOG_SIZES, N=10, search_users=20_000,
+              n_images=20, pet_size=512, repeat=1, images=True, verbose=True, out=None):
+    """
+    Every stage at every population and catalog size.
+
+    Parameters:
+        out (str): When given, <out>.json and <out>.csv are rewritten after every group of stages.
+
+    Returns:
+        dict: 'environment', 'settings' and 'results' (list of records).
+    """
+    generator = load_generator()
+    settings = {'user_sizes': list(user_sizes), 'catalog_sizes': list(catalog_sizes), 'N': N,
+                'search_users': search_users, 'images': n_images if images else 0, 'pet_size': pet_size,
+                'repeat': repeat}
+    report = {'environment': environment(), 'settings': settings, 'results': []}
+
+    def run(group, users, catalog_size, fn):
+        try:
+            records = fn()
+        except Exception as e:
+            records = [_error(group, users, catalog_size, e)]
+        for record in records:
+            report['results'].append(record)
+            if verbose:
+                print(_format(record))
+        if out:
+            write_results(report, out)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for catalog_size in catalog_sizes:
+            catalog = synthetic_catalog(catalog_size, generator.GENRES, seed=catalog_size)
+            for n_users in user_sizes:
+                run('population_stages', n_users, catalog_size,
+                    lambda: population_stages(generator, n_users, catalog, catalog_size, work_dir,
+                                              N, search_users, repeat))
+                path = os.path.join(work_dir, f'users_{n_users}.npy')
+                if os.path.exists(path):
+                    os.remove(path)
+            if images:
+                run('image_stages', 0, catalog_size,
+                    lambda: image_stages(catalog_size, n_images, pet_size, repeat))
+    return report
+
+
+def _format(record):
+    if record.get('error'):
+        return (f"{record['stage']:<20} users={record['users']:<9} catalog={record['catalog_per_slot']:<5} "
+                f"failed: {record['error']}")
+    return (f"{record['stage']:<20} users={record['users']:<9} catalog={record['catalog_per_slot']:<5} "
+            f"{record['seconds']:9.4f}s  {record['per_item_us'] or 0:10.2f} us/item")
+
+
+def write_results(report, out):
+    # <out>.json (full report) and <out>.csv (one row per record), replaced atomically
+    with open(out + '.json.tmp', 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(out + '.json.tmp', out + '.json')
+    pd.DataFrame(report['results'], columns=FIELDS).to_csv(out + '.csv.tmp', index=False)
+    os.replace(out + '.csv.tmp', out + '.csv')
+
+
+def compare(report, baseline):
+    """
+    Per-item time of every record relative to a baseline report (> 1 is slower).
+
+    Returns:
+        pd.DataFrame: Timed records found in both (failed ones are left out), with the baseline
+        and current per-item times.
+    """
+    key = ['stage', 'users', 'catalog_per_slot']
+    old = pd.DataFrame(baseline['results'])[key + ['per_item_us']].dropna()
+    new = pd.DataFrame(report['results'])[key + ['per_item_us']].dropna()
+    both = new.merge(old, on=key, suffixes=('', '_baseline'))
+    both['ratio'] = both['per_item_us'] / both['per_item_us_baseline']
+    return both
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PET pipeline benchmark suite')
+    parser.add_argument('--users', type=int, nargs='+', default=list(USER_SIZES))
+    parser.add_argument('--catalog', type=int, nargs='+', default=list(CATALOG_SIZES),
+                        help='Accessories per slot of the synthetic catalog')
+    parser.add_argument('--N', type=int, default=10)
+    parser.add_argument('--search-users', type=int, default=20_000,
+                        help='Users timed in combination search, at most')
+    parser.add_argument('--images', type=int, default=20, help='Pets, charts and encodings timed')
+    parser.add_argument('--pet-size', type=int, default=512)
+    parser.add_argument('--no-images', action='store_true')
+    parser.add_argument('--repeat', type=int, default=1, help='Best of this many runs per stage')
+    parser.add_argument('--out', default='bench', help='Writes <out>.json and <out>.csv')
+    parser.add_argument('--compare', help='Earlier JSON report to compare against')
+    opts = parser.parse_args()
+
+    report = run_suite(opts.users, opts.catalog, opts.N, opts.search_users, opts.images,
+                       opts.pet_size, opts.repeat, not opts.no_images, out=opts.out)
+    print(f"Wrote {opts.out}.json and {opts.out}.csv")
+    if opts.compare:
+        with open(opts.compare) as f:
+            print(compare(report, json.load(f)).to_string(index=False))
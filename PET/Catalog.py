@@ -0,0 +1,167 @@
+"""
+Accessory catalog loaded once from PET/Data/AccessoryDataset.csv.
+
+Every slot (Head, Torso, Face) keeps its accessory vectors as a contiguous float32 matrix
+together with the terms the scoring code needs over and over (row norms, unit rows for
+cosine, centered and standardized rows for Pearson) and the name / file / image path of
+each row. The rest of the pipeline carries integer row indices into these matrices, so
+recovering the name or vector of a chosen accessory is a plain array lookup.
+"""
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from Profiler import timed
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data')
+CATALOG_PATH = os.path.join(DATA_DIR, 'AccessoryDataset.csv')
+
+SLOTS = ('Head', 'Torso', 'Face')
+
+
+def _safe_rows(X, norms):
+    out = np.zeros_like(X)
+    np.divide(X, norms[:, None], out=out, where=norms[:, None] > 0)
+    return out
+
+
+class SlotCatalog:
+    """
+    Accessories of one slot with their precomputed terms.
+
+    Attributes:
+        vectors (np.ndarray): (M, G) float32 accessory vectors.
+        norms (np.ndarray): (M,) L2 norms of the rows.
+        sq_norms (np.ndarray): (M,) squared norms of the rows.
+        unit (np.ndarray): Rows scaled to unit norm (zero rows stay zero), for cosine.
+        centered (np.ndarray): Rows minus their mean, for Pearson.
+        centered_norms (np.ndarray): (M,) norms of the centered rows.
+        standardized (np.ndarray): Centered rows scaled to unit norm. The dot product of two
+            standardized rows is their Pearson correlation.
+        names, files, image_paths (np.ndarray): Per-row accessory name (file name without
+            extension), file name and full image path.
+    """
+
+    def __init__(self, slot, vectors, files=None, data_dir=DATA_DIR):
+        self.slot = slot
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if files is None:
+            files = [f'{slot}_{i}' for i in range(len(self.vectors))]
+        self.files = np.asarray(files, dtype=object)
+        self.names = np.array([os.path.splitext(f)[0] for f in self.files], dtype=object)
+        self.image_paths = np.array([os.path.join(data_dir, slot, f) for f in self.files], dtype=object)
+        self._index = {f: i for i, f in enumerate(self.files)}
+
+        self.sq_norms = (self.vectors.astype(np.float64) ** 2).sum(1)
+        self.norms = np.sqrt(self.sq_norms)
+        self.unit = _safe_rows(self.vectors, self.norms.astype(np.float32))
+        self.centered = np.ascontiguousarray(self.vectors - self.vectors.mean(1, keepdims=True))
+        self.centered_sq_norms = (self.centered.astype(np.float64) ** 2).sum(1)
+        self.centered_norms = np.sqrt(self.centered_sq_norms)
+        self.standardized = _safe_rows(self.centered, self.centered_norms.astype(np.float32))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def vector(self, i):
+        # Row i as float64, rounded back to the precision of the CSV (hides float32 noise)
+        return self.vectors[i].astype(np.float64).round(6)
+
+    def index_of(self, file_name):
+        # Row of an accessory from its file name (with or without a '(Slot) ' prefix)
+        return self._index[file_name.split(') ')[-1]]
+
+
+def as_slot(accessories, slot=''):
+    # Lets the scoring functions accept either a SlotCatalog or a plain matrix
+    if isinstance(accessories, SlotCatalog):
+        return accessories
+    return SlotCatalog(slot, accessories)
+
+
+class AccessoryCatalog:
+    """
+    All accessory slots of the PET catalog.
+
+    Parameters:
+        df (pd.DataFrame): Accessory table with FileName, Type and one column per genre.
+        data_dir (str): Folder holding the Head/Torso/Face image folders.
+    """
+
+    def __init__(self, df, data_dir=DATA_DIR):
+        self.genres = list(df.columns[2:])
+        self.data_dir = data_dir
+        self.slots = {}
+        for slot in SLOTS:
+            rows = df[df['Type'] == slot]
+            self.slots[slot] = SlotCatalog(slot, rows[self.genres].values, rows['FileName'].values, data_dir)
+
+    @classmethod
+    @timed('load_catalog')
+    def from_csv(cls, path=CATALOG_PATH, data_dir=DATA_DIR):
+        # Some rows of the CSV have a space after the comma ('"Torso", 0.1'), which without
+        # skipinitialspace leaves them with a Type of ' "Torso"' and drops them from every slot
+        df = pd.read_csv(path, skipinitialspace=True)
+        return cls(df, data_dir)
+
+    @property
+    def head(self):
+        return self.slots['Head']
+
+    @property
+    def torso(self):
+        return self.slots['Torso']
+
+    @property
+    def face(self):
+        return self.slots['Face']
+
+    def matrices(self):
+        # (head, torso, face) slots, in the order the scoring functions take them
+        return self.head, self.torso, self.face
+
+    def fingerprint(self):
+        # Content hash of genres, file names and vectors of every slot
+        digest = hashlib.sha256('|'.join(self.genres).encode())
+        for slot in SLOTS:
+            digest.update(slot.encode())
+            digest.update('|'.join(self.slots[slot].files).encode())
+            digest.update(self.slots[slot].vectors.tobytes())
+        return digest.hexdigest()
+
+    def files_of(self, head, torso, face):
+        # File names of a (head, torso, face) index triple
+        return self.head.files[head], self.torso.files[torso], self.face.files[face]
+
+
+def synthetic_catalog(n_per_slot, genres=None, seed=0):
+    """
+    Random catalog shaped like AccessoryDataset.csv, for scaling experiments.
+
+    Each accessory has one dominant genre at 1.0 and up to three secondary genres with
+    values in 0.1 steps, like the hand-made accessories.
+
+    Parameters:
+        n_per_slot (int): Accessories per slot.
+        genres (list, optional): Genre columns; defaults to the real catalog's.
+        seed (int): Random seed.
+
+    Returns:
+        AccessoryCatalog
+    """
+    if genres is None:
+        genres = list(pd.read_csv(CATALOG_PATH, nrows=0).columns[2:])
+    rng = np.random.default_rng(seed)
+    n, G = n_per_slot * len(SLOTS), len(genres)
+    X = np.zeros((n, G))
+    rows = np.arange(n)
+    X[rows, rng.integers(0, G, n)] = 1.0
+    for _ in range(3):
+        extra = rows[rng.random(n) < 0.6]
+        g = rng.integers(0, G, len(extra))
+        X[extra, g] = np.maximum(X[extra, g], rng.integers(1, 10, len(extra)) / 10)
+    df = pd.DataFrame(X, columns=genres)
+    df.insert(0, 'Type', np.repeat(SLOTS, n_per_slot))
+    df.insert(0, 'FileName', [f'synthetic_{i}.png' for i in range(n)])
+    return AccessoryCatalog(df)
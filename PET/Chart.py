@@ -0,0 +1,181 @@
+"""
+Raster genre-comparison bar charts without a matplotlib figure per user.
+
+The charts of 1.5_Plot_Pet.py and PetEval.py only differ between users in the bar heights:
+axes, tick labels, title and legend depend on the genre list and the figure size alone.
+`GenreChart` lays them out once with matplotlib (same figure size, bar width, `tight_layout()`
+and DPI as the original plots), keeps the empty chart as an RGB array together with the pixel
+geometry of every bar slot, and then draws a user's chart by copying that template and filling
+one rectangle per bar with NumPy. The legend box is restored over the bars afterwards, as
+matplotlib draws it on top.
+
+The result is an in-memory `PIL.Image`, ready to be pasted next to the pet. No figure stays
+alive (the template uses a standalone `Figure`, never registered with pyplot), so memory is
+flat however many users are drawn. Templates are shared per (genres, series, width) by
+`chart_for()`; building one takes about as long as one matplotlib chart.
+
+Usage:
+    python Chart.py --users 200
+"""
+
+import time
+import argparse
+from functools import lru_cache
+import numpy as np
+from PIL import Image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import to_rgb
+
+# (legend label, color) of each bar series, in drawing order
+SERIES_5 = (('User', 'b'), ('Torso', 'r'), ('Head', 'y'), ('Face', 'purple'), ('Accessories (Avg)', 'g'))
+SERIES_2 = (('User', 'b'), ('Accessories', 'r'))
+
+# Figure size (inches) and bar width of the original plot_genres_5 / plot_genres_2
+LAYOUTS = {SERIES_5: ((12, 6), 0.15), SERIES_2: ((10, 6), 0.35)}
+
+TITLE = 'Comparison of User and Accessory Genres'
+Y_MAX = 1.05  # Affinities are in [0, 1]; matplotlib's 5% margin over 1.0
+
+
+class GenreChart:
+    """
+    Pre-rendered grouped bar chart of genre affinities.
+
+    Parameters:
+        genres (list): Genre labels of the x axis.
+        series (tuple): (label, color) of each bar series; `SERIES_5` or `SERIES_2`.
+        width (int, optional): Output width in pixels; None keeps matplotlib's default 100 DPI.
+    """
+
+    def __init__(self, genres, series=SERIES_5, width=None):
+        self.genres = list(genres)
+        self.series = tuple(series)
+        figsize, bar_width = LAYOUTS.get(self.series, ((12, 6), 0.8 / len(self.series)))
+        dpi = 100 if width is None else width / figsize[0]
+
+        fig = Figure(figsize=figsize, dpi=dpi)
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot(1, 1, 1)
+        index = np.arange(len(self.genres))
+        for k, (label, color) in enumerate(self.series):
+            # Zero-height bars give the legend its handles and the x axis its extent
+            ax.bar(index + k * bar_width, np.zeros(len(index)), bar_width, label=label, color=color)
+        ax.set_xlabel('Genres')
+        ax.set_ylabel('Values')
+        ax.set_title(TITLE)
+        ax.set_xticks(index + 2 * bar_width)
+        ax.set_xticklabels(self.genres, rotation=90)
+        ax.set_ylim(0, Y_MAX)
+        legend = ax.legend(loc='upper right')
+        fig.tight_layout()
+        canvas.draw()
+
+        self.template = np.asarray(canvas.buffer_rgba())[..., :3].copy()
+        height = self.template.shape[0]
+
+        # Pixel columns of every bar (series x genre) and the rows of the value axis
+        lefts = (index[None, :] + np.arange(len(self.series))[:, None] * bar_width - bar_width / 2).ravel()
+        xs = ax.transData.transform(np.column_stack([np.r_[lefts, lefts + bar_width], np.zeros(2 * len(lefts))]))[:, 0]
+        self.x0 = np.round(xs[:len(lefts)]).astype(int).reshape(len(self.series), -1)
+        self.x1 = np.maximum(np.round(xs[len(lefts):]).astype(int).reshape(len(self.series), -1), self.x0 + 1)
+        base, top = ax.transData.transform([(0, 0), (0, Y_MAX)])[:, 1]
+        self.base = int(round(height - base))
+        self.top = int(round(height - top)) + 1  # below the top spine
+        self.scale = (top - base) / Y_MAX  # pixels per unit
+        self.colors = [np.array([round(255 * c) for c in to_rgb(color)], dtype=np.uint8)
+                       for _, color in self.series]
+
+        # Legend box, redrawn over the bars
+        box = legend.get_window_extent(canvas.get_renderer())
+        self.legend = (slice(int(height - box.y1), int(np.ceil(height - box.y0))),
+                       slice(int(box.x0), int(np.ceil(box.x1))))
+        self.size = (self.template.shape[1], height)
+
+    def render(self, *values):
+        """
+        Chart of one user.
+
+        Parameters:
+            *values (array-like): One vector of genre values per series, in series order;
+                NaN values (an unserved slot) draw no bar.
+
+        Returns:
+            PIL.Image.Image: RGB chart.
+        """
+        if len(values) != len(self.series):
+            raise ValueError(f"Expected {len(self.series)} value vectors, got {len(values)}")
+        canvas = self.template.copy()
+        for k, vector in enumerate(values):
+            vector = np.clip(np.nan_to_num(np.asarray(vector, dtype=np.float64), nan=0.0), 0, Y_MAX)
+            if len(vector) != len(self.genres):
+                raise ValueError(f"Expected {len(self.genres)} genre values, got {len(vector)}")
+            tops = np.maximum(np.round(self.base - vector * self.scale).astype(int), self.top)
+            color = self.colors[k]
+            for x0, x1, y in zip(self.x0[k], self.x1[k], tops):
+                if y < self.base:
+                    canvas[y:self.base, x0:x1] = color
+        canvas[self.legend] = self.template[self.legend]
+        return Image.fromarray(canvas, 'RGB')
+
+
+@lru_cache(maxsize=16)
+def _chart(genres, series, width):
+    return GenreChart(genres, series, width)
+
+
+def chart_for(genres, series=SERIES_5, width=None):
+    # Shared template per genre list, series and width
+    return _chart(tuple(genres), tuple(series), width)
+
+
+def benchmark(n_users=200, genres=None, seed=0):
+    """
+    Seconds per chart of the matplotlib path (new figure, PNG encode, close) against the
+    template renderer, with and without encoding its PNG.
+
+    Returns:
+        dict: Per-chart seconds and speedups.
+    """
+    import io
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    genres = genres or [f'Genre {i}' for i in range(18)]
+    rng = np.random.default_rng(seed)
+    data = rng.uniform(0, 1, (n_users, len(SERIES_5), len(genres)))
+    index = np.arange(len(genres))
+    n_plt = max(1, n_users // 10)
+
+    t0 = time.perf_counter()
+    for values in data[:n_plt]:
+        fig, ax = plt.subplots(figsize=(12, 6))
+        for k, (label, color) in enumerate(SERIES_5):
+            ax.bar(index + k * 0.15, values[k], 0.15, label=label, color=color)
+        ax.set_xticks(index + 0.3)
+        ax.set_xticklabels(genres, rotation=90)
+        ax.legend()
+        fig.tight_layout()
+        fig.savefig(io.BytesIO(), format='png')
+        plt.close(fig)
+    plt_s = (time.perf_counter() - t0) / n_plt
+
+    chart = chart_for(genres)
+    t0 = time.perf_counter()
+    for values in data:
+        chart.render(*values)
+    render_s = (time.perf_counter() - t0) / n_users
+    t0 = time.perf_counter()
+    for values in data:
+        chart.render(*values).save(io.BytesIO(), format='PNG')
+    encode_s = (time.perf_counter() - t0) / n_users
+    return {'matplotlib_s': plt_s, 'render_s': render_s, 'render_png_s': encode_s,
+            'speedup': plt_s / render_s, 'speedup_png': plt_s / encode_s}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Genre chart renderer benchmark')
+    parser.add_argument('--users', type=int, default=200)
+    opts = parser.parse_args()
+    print(benchmark(opts.users))
@@ -0,0 +1,140 @@
+"""
+Pet image compositing from cached, cropped layers.
+
+Every accessory PNG is a full 3780x3780 RGBA canvas, mostly transparent. `PetCompositor`
+decodes each layer once, crops it to the bounding box of its alpha channel and remembers
+the offset of the crop. A pet is then a copy of the cached body with the three crops pasted
+at their offsets, so the work per accessory is proportional to its visible area instead of
+the canvas. Pixels outside the bounding box have alpha 0, which the full-canvas paste left
+untouched, so the result is identical to the original `create_pet_image()`. An empty name
+(a slot left unserved, see Assignment.py) adds no layer.
+"""
+
+import os
+import numpy as np
+from PIL import Image
+from Catalog import DATA_DIR
+from Profiler import timed
+
+BODY = os.path.join('Body', 'RockyBoi.png')
+
+# Paste order of the accessories, bottom to top
+LAYER_ORDER = ('Torso', 'Head', 'Face')
+
+
+class Layer:
+    """
+    One decoded accessory, cropped to its visible pixels.
+
+    Attributes:
+        image (PIL.Image.Image): RGBA crop (None if the layer is fully transparent).
+        offset (tuple): (x, y) of the crop on the canvas.
+        canvas_size (tuple): (width, height) of the original image.
+    """
+
+    def __init__(self, image, offset, canvas_size):
+        self.image = image
+        self.offset = offset
+        self.canvas_size = canvas_size
+
+    @classmethod
+    @timed('decode_image')
+    def from_file(cls, path):
+        with Image.open(path) as im:
+            im = im.convert('RGBA')
+            bbox = im.getchannel('A').getbbox()
+            crop = im.crop(bbox) if bbox else None
+            if crop is not None:
+                crop.load()
+            return cls(crop, bbox[:2] if bbox else (0, 0), im.size)
+
+    @property
+    def array(self):
+        # (h, w, 4) uint8 view of the crop
+        if self.image is None:
+            return np.zeros((0, 0, 4), dtype=np.uint8)
+        return np.asarray(self.image)
+
+    @property
+    def area(self):
+        return 0 if self.image is None else self.image.width * self.image.height
+
+
+def accessory_file(name):
+    # Remove the prefix like '(Torso) ' from the name
+    return name.split(') ')[-1]
+
+
+class PetCompositor:
+    """
+    Builds pet images from layers decoded once and kept in memory.
+
+    Parameters:
+        data_dir (str): Folder with Body/, Head/, Torso/ and Face/.
+        body (str): Base image, relative to `data_dir`.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, body=BODY):
+        self.data_dir = data_dir
+        self.body_path = os.path.join(data_dir, body)
+        self.layers = {}
+        self._body = None
+
+    @property
+    def body(self):
+        if self._body is None:
+            with Image.open(self.body_path) as im:
+                self._body = im.convert('RGBA')
+        return self._body
+
+    def layer(self, slot, name):
+        """
+        Cached layer of an accessory.
+
+        Parameters:
+            slot (str): 'Head', 'Torso' or 'Face'.
+            name (str): File name, optionally prefixed like '(Head) '.
+        """
+        key = (slot, accessory_file(name))
+        layer = self.layers.get(key)
+        if layer is None:
+            layer = Layer.from_file(os.path.join(self.data_dir, slot, key[1]))
+            self.layers[key] = layer
+        return layer
+
+    def preload(self, catalog):
+        # Decode every accessory of the catalog that has an image on disk
+        missing = []
+        for slot in LAYER_ORDER:
+            for f in catalog.slots[slot].files:
+                try:
+                    self.layer(slot, f)
+                except FileNotFoundError:
+                    missing.append(os.path.join(slot, f))
+        return missing
+
+    def compose(self, head_name, torso_name, face_name):
+        """
+        Pet image for one accessory combination.
+
+        Returns:
+            PIL.Image.Image: Body with torso, head and face pasted in that order (slots
+            with an empty name are left out).
+        """
+        pet = self.body.copy()
+        names = {'Head': head_name, 'Torso': torso_name, 'Face': face_name}
+        for slot in LAYER_ORDER:
+            if not names[slot]:
+                continue
+            layer = self.layer(slot, names[slot])
+            if layer.image is not None:
+                pet.paste(layer.image, layer.offset, layer.image)
+        return pet
+
+    def stats(self):
+        # Cached layers and their share of the full canvas area
+        canvas = self.body.width * self.body.height
+        areas = [layer.area for layer in self.layers.values()]
+        return {'layers': len(areas),
+                'mean_area_ratio': float(np.mean(areas) / canvas) if areas else 0.0,
+                'cached_mb': sum(areas) * 4 / 2 ** 20}
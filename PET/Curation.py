@@ -0,0 +1,350 @@
+"""
+Catalog curation analytics over recommendation results.
+
+Which accessories never win, which dominate, and which user types pick what? `ResultStats`
+answers that from result files of any size (see Results.py), read chunk by chunk into
+fixed-size accumulators, so memory depends on the catalog and not on the population:
+
+- wins per accessory of every slot, in total and per user type (the types of
+  0.5_Dataset_analysis.py, from `Analysis.classify()` on the users' vectors);
+- co-occurrence matrices of every slot pair (head x torso, head x face, torso x face), and
+  of whole (head, torso, face) triples while the catalog has at most `max_triples` of them;
+- score histograms per user type (fixed bins, so chunks simply add up) with count, mean,
+  standard deviation, min and max.
+
+Accumulators of separate runs (e.g. one per results shard) combine with `merge()`.
+`report()` summarizes them: dead accessories (never selected), the dominant ones, the
+effective number of accessories per slot (1 / sum of squared win shares), the most common
+triples and score quantiles per user type. `plot()` draws the figures once, at the end.
+
+Rows of unserved slots (see Assignment.py) count in no slot, and NaN scores only in
+`nan_scores`.
+
+Usage:
+    python Curation.py 1_DResultados.csv --users 0_Diverse_users_100k.csv \\
+        --catalog 1_AccessoryDataset.csv --out curation
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+from Catalog import SLOTS
+from Results import INDEX_COLUMNS, iter_results
+from Analysis import USER_TYPES, classify
+
+PAIRS = (('Head', 'Torso'), ('Head', 'Face'), ('Torso', 'Face'))
+SCORE_BINS = np.linspace(-1.0, 1.0, 401)  # Scores are weighted means of terms in [-1, 1]
+
+
+class ResultStats:
+    """
+    Constant-memory accumulators of recommendation results.
+
+    Parameters:
+        catalog (AccessoryCatalog): Catalog the result rows index into.
+        bins (np.ndarray): Edges of the score histograms.
+        max_triples (int): Largest catalog (head x torso x face count) whose triple
+            co-occurrence is kept.
+    """
+
+    def __init__(self, catalog, bins=SCORE_BINS, max_triples=10_000_000):
+        self.catalog = catalog
+        self.sizes = {slot: len(catalog.slots[slot]) for slot in SLOTS}
+        self.bins = np.asarray(bins, dtype=np.float64)
+        n_types = len(USER_TYPES)
+        self.users = 0
+        self.nan_scores = 0
+        self.type_counts = np.zeros(n_types, dtype=np.int64)
+        self.wins = {slot: np.zeros((n_types, m), dtype=np.int64) for slot, m in self.sizes.items()}
+        self.pairs = {pair: np.zeros((self.sizes[pair[0]], self.sizes[pair[1]]), dtype=np.int64)
+                      for pair in PAIRS}
+        shape = tuple(self.sizes[slot] for slot in SLOTS)
+        self.triples = np.zeros(shape, dtype=np.int64) if np.prod(shape) <= max_triples else None
+        self.hist = np.zeros((n_types, len(self.bins) - 1), dtype=np.int64)
+        self.score_sum = np.zeros(n_types)
+        self.score_sq = np.zeros(n_types)
+        self.score_min = np.full(n_types, np.inf)
+        self.score_max = np.full(n_types, -np.inf)
+
+    # ------------------------------------------------------------------
+    # Accumulation
+    # ------------------------------------------------------------------
+    def update(self, df, codes):
+        """
+        Add one chunk of results.
+
+        Parameters:
+            df (pd.DataFrame): Result rows (see Results.COLUMNS).
+            codes (np.ndarray): User type (index into USER_TYPES) of every row.
+        """
+        codes = np.asarray(codes, dtype=np.intp)
+        n_types = len(USER_TYPES)
+        idx = {slot: df[col].to_numpy().astype(np.intp) for slot, col in zip(SLOTS, INDEX_COLUMNS)}
+        self.users += len(df)
+        self.type_counts += np.bincount(codes, minlength=n_types)
+
+        # Wins per (type, accessory) as one bincount over flattened indices
+        for slot, rows in idx.items():
+            m, ok = self.sizes[slot], rows >= 0
+            self.wins[slot] += np.bincount(codes[ok] * m + rows[ok], minlength=n_types * m).reshape(n_types, m)
+        for a, b in PAIRS:
+            ok = (idx[a] >= 0) & (idx[b] >= 0)
+            nb = self.sizes[b]
+            self.pairs[(a, b)] += np.bincount(idx[a][ok] * nb + idx[b][ok],
+                                              minlength=self.sizes[a] * nb).reshape(self.sizes[a], nb)
+        if self.triples is not None:
+            h, t, f = (idx[slot] for slot in SLOTS)
+            ok = (h >= 0) & (t >= 0) & (f >= 0)
+            flat = np.ravel_multi_index((h[ok], t[ok], f[ok]), self.triples.shape)
+            self.triples += np.bincount(flat, minlength=self.triples.size).reshape(self.triples.shape)
+
+        # Score distribution per type; out-of-range scores go to the outer bins
+        scores = df['Score'].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(scores)
+        self.nan_scores += int((~valid).sum())
+        scores, codes = scores[valid], codes[valid]
+        n_bins = len(self.bins) - 1
+        bin_idx = np.clip(np.searchsorted(self.bins, scores, side='right') - 1, 0, n_bins - 1)
+        self.hist += np.bincount(codes * n_bins + bin_idx, minlength=n_types * n_bins).reshape(n_types, n_bins)
+        self.score_sum += np.bincount(codes, scores, minlength=n_types)
+        self.score_sq += np.bincount(codes, scores ** 2, minlength=n_types)
+        if len(scores):
+            np.minimum.at(self.score_min, codes, scores)
+            np.maximum.at(self.score_max, codes, scores)
+
+    def merge(self, other):
+        # Adds the accumulators of another ResultStats over the same catalog and bins
+        if other.sizes != self.sizes or not np.array_equal(other.bins, self.bins):
+            raise ValueError("Cannot merge statistics of different catalogs or score bins")
+        self.users += other.users
+        self.nan_scores += other.nan_scores
+        self.type_counts += other.type_counts
+        for slot in SLOTS:
+            self.wins[slot] += other.wins[slot]
+        for pair in PAIRS:
+            self.pairs[pair] += other.pairs[pair]
+        if self.triples is not None and other.triples is not None:
+            self.triples += other.triples
+        else:
+            self.triples = None
+        self.hist += other.hist
+        self.score_sum += other.score_sum
+        self.score_sq += other.score_sq
+        self.score_min = np.minimum(self.score_min, other.score_min)
+        self.score_max = np.maximum(self.score_max, other.score_max)
+        return self
+
+    # ------------------------------------------------------------------
+    # Report
+    # ------------------------------------------------------------------
+    def _quantiles(self, hist, qs=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        # Quantiles interpolated within the histogram bins
+        total = hist.sum()
+        if not total:
+            return {f'p{round(q * 100)}': None for q in qs}
+        cdf = np.concatenate([[0], np.cumsum(hist)]) / total
+        return {f'p{round(q * 100)}': float(np.interp(q, cdf, self.bins)) for q in qs}
+
+    def report(self, top=5, dominant_share=None):
+        """
+        Curation summary.
+
+        Parameters:
+            top (int): Accessories and triples listed as the most selected.
+            dominant_share (float, optional): Win share above which an accessory is dominant;
+                defaults to three times a uniform share (3 / slot size).
+
+        Returns:
+            dict: 'users', 'user_types', 'slots' (per slot: wins, dead, dominant, top,
+            effective count, choices per user type), 'top_triples' and 'scores'.
+        """
+        slots = {}
+        for slot in SLOTS:
+            files = self.catalog.slots[slot].files
+            wins = self.wins[slot].sum(0)
+            total = wins.sum()
+            share = wins / total if total else np.zeros(len(wins))
+            threshold = dominant_share if dominant_share is not None else 3 / len(wins)
+            order = np.argsort(-wins, kind='stable')
+            slots[slot] = {
+                'accessories': len(wins),
+                'wins': dict(zip(files.tolist(), wins.tolist())),
+                'dead': files[wins == 0].tolist(),
+                'dominant': [{'name': files[i], 'share': float(share[i])} for i in order if share[i] > threshold],
+                'top': [{'name': files[i], 'wins': int(wins[i]), 'share': float(share[i])}
+                        for i in order[:top] if wins[i]],
+                'effective_accessories': float(1 / (share ** 2).sum()) if total else 0.0,
+                'top_by_type': {USER_TYPES[t]: files[int(np.argmax(self.wins[slot][t]))]
+                                for t in range(len(USER_TYPES)) if self.wins[slot][t].any()},
+            }
+
+        top_triples = []
+        if self.triples is not None:
+            flat = self.triples.ravel()
+            for i in np.argsort(-flat, kind='stable')[:top]:
+                if not flat[i]:
+                    break
+                h, t, f = np.unravel_index(i, self.triples.shape)
+                top_triples.append({'triple': self.catalog.files_of(h, t, f), 'users': int(flat[i])})
+
+        scores = {}
+        for t, name in enumerate(USER_TYPES):
+            n = int(self.hist[t].sum())
+            mean = float(self.score_sum[t] / n) if n else None
+            std = float(np.sqrt(max(self.score_sq[t] / n - mean ** 2, 0))) if n else None
+            scores[name] = {'users': n, 'mean': mean, 'std': std,
+                            'min': float(self.score_min[t]) if n else None,
+                            'max': float(self.score_max[t]) if n else None, **self._quantiles(self.hist[t])}
+
+        return {'users': self.users, 'nan_scores': self.nan_scores,
+                'user_types': dict(zip(USER_TYPES, self.type_counts.tolist())),
+                'slots': slots, 'top_triples': top_triples, 'scores': scores}
+
+    # ------------------------------------------------------------------
+    # Plots
+    # ------------------------------------------------------------------
+    def plot(self, out_dir, dpi=150):
+        """
+        Figures of the accumulated statistics, as PNG files in `out_dir`.
+
+        Returns:
+            list: Paths of the written figures.
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib import colormaps
+
+        colors = colormaps['Set2'].colors  # No red, which marks dead accessories
+
+        os.makedirs(out_dir, exist_ok=True)
+        paths = []
+
+        def save(fig, name):
+            FigureCanvasAgg(fig)
+            fig.tight_layout()
+            path = os.path.join(out_dir, name)
+            fig.savefig(path, dpi=dpi)
+            paths.append(path)
+
+        # Wins per accessory, stacked by user type; dead accessories in red
+        fig = Figure(figsize=(16, 12))
+        for k, slot in enumerate(SLOTS):
+            ax = fig.add_subplot(len(SLOTS), 1, k + 1)
+            files = self.catalog.slots[slot].files
+            bottom = np.zeros(len(files))
+            for t, name in enumerate(USER_TYPES):
+                ax.bar(np.arange(len(files)), self.wins[slot][t], bottom=bottom, label=name, color=colors[t])
+                bottom += self.wins[slot][t]
+            ax.set_xticks(np.arange(len(files)))
+            ax.set_xticklabels([os.path.splitext(f)[0] for f in files], rotation=90, fontsize=7)
+            for label, wins in zip(ax.get_xticklabels(), bottom):
+                if wins == 0:
+                    label.set_color('red')
+            ax.set_title(f"{slot}: wins per accessory (red: never selected)")
+            ax.set_ylabel("Users")
+        fig.axes[0].legend(fontsize=8)
+        save(fig, 'wins.png')
+
+        # Co-occurrence of every slot pair
+        fig = Figure(figsize=(18, 6))
+        for k, (a, b) in enumerate(PAIRS):
+            ax = fig.add_subplot(1, len(PAIRS), k + 1)
+            image = ax.imshow(np.log1p(self.pairs[(a, b)]), aspect='auto', cmap='viridis')
+            ax.set_title(f"{a} x {b} (log users)")
+            ax.set_xlabel(f"{b} row")
+            ax.set_ylabel(f"{a} row")
+            fig.colorbar(image, ax=ax)
+        save(fig, 'cooccurrence.png')
+
+        # Share of each accessory within each user type
+        fig = Figure(figsize=(16, 8))
+        for k, slot in enumerate(SLOTS):
+            ax = fig.add_subplot(len(SLOTS), 1, k + 1)
+            counts = self.wins[slot]
+            share = counts / np.maximum(counts.sum(1, keepdims=True), 1)
+            image = ax.imshow(share, aspect='auto', cmap='magma', vmin=0, vmax=1)
+            ax.set_yticks(np.arange(len(USER_TYPES)))
+            ax.set_yticklabels(USER_TYPES, fontsize=8)
+            ax.set_title(f"{slot}: share of each accessory per user type")
+            fig.colorbar(image, ax=ax)
+        save(fig, 'types.png')
+
+        # Score distribution per user type
+        fig = Figure(figsize=(10, 6))
+        ax = fig.add_subplot(1, 1, 1)
+        centers = (self.bins[:-1] + self.bins[1:]) / 2
+        for t, name in enumerate(USER_TYPES):
+            if self.hist[t].any():
+                ax.plot(centers, self.hist[t] / self.hist[t].sum(), label=f"{name} ({self.hist[t].sum()})",
+                        color=colors[t])
+        used = np.flatnonzero(self.hist.sum(0))
+        if len(used):
+            ax.set_xlim(self.bins[used[0]], self.bins[used[-1] + 1])
+        ax.set_title("Score distribution per user type")
+        ax.set_xlabel("Score")
+        ax.set_ylabel("Share of users")
+        ax.legend()
+        ax.grid(True)
+        save(fig, 'scores.png')
+        return paths
+
+
+def analyze(results_path, catalog, users, chunk_size=1_000_000):
+    """
+    Statistics of a results file, read in chunks; user types come from the user store.
+
+    Returns:
+        ResultStats: The accumulated statistics.
+    """
+    stats = ResultStats(catalog)
+    for df in iter_results(results_path, chunk_size, catalog):
+        rows = users.rows(df['UserID'].to_numpy())
+        if (rows < 0).any():
+            raise KeyError(f"{df['UserID'].to_numpy()[rows < 0][0]} is not in {users.path}")
+        # Rows read in file order, which is sequential on the memory map
+        order = np.argsort(rows, kind='stable')
+        codes = np.empty(len(rows), dtype=np.int8)
+        codes[order] = classify(users.X[rows[order]])
+        stats.update(df, codes)
+    return stats
+
+
+def format_report(report):
+    # Text summary of a report
+    lines = [f"{report['users']} users: " + ', '.join(f'{k} {v}' for k, v in report['user_types'].items())]
+    for slot, s in report['slots'].items():
+        top = ', '.join(f"{a['name']} {a['share']:.0%}" for a in s['top'])
+        lines.append(f"{slot}: {s['accessories']} accessories, {len(s['dead'])} never selected, "
+                     f"effective {s['effective_accessories']:.1f}; top {top}")
+        if s['dead']:
+            lines.append(f"  dead: {', '.join(s['dead'])}")
+    for name, s in report['scores'].items():
+        if s['users']:
+            lines.append(f"{name}: score mean {s['mean']:.3f} (p5 {s['p5']:.3f}, p50 {s['p50']:.3f}, "
+                         f"p95 {s['p95']:.3f}) over {s['users']} users")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from Catalog import AccessoryCatalog, CATALOG_PATH
+    from UserStore import open_users
+
+    parser = argparse.ArgumentParser(description='Catalog curation analytics over PET results')
+    parser.add_argument('results', help='Results file of 1_TopN.py (.csv, .parquet or .npz)')
+    parser.add_argument('--users', required=True, help='Users CSV or user store .npy the results came from')
+    parser.add_argument('--catalog', default=CATALOG_PATH)
+    parser.add_argument('--chunk-size', type=int, default=1_000_000)
+    parser.add_argument('--out', default='curation', help='Folder of report.json and the figures')
+    parser.add_argument('--no-plots', action='store_true')
+    opts = parser.parse_args()
+
+    stats = analyze(opts.results, AccessoryCatalog.from_csv(opts.catalog), open_users(opts.users),
+                    opts.chunk_size)
+    report = stats.report()
+    os.makedirs(opts.out, exist_ok=True)
+    with open(os.path.join(opts.out, 'report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(format_report(report))
+    if not opts.no_plots:
+        print(f"Figures: {', '.join(stats.plot(opts.out))}")
@@ -0,0 +1,263 @@
+"""
+Exact best-combination search over the whole accessory catalog.
+
+The Top-N search in 1_TopN.py only combines the N most cosine-similar accessories of each
+slot, so the true optimum of the combined score can be missed. `BranchAndBoundSolver`
+explores head -> torso -> face and discards every branch whose upper bound cannot beat the
+best score found so far. Leaves (all faces of a surviving (head, torso) pair) are scored
+exactly as array operations.
+
+Upper bounds per component, for a branch with some slots still free:
+- cos / Pearson of the combo: the numerator is a sum of per-accessory dot products (bounded
+  by the max over the free slots) and the squared norm of the combo is bounded from below
+  with catalog-level minima of the Gram terms.
+- w_error_score: each genre of the combo lies in an interval given by the per-genre min/max
+  of the free slots, so the error is at least the distance from the user to that interval.
+- min_sim / min_corr: the fixed accessories' terms and the max over the free slots.
+"""
+
+import numpy as np
+from Catalog import as_slot
+from Scoring import WEIGHTS, COMPONENTS, best_combinations
+
+# Slack added to every bound so rounding never prunes the optimum
+_EPS = 1e-9
+
+
+def _centered(X):
+    return X - X.mean(axis=-1, keepdims=True)
+
+
+def _ratio_bound(num_ub, den_sq_lb, norm_u):
+    # Upper bound of num / (norm_u * sqrt(den_sq)) given num <= num_ub and den_sq >= den_sq_lb
+    num_ub, den_sq_lb = np.broadcast_arrays(num_ub, den_sq_lb)
+    ub = np.ones(num_ub.shape)
+    ub[num_ub <= 0] = 0.0
+    ok = (num_ub > 0) & (den_sq_lb > 0)
+    if norm_u > 0:
+        ub[ok] = np.minimum(1.0, num_ub[ok] / (norm_u * np.sqrt(den_sq_lb[ok])))
+    else:
+        ub[:] = 0.0
+    return ub + _EPS
+
+
+def _error_bound(u, lo, hi):
+    # Lower bound of sum(|u - c| * u) when every genre of c lies in [lo, hi]
+    gap = np.maximum(np.maximum(lo - u, u - hi), 0)
+    return (gap * u).sum(-1)
+
+
+class _Slot:
+    # Per-slot terms that do not depend on the user, in float64
+    def __init__(self, slot):
+        self.catalog = as_slot(slot)
+        self.raw = self.catalog.vectors.astype(np.float64)
+        self.cen = self.catalog.centered.astype(np.float64)
+        self.sq = self.catalog.sq_norms
+        self.sq_c = self.catalog.centered_sq_norms
+        self.lo = self.raw.min(0)
+        self.hi = self.raw.max(0)
+
+
+class BranchAndBoundSolver:
+    """
+    Exact best (head, torso, face) search with branch-and-bound pruning.
+
+    Parameters:
+        head, torso, face (SlotCatalog or np.ndarray): Accessories per slot.
+        weights (tuple): Score weights (p1, p2, p3, p4).
+        chunk (int): Torsos of one head scored together at the leaf level.
+    """
+
+    def __init__(self, head, torso, face, weights=WEIGHTS, chunk=8):
+        self.weights = tuple(weights)
+        self.chunk = chunk
+        self.H, self.T, self.F = _Slot(head), _Slot(torso), _Slot(face)
+        H, T, F = self.H, self.T, self.F
+
+        # Gram terms between slots, raw and centered
+        self.HT, self.HF, self.TF = H.raw @ T.raw.T, H.raw @ F.raw.T, T.raw @ F.raw.T
+        self.HTc, self.HFc, self.TFc = H.cen @ T.cen.T, H.cen @ F.cen.T, T.cen @ F.cen.T
+
+        # Lower bounds of the squared combo norm once the head (and torso) is fixed
+        self.min_t_given_h = (T.sq[None, :] + 2 * self.HT).min(1)
+        self.min_f_given_h = (F.sq[None, :] + 2 * self.HF).min(1)
+        self.min_tf = 2 * self.TF.min()
+        self.min_f_given_t = (2 * self.TF).min(1)
+        self.min_t_given_h_c = (T.sq_c[None, :] + 2 * self.HTc).min(1)
+        self.min_f_given_h_c = (F.sq_c[None, :] + 2 * self.HFc).min(1)
+        self.min_tf_c = 2 * self.TFc.min()
+        self.min_f_given_t_c = (2 * self.TFc).min(1)
+
+        self.total = len(H.raw) * len(T.raw) * len(F.raw)
+
+    # ------------------------------------------------------------------
+    # Per-user terms
+    # ------------------------------------------------------------------
+    def _user_terms(self, u):
+        uc = _centered(u)
+        terms = {'u': u, 'norm': np.linalg.norm(u), 'norm_c': np.linalg.norm(uc), 'sum': u.sum()}
+        for key, slot in (('h', self.H), ('t', self.T), ('f', self.F)):
+            dot, dot_c = slot.raw @ u, slot.cen @ uc
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sim = np.where(slot.sq > 0, dot / (terms['norm'] * np.sqrt(slot.sq)), 0.0)
+                corr = dot_c / (terms['norm_c'] * np.sqrt(slot.sq_c))
+            if terms['norm'] == 0:
+                sim = np.zeros_like(dot)
+            terms[key] = (dot, dot_c, sim, corr)
+        return terms
+
+    # ------------------------------------------------------------------
+    # Bounds
+    # ------------------------------------------------------------------
+    def _head_bounds(self, t):
+        H, T, F = self.H, self.T, self.F
+        dh, dhc, sh, rh = t['h']
+        dt, dtc, st, rt = t['t']
+        df, dfc, sf, rf = t['f']
+        p1, p2, p3, p4 = self.weights
+
+        cos_ub = _ratio_bound(dh + dt.max() + df.max(),
+                              H.sq + self.min_t_given_h + self.min_f_given_h + self.min_tf, t['norm'])
+        pear_ub = _ratio_bound(dhc + dtc.max() + dfc.max(),
+                               H.sq_c + self.min_t_given_h_c + self.min_f_given_h_c + self.min_tf_c,
+                               t['norm_c'])
+        err_lb = _error_bound(t['u'], (H.raw + T.lo + F.lo) / 3, (H.raw + T.hi + F.hi) / 3)
+        w_err_ub = 1 - err_lb / t['sum'] if t['sum'] > 0 else np.ones(len(H.raw))
+        min_sim_ub = np.minimum(sh, min(st.max(), sf.max()))
+        min_corr_ub = np.minimum(rh, min(np.nanmax(rt), np.nanmax(rf)))
+        ub = p1 * (cos_ub + pear_ub) / 2 + p2 * w_err_ub + p3 * min_sim_ub + p4 * min_corr_ub + _EPS
+        return np.where(np.isnan(ub), -np.inf, ub)
+
+    def _pair_bounds(self, t, h):
+        H, T, F = self.H, self.T, self.F
+        dh, dhc, sh, rh = t['h']
+        dt, dtc, st, rt = t['t']
+        df, dfc, sf, rf = t['f']
+        p1, p2, p3, p4 = self.weights
+
+        cos_ub = _ratio_bound(dh[h] + dt + df.max(),
+                              H.sq[h] + T.sq + 2 * self.HT[h] + self.min_f_given_h[h] + self.min_f_given_t,
+                              t['norm'])
+        pear_ub = _ratio_bound(dhc[h] + dtc + dfc.max(),
+                               H.sq_c[h] + T.sq_c + 2 * self.HTc[h] + self.min_f_given_h_c[h] + self.min_f_given_t_c,
+                               t['norm_c'])
+        v = H.raw[h] + T.raw
+        err_lb = _error_bound(t['u'], (v + F.lo) / 3, (v + F.hi) / 3)
+        w_err_ub = 1 - err_lb / t['sum'] if t['sum'] > 0 else np.ones(len(T.raw))
+        min_sim_ub = np.minimum(np.minimum(sh[h], st), sf.max())
+        min_corr_ub = np.minimum(np.minimum(rh[h], rt), np.nanmax(rf))
+        ub = p1 * (cos_ub + pear_ub) / 2 + p2 * w_err_ub + p3 * min_sim_ub + p4 * min_corr_ub + _EPS
+        return np.where(np.isnan(ub), -np.inf, ub)
+
+    # ------------------------------------------------------------------
+    # Leaves
+    # ------------------------------------------------------------------
+    def _leaf_components(self, t, h, torsos):
+        # Exact components for head h, the given torsos and every face: (len(torsos), |F|)
+        H, T, F = self.H, self.T, self.F
+        dh, dhc, sh, rh = t['h']
+        dt, dtc, st, rt = t['t']
+        df, dfc, sf, rf = t['f']
+        u = t['u']
+
+        def combo(d_h, d_t, d_f, hsq, tsq, fsq, HT, HF, TF, norm):
+            num = d_h[h] + d_t[torsos][:, None] + d_f[None, :]
+            sq = (hsq[h] + tsq[torsos][:, None] + fsq[None, :]
+                  + 2 * (HT[h, torsos][:, None] + HF[h][None, :] + TF[torsos]))
+            return num, norm * np.sqrt(np.maximum(sq, 0))
+
+        num, den = combo(dh, dt, df, H.sq, T.sq, F.sq, self.HT, self.HF, self.TF, t['norm'])
+        cos_global = np.zeros(num.shape)
+        np.divide(num, den, out=cos_global, where=den > 0)
+        num, den = combo(dhc, dtc, dfc, H.sq_c, T.sq_c, F.sq_c, self.HTc, self.HFc, self.TFc, t['norm_c'])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pearson_global = num / den
+            diff = np.abs(3 * u - H.raw[h] - T.raw[torsos][:, None, :] - F.raw[None, :, :])
+            w_error_score = 1 - (diff @ u) / 3 / t['sum']
+
+        return {
+            'sim_global': (cos_global + pearson_global) / 2,
+            'w_error_score': w_error_score,
+            'min_sim': np.minimum(np.minimum(sh[h], st[torsos])[:, None], sf[None, :]),
+            'min_corr': np.minimum(np.minimum(rh[h], rt[torsos])[:, None], rf[None, :]),
+        }
+
+    def _score(self, components):
+        p1, p2, p3, p4 = self.weights
+        return (p1 * components['sim_global'] + p2 * components['w_error_score']
+                + p3 * components['min_sim'] + p4 * components['min_corr'])
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def solve(self, user_vector, initial=None):
+        """
+        Provably best (head, torso, face) for one user over the whole catalog.
+
+        Parameters:
+            user_vector (np.ndarray): (G,) user vector.
+            initial (tuple, optional): A known (head, torso, face) used as the first
+                incumbent, e.g. the Top-N result. A good incumbent prunes more.
+
+        Returns:
+            dict: 'head', 'torso', 'face', 'score', the `COMPONENTS` of the best triple,
+            and 'pruned' / 'evaluated' combination counts.
+        """
+        t = self._user_terms(np.asarray(user_vector, dtype=np.float64))
+        n_t, n_f = len(self.T.raw), len(self.F.raw)
+        best = {'head': -1, 'torso': -1, 'face': -1, 'score': -np.inf}
+        best.update({name: np.nan for name in COMPONENTS})
+        evaluated = 0
+
+        def offer(h, torsos):
+            components = self._leaf_components(t, h, torsos)
+            score = self._score(components)
+            score = np.where(np.isnan(score), -np.inf, score)
+            j, k = np.unravel_index(score.argmax(), score.shape)
+            if score[j, k] > best['score']:
+                best.update(head=h, torso=int(torsos[j]), face=int(k), score=float(score[j, k]))
+                best.update({name: float(components[name][j, k]) for name in COMPONENTS})
+            return score.size
+
+        if initial is not None:
+            h0, t0, f0 = (int(i) for i in initial)
+            offer(h0, np.array([t0]))
+
+        head_ub = self._head_bounds(t)
+        for h in np.argsort(-head_ub, kind='stable'):
+            if head_ub[h] <= best['score']:
+                break  # heads are sorted, every remaining head is pruned too
+            pair_ub = self._pair_bounds(t, h)
+            order = np.argsort(-pair_ub, kind='stable')
+            for start in range(0, n_t, self.chunk):
+                torsos = order[start:start + self.chunk]
+                torsos = torsos[pair_ub[torsos] > best['score']]
+                if len(torsos) == 0:
+                    break
+                evaluated += offer(h, torsos)
+
+        best['score'] = best['score'] if best['head'] >= 0 else np.nan
+        best['evaluated'] = evaluated
+        best['pruned'] = self.total - evaluated
+        return best
+
+    def solve_many(self, users, N=10, block_size=64):
+        """
+        Exact search for a matrix of users, seeded with the Top-N result of each user.
+
+        Returns:
+            dict: Arrays like `Scoring.best_combinations`, plus per-user 'pruned' and
+            'evaluated' counts.
+        """
+        users = np.atleast_2d(users)
+        seeds = best_combinations(users, self.H.catalog, self.T.catalog, self.F.catalog, N, self.weights, block_size)
+        keys = ('head', 'torso', 'face', 'pruned', 'evaluated')
+        result = {key: np.empty(len(users), dtype=np.int64) for key in keys}
+        for name in ('score',) + COMPONENTS:
+            result[name] = np.empty(len(users), dtype=np.float64)
+        for i, u in enumerate(users):
+            best = self.solve(u, (seeds['head'][i], seeds['torso'][i], seeds['face'][i]))
+            for key in result:
+                result[key][i] = best[key]
+        return result
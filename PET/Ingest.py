@@ -0,0 +1,240 @@
+"""
+Listening-event ingestion into the 18-genre user vectors.
+
+Check-in and listening events ("user X attended a Jazz set for 40 minutes") are aggregated
+into a dense float32 user x genre matrix of exposure minutes:
+
+- Batches are vectorized: user IDs and genres are mapped to rows / columns with pandas
+  hash indexes and summed with one `np.bincount` over the flattened matrix (faster than
+  `np.add.at`).
+- Optional exponential time decay with a half-life: the matrix is kept as of the latest event
+  time; it is scaled down once per batch and each event is added with its own decay factor.
+- `vectors()` normalizes every user by their top genre, giving the 0-1 affinity scale of
+  0_Real_dataset_generator.py (favourite genre at 1.0).
+- Snapshots are a single .npz written atomically. `to_frame()` gives the users CSV layout
+  (UserID + one column per genre) read by the PET scripts, and `drain_updates()` the users
+  touched since the last call, for `Streaming.StreamingRecommender.update()`.
+
+Usage:
+    python Ingest.py events.csv --snapshot listening.npz --half-life 24 --out users.csv
+    (events.csv: UserID, Genre, Minutes, Timestamp in seconds)
+    python Ingest.py --benchmark 10000000
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from Catalog import AccessoryCatalog, CATALOG_PATH
+
+FORMAT_VERSION = 1
+
+
+class GenreAccumulator:
+    """
+    Decayed listening minutes per user and genre.
+
+    Parameters:
+        genres (list): Genre columns, in the order of the catalog.
+        half_life (float, optional): Half-life of the decay, in the units of the event
+            timestamps; None disables decay.
+        capacity (int): Initial number of user rows (grows as needed).
+    """
+
+    def __init__(self, genres, half_life=None, capacity=1024):
+        self.genres = list(genres)
+        self._genre_index = pd.Index(self.genres)
+        self.half_life = half_life
+        self.matrix = np.zeros((capacity, len(self.genres)), dtype=np.float32)
+        self.ids = pd.Index([], dtype=object)
+        self.now = -np.inf
+        self.events = 0
+        self._dirty = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ------------------------------------------------------------------
+    # Batches
+    # ------------------------------------------------------------------
+    def rows_of(self, user_ids):
+        # Row of every UserID, adding the unknown ones
+        rows = self.ids.get_indexer(user_ids)
+        unknown = rows < 0
+        if unknown.any():
+            new = pd.unique(np.asarray(user_ids, dtype=object)[unknown])
+            self._grow(len(self.ids) + len(new))
+            self.ids = self.ids.append(pd.Index(new, dtype=object))
+            rows[unknown] = self.ids.get_indexer(np.asarray(user_ids, dtype=object)[unknown])
+        return rows
+
+    def columns_of(self, genres):
+        # Column of every genre; accepts names or column numbers
+        genres = np.asarray(genres)
+        if genres.dtype.kind in 'iu':
+            cols = genres
+        else:
+            cols = self._genre_index.get_indexer(genres)
+        bad = (cols < 0) | (cols >= len(self.genres))
+        if bad.any():
+            raise ValueError(f"Unknown genres: {sorted(set(np.asarray(genres)[bad].tolist()))[:5]}")
+        return cols
+
+    def _grow(self, n_rows):
+        if n_rows <= len(self.matrix):
+            return
+        capacity = max(n_rows, 2 * len(self.matrix))
+        matrix = np.zeros((capacity, len(self.genres)), dtype=np.float32)
+        matrix[:len(self.matrix)] = self.matrix
+        dirty = np.zeros(capacity, dtype=bool)
+        dirty[:len(self._dirty)] = self._dirty
+        self.matrix, self._dirty = matrix, dirty
+
+    def add(self, user_ids, genres, minutes, timestamps=None):
+        """
+        Add a batch of events.
+
+        Parameters:
+            user_ids (array-like): UserID of every event.
+            genres (array-like): Genre name or column of every event.
+            minutes (array-like): Exposure of every event (minutes, or 1 per check-in).
+            timestamps (array-like, optional): Event times; required when decaying.
+        """
+        self.add_rows(self.rows_of(user_ids), self.columns_of(genres), minutes, timestamps)
+
+    def add_rows(self, rows, cols, minutes, timestamps=None):
+        # Same as `add()` for already mapped rows and columns
+        rows = np.asarray(rows, dtype=np.int64)
+        weights = np.asarray(minutes, dtype=np.float64)
+        if self.half_life is not None:
+            if timestamps is None:
+                raise ValueError("Timestamps are needed when a half-life is set")
+            t = np.asarray(timestamps, dtype=np.float64)
+            latest = float(t.max())
+            if latest > self.now:
+                if np.isfinite(self.now):
+                    self.matrix *= np.float32(2.0 ** (-(latest - self.now) / self.half_life))
+                self.now = latest
+            weights = weights * np.exp2((t - self.now) / self.half_life)
+
+        n_cols = len(self.genres)
+        used = int(rows.max()) + 1 if len(rows) else 0
+        flat = rows * n_cols + cols
+        totals = np.bincount(flat, weights=weights, minlength=used * n_cols)
+        self.matrix[:used] += totals.reshape(used, n_cols).astype(np.float32)
+        self._dirty[rows] = True
+        self.events += len(rows)
+
+    # ------------------------------------------------------------------
+    # Output
+    # ------------------------------------------------------------------
+    def vectors(self, rows=None):
+        # Float32 affinities in [0, 1]: each user's minutes over their top genre's
+        M = self.matrix[:len(self.ids)] if rows is None else self.matrix[rows]
+        top = M.max(axis=1, keepdims=True)
+        return np.divide(M, top, out=np.zeros_like(M), where=top > 0)
+
+    def user_vector(self, user_id):
+        row = self.ids.get_indexer([user_id])[0]
+        if row < 0:
+            raise KeyError(user_id)
+        return self.vectors([row])[0]
+
+    def to_frame(self):
+        # Users CSV layout: UserID + one column per genre
+        df = pd.DataFrame(self.vectors(), columns=self.genres)
+        df.insert(0, 'UserID', np.asarray(self.ids, dtype=object))
+        return df
+
+    def drain_updates(self):
+        """
+        Users touched since the last call.
+
+        Returns:
+            tuple: (UserIDs, (n, G) normalized vectors), for `StreamingRecommender.update()`.
+        """
+        rows = np.flatnonzero(self._dirty[:len(self.ids)])
+        self._dirty[rows] = False
+        return np.asarray(self.ids[rows], dtype=object), self.vectors(rows)
+
+    # ------------------------------------------------------------------
+    # Snapshots
+    # ------------------------------------------------------------------
+    def save(self, path):
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, version=FORMAT_VERSION, matrix=self.matrix[:len(self.ids)],
+                 ids=np.asarray(self.ids, dtype=str), genres=np.array(self.genres),
+                 half_life=np.nan if self.half_life is None else self.half_life,
+                 now=self.now, events=self.events)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        half_life = float(data['half_life'])
+        acc = cls(data['genres'].tolist(), None if np.isnan(half_life) else half_life,
+                  capacity=max(len(data['ids']), 1))
+        acc.matrix[:len(data['ids'])] = data['matrix']
+        acc.ids = pd.Index(data['ids'].astype(object), dtype=object)
+        acc.now = float(data['now'])
+        acc.events = int(data['events'])
+        return acc
+
+
+def benchmark(n_events=10_000_000, n_users=100_000, batch_size=1_000_000, genres=None, seed=0):
+    """
+    Ingestion throughput on synthetic events, in events per second.
+
+    Returns:
+        dict: Events/s with integer user rows and with string UserIDs.
+    """
+    genres = genres or AccessoryCatalog.from_csv(CATALOG_PATH).genres
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, n_users, batch_size)
+    cols = rng.integers(0, len(genres), batch_size)
+    minutes = rng.uniform(1, 90, batch_size).astype(np.float32)
+    ids = np.array([f'user_{i + 1}' for i in range(n_users)], dtype=object)[rows]
+    n_batches = max(1, n_events // batch_size)
+
+    report = {}
+    for name, keys in (('rows', None), ('user_ids', ids)):
+        acc = GenreAccumulator(genres, half_life=86_400, capacity=n_users)
+        acc.rows_of(ids)  # register the population up front
+        t0 = time.perf_counter()
+        for b in range(n_batches):
+            stamps = b * 60.0 + np.sort(rng.uniform(0, 60, batch_size))
+            if keys is None:
+                acc.add_rows(rows, cols, minutes, stamps)
+            else:
+                acc.add(keys, cols, minutes, stamps)
+        report[f'{name}_events_per_s'] = n_batches * batch_size / (time.perf_counter() - t0)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregate listening events into PET user vectors')
+    parser.add_argument('events', nargs='?', help='Events CSV (UserID, Genre, Minutes, Timestamp)')
+    parser.add_argument('--snapshot', help='Accumulator .npz to resume from and save to')
+    parser.add_argument('--half-life', type=float, default=None, help='Decay half-life (timestamp units)')
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    parser.add_argument('--out', help='Write normalized vectors as a users CSV')
+    parser.add_argument('--catalog', default=CATALOG_PATH)
+    parser.add_argument('--benchmark', type=int, metavar='EVENTS', help='Measure throughput instead')
+    opts = parser.parse_args()
+
+    if opts.benchmark:
+        print(benchmark(opts.benchmark))
+    else:
+        if opts.snapshot and os.path.exists(opts.snapshot):
+            acc = GenreAccumulator.load(opts.snapshot)
+        else:
+            acc = GenreAccumulator(AccessoryCatalog.from_csv(opts.catalog).genres, opts.half_life)
+        for chunk in pd.read_csv(opts.events, chunksize=opts.chunksize, skipinitialspace=True):
+            stamps = chunk['Timestamp'].values if 'Timestamp' in chunk else None
+            acc.add(chunk['UserID'].values, chunk['Genre'].values, chunk['Minutes'].values, stamps)
+        print(f"{acc.events} events, {len(acc)} users")
+        if opts.snapshot:
+            acc.save(opts.snapshot)
+        if opts.out:
+            acc.to_frame().to_csv(opts.out, index=False)
@@ -0,0 +1,201 @@
+"""
+Output stage of the PET renders: image format, size, file names and background writing.
+
+A full-size pet is 3780x3780 RGBA, and a synchronous `save()` at PNG's default compression
+often costs more than compositing it. `OutputSpec` describes how one kind of output is
+stored:
+
+- format: 'png' (with a `compress_level`: 1 trades larger files for faster encoding than
+  the default 6), 'webp' (lossless; `method` trades speed for size) or 'jpeg' (high quality,
+  for the combined image; alpha is dropped);
+- optional downscale so the longest side is at most `max_size` pixels;
+- file name pattern, e.g. 'Pet_{user_id}.{ext}'.
+
+`ImageWriter` encodes and writes on a thread pool (PIL's encoders release the GIL) so the
+render loop does not wait on compression or disk. At most `queue_size` images are pending:
+`submit()` blocks when the queue is full, which keeps memory bounded when rendering is
+faster than writing. Files are written atomically (temporary name + `os.replace`).
+
+Usage:
+    python Output.py Data/Body/RockyBoi.png    (size and encode time of every preset)
+"""
+
+import io
+import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from Profiler import timed
+
+# Pillow format, file extension and default save options of every format
+FORMATS = {
+    'png': ('PNG', 'png', {'compress_level': 6}),
+    'webp': ('WEBP', 'webp', {'lossless': True, 'quality': 100, 'method': 0}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 95, 'subsampling': 0}),
+}
+
+
+class OutputSpec:
+    """
+    How one kind of image is stored.
+
+    Parameters:
+        format (str): 'png', 'webp' or 'jpeg'.
+        pattern (str): File name, formatted with `user_id` and `ext`.
+        max_size (int, optional): Longest side in pixels; larger images are downscaled.
+        **options: Save options overriding the format defaults (e.g. compress_level=1).
+    """
+
+    def __init__(self, format='png', pattern='{user_id}.{ext}', max_size=None, **options):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format {format!r}; expected one of {sorted(FORMATS)}")
+        self.format = format
+        self.pattern = pattern
+        self.max_size = max_size
+        self.pil_format, self.ext, defaults = FORMATS[format]
+        self.options = {**defaults, **options}
+
+    def __repr__(self):
+        return f'OutputSpec({self.format!r}, {self.pattern!r}, max_size={self.max_size}, **{self.options})'
+
+    def path(self, user_id, folder=''):
+        return os.path.join(folder, self.pattern.format(user_id=user_id, ext=self.ext))
+
+    @property
+    def linkable(self):
+        # A cached PNG saved with these options can be used as the output file as it is
+        return self.format == 'png' and self.max_size is None
+
+    def prepare(self, image):
+        # Downscaled, mode-converted image ready for the encoder
+        if self.max_size and max(image.size) > self.max_size:
+            scale = self.max_size / max(image.size)
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        if self.format == 'jpeg' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image
+
+    @timed('encode')
+    def encode(self, image):
+        """
+        Encoded file contents.
+
+        Returns:
+            bytes: The image in this spec's format and size.
+        """
+        buf = io.BytesIO()
+        self.prepare(image).save(buf, format=self.pil_format, **self.options)
+        return buf.getvalue()
+
+
+@timed('write_file')
+def write_file(path, data):
+    # Atomic write: readers never see a partial file, and resuming can trust what exists
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return path
+
+
+class ImageWriter:
+    """
+    Background encoder and writer with a bounded queue.
+
+    Parameters:
+        workers (int): Encoding threads.
+        queue_size (int): Images pending at most; `submit()` blocks beyond it.
+    """
+
+    def __init__(self, workers=min(4, os.cpu_count() or 1), queue_size=8):
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='ImageWriter')
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.lock = threading.Lock()
+        self.error = None
+        self.files = 0
+        self.bytes = 0
+        self.encode_seconds = 0.0
+        self.blocked_seconds = 0.0
+
+    def submit(self, path, payload, spec=None):
+        """
+        Queue one file.
+
+        Parameters:
+            path (str): Output file.
+            payload (PIL.Image.Image or bytes): Image to encode with `spec`, or encoded bytes.
+            spec (OutputSpec, optional): Required for images.
+        """
+        self._raise()
+        start = time.perf_counter()
+        self.slots.acquire()
+        self.blocked_seconds += time.perf_counter() - start
+        future = self.pool.submit(self._write, path, payload, spec)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def _write(self, path, payload, spec):
+        try:
+            start = time.perf_counter()
+            data = payload if isinstance(payload, (bytes, bytearray)) else spec.encode(payload)
+            encoded = time.perf_counter() - start
+            write_file(path, data)
+            with self.lock:
+                self.files += 1
+                self.bytes += len(data)
+                self.encode_seconds += encoded
+        except BaseException as e:
+            with self.lock:
+                self.error = self.error or e
+            raise
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        # Wait for every pending file; re-raises the first failure
+        self.pool.shutdown(wait=True)
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        return {'files': self.files, 'mb': self.bytes / 2 ** 20, 'encode_s': self.encode_seconds,
+                'blocked_s': self.blocked_seconds}
+
+
+def compare(image, specs):
+    """
+    Encode time and size of one image with every spec.
+
+    Returns:
+        list: Dicts with the spec, seconds and kilobytes.
+    """
+    rows = []
+    for spec in specs:
+        start = time.perf_counter()
+        data = spec.encode(image)
+        rows.append({'spec': repr(spec), 'seconds': time.perf_counter() - start, 'kb': len(data) / 1024})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare PET output encodings on one image')
+    parser.add_argument('image')
+    opts = parser.parse_args()
+
+    with Image.open(opts.image) as im:
+        image = im.convert('RGBA')
+    specs = [OutputSpec('png'), OutputSpec('png', compress_level=1), OutputSpec('webp'),
+             OutputSpec('webp', method=4), OutputSpec('jpeg'), OutputSpec('png', max_size=1024)]
+    for row in compare(image, specs):
+        print(row)
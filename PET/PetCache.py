@@ -0,0 +1,316 @@
+"""
+Content-addressed cache of composed pet images.
+
+Only a few dozen accessories exist per slot, so across a population the number of distinct
+(head, torso, face) triples is small while every user used to get a freshly composed and
+encoded image. `PetCache` stores each composed pet once, under the SHA-256 of
+
+    (body, head, torso, face, size, asset versions)
+
+where the version of an asset is its file size and modification time, so editing a PNG
+invalidates every pet using it. Two tiers:
+- disk: `<cache_dir>/<2 hex>/<digest>.png`, capped in bytes and evicted least recently
+  used first;
+- memory: the most recently used decoded images, capped in bytes.
+
+Per-user outputs are references: `link()` hard-links `Pet_<UserID>.png` to the cached file
+(copying when the file system has no hard links), so they survive eviction. Hard links share
+the file's mtime, so recency is not kept there but in `<cache_dir>/index.json`
+(digest -> bytes, last use).
+
+Render processes may share a cache folder. The index is the one record of the disk tier: every
+store merges the process's recent uses into it, adds the new file and evicts, under a file lock,
+so the byte cap holds for all processes together (uses are also merged every `sync_every`
+lookups). Another process may still evict a file between any two calls: a disk hit whose file
+is gone is rendered again, and `link()` stores the pet again before linking.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import contextlib
+from collections import OrderedDict
+from PIL import Image
+from Catalog import DATA_DIR
+from Compositor import BODY, accessory_file
+from Profiler import timed
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pet_cache')
+FORMAT_VERSION = 1
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'index.lock'
+
+try:
+    import fcntl
+except ImportError:  # Windows: the index is shared without a lock
+    fcntl = None
+
+
+def _link_or_copy(src, dst):
+    # A missing source raises FileNotFoundError rather than falling back to a copy
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class PetCache:
+    """
+    Two-tier LRU cache of composed pets.
+
+    Parameters:
+        cache_dir (str): Folder of the disk tier.
+        max_bytes (int): Size cap of the disk tier.
+        memory_bytes (int): Size cap of the decoded in-memory tier (RGBA bytes).
+        data_dir (str): Asset folder, for the version of every layer.
+        save_options (dict, optional): Keyword arguments of `PIL.Image.save`.
+        sync_every (int): Lookups between merges of this process's uses into the index.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=2 * 2 ** 30, memory_bytes=512 * 2 ** 20,
+                 data_dir=DATA_DIR, save_options=None, sync_every=1000):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.data_dir = data_dir
+        self.save_options = save_options or {}
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.hot_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._versions = {}
+        self.sync_every = sync_every
+        self._used = {}  # digest -> last use, not merged into the index yet
+        self._lookups = 0
+
+        # Disk entries as of the last merge with the index, oldest use first
+        self.entries = OrderedDict()
+        self.disk_used = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.sync(scan=True)
+
+    # ------------------------------------------------------------------
+    # Keys
+    # ------------------------------------------------------------------
+    def _version(self, path):
+        version = self._versions.get(path)
+        if version is None:
+            stat = os.stat(path)
+            version = self._versions[path] = [stat.st_size, stat.st_mtime_ns]
+        return version
+
+    def key(self, head_name, torso_name, face_name, size=None):
+        layers = [[BODY, self._version(os.path.join(self.data_dir, BODY))]]
+        for slot, name in (('Head', head_name), ('Torso', torso_name), ('Face', face_name)):
+            if not name:  # unserved slot: no layer
+                layers.append([slot, None])
+                continue
+            layer = os.path.join(slot, accessory_file(name))
+            layers.append([layer, self._version(os.path.join(self.data_dir, layer))])
+        payload = {'version': FORMAT_VERSION, 'size': size, 'save': self.save_options, 'layers': layers}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def path(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], digest + '.png')
+
+    # ------------------------------------------------------------------
+    # Shared index
+    # ------------------------------------------------------------------
+    @contextlib.contextmanager
+    def _locked(self):
+        # Exclusive lock of the index between the processes sharing the folder
+        with open(os.path.join(self.cache_dir, LOCK_FILE), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_FILE)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_index(self, index):
+        path = os.path.join(self.cache_dir, INDEX_FILE)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, path)
+
+    def _scan(self):
+        # Cached files on disk: digest -> (bytes, mtime)
+        found = {}
+        for sub in os.listdir(self.cache_dir):
+            folder = os.path.join(self.cache_dir, sub)
+            if not os.path.isdir(folder):
+                continue
+            for entry in os.scandir(folder):
+                if entry.name.endswith('.png'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    found[entry.name[:-4]] = (stat.st_size, stat.st_mtime)
+        return found
+
+    def sync(self, new=None, scan=False):
+        """
+        Merge this process's uses into the shared index, add the files just stored and evict
+        least recently used files until the disk tier fits in `max_bytes`.
+
+        Parameters:
+            new (dict, optional): digest -> bytes of files just stored (never evicted here).
+            scan (bool): Rebuild the index from the files on disk; files it did not know
+                count as last used at their modification time.
+        """
+        new = new or {}
+        with self._locked():
+            index = self._read_index()
+            if index is None or scan:
+                known = index or {}
+                index = {digest: [size, known[digest][1] if digest in known else mtime]
+                         for digest, (size, mtime) in self._scan().items()}
+            for digest, used in self._used.items():
+                if digest in index:
+                    index[digest][1] = max(index[digest][1], used)
+            now = time.time()
+            for digest, size in new.items():
+                index[digest] = [size, now]
+            total = sum(size for size, _ in index.values())
+            for digest in sorted(index, key=lambda d: index[d][1]):
+                if total <= self.max_bytes:
+                    break
+                if digest in new:
+                    continue
+                total -= index.pop(digest)[0]
+                self.evictions += 1
+                try:
+                    os.remove(self.path(digest))
+                except FileNotFoundError:
+                    pass
+            self._write_index(index)
+        self._used.clear()
+        self.entries = OrderedDict((d, index[d][0]) for d in sorted(index, key=lambda d: index[d][1]))
+        self.disk_used = total
+
+    # ------------------------------------------------------------------
+    # Tiers
+    # ------------------------------------------------------------------
+    def _remember(self, digest, image):
+        nbytes = image.width * image.height * len(image.getbands())
+        if nbytes > self.memory_bytes:
+            return
+        if digest in self.memory:
+            self.memory_used -= self.memory.pop(digest)[1]
+        self.memory[digest] = (image, nbytes)
+        self.memory_used += nbytes
+        while self.memory_used > self.memory_bytes:
+            self.memory_used -= self.memory.popitem(last=False)[1][1]
+
+    @timed('cache_store')
+    def _store(self, digest, image):
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'  # render processes may share the cache
+        image.save(tmp, format='PNG', **self.save_options)
+        size = os.path.getsize(tmp)  # the stored file may be evicted by another process at once
+        os.replace(tmp, path)
+        self.sync({digest: size})
+
+    def get_or_render(self, head_name, torso_name, face_name, size, render, load=True):
+        """
+        Cached pet, rendered with `render(head_name, torso_name, face_name, size)` on a miss.
+
+        Parameters:
+            load (bool): Whether a disk hit is decoded; with False the image is None and
+                only the path is returned.
+
+        Returns:
+            tuple: (path of the cached file, PIL image or None). On a memory hit the file
+            may have been evicted meanwhile; `link()` stores it again.
+        """
+        digest = self.key(head_name, torso_name, face_name, size)
+        path = self.path(digest)
+        if digest in self.memory:
+            self.hot_hits += 1
+            self.memory.move_to_end(digest)
+            self._touch(digest)
+            return path, self.memory[digest][0]
+        if os.path.exists(path):  # also finds pets stored by other processes
+            image = None
+            try:
+                if load:
+                    with Image.open(path) as im:
+                        image = im.copy()
+            except FileNotFoundError:
+                pass  # evicted by another process since the check: render it again
+            else:
+                self.disk_hits += 1
+                self._touch(digest)
+                if load:
+                    self._remember(digest, image)
+                return path, image
+
+        self.misses += 1
+        image = render(head_name, torso_name, face_name, size)
+        self._store(digest, image)
+        self._remember(digest, image)
+        return path, image
+
+    def _touch(self, digest):
+        # Recorded for the index rather than as the file's mtime, which hard links share
+        if digest in self.entries:
+            self.entries.move_to_end(digest)
+        self._used[digest] = time.time()
+        self._lookups += 1
+        if self._lookups % self.sync_every == 0:
+            self.sync()
+
+    def link(self, path, out_path, image=None):
+        """
+        Per-user reference to a cached pet: a hard link, or a copy if links are unsupported.
+
+        Parameters:
+            image (PIL.Image.Image, optional): The pet, stored again if its cached file was
+                evicted (by another process) before it could be linked.
+        """
+        if os.path.abspath(path) == os.path.abspath(out_path):
+            return out_path
+        try:
+            if os.path.samefile(path, out_path):
+                return out_path  # already linked (renaming a link onto itself keeps the temporary)
+        except FileNotFoundError:
+            pass
+        tmp = f'{out_path}.{os.getpid()}.tmp'
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        digest = os.path.basename(path)[:-4]
+        if image is None and digest in self.memory:
+            image = self.memory[digest][0]
+        try:
+            _link_or_copy(path, tmp)
+        except FileNotFoundError:
+            if image is None:
+                raise
+            self._store(digest, image)
+            _link_or_copy(path, tmp)
+        os.replace(tmp, out_path)
+        return out_path
+
+    def stats(self):
+        total = self.hot_hits + self.disk_hits + self.misses
+        return {'hot_hits': self.hot_hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'hit_rate': (self.hot_hits + self.disk_hits) / total if total else 0.0,
+                'entries': len(self.entries), 'disk_mb': self.disk_used / 2 ** 20,
+                'memory_mb': self.memory_used / 2 ** 20, 'evictions': self.evictions}
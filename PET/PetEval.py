@@ -1,10 +1,16 @@
 import pandas as pd
 from PIL import Image
 import os
-import matplotlib.pyplot as plt
+from Chart import chart_for, SERIES_5, SERIES_2
+from Catalog import AccessoryCatalog
+from UserStore import open_users
+from Results import iter_results, accessory_vectors, user_vectors
 
-csv_path = '1_DResultados2.csv'
-df = pd.read_csv(csv_path)
+# Results of 1_TopN.py (one row per user, see Results.py); the genre vectors are joined from
+# the catalog and the users the search ran on
+RESULTS_PATH = '1_DResultados.csv'
+catalog = AccessoryCatalog.from_csv('1_AccessoryDataset.csv')
+users = open_users('0_Diverse_users_100k.csv')
 
 # =====================================
 # Load accessory image from its folder
@@ -18,65 +24,26 @@ def load_image_from_folder(accessory_name, folder_path):
 # ================================================================
 # Bar chart: user genres + individual accessories + average vector
 # ================================================================
+
+# Bars are drawn on a chart template pre-rendered once per genre list (see Chart.py)
 def plot_genres_5(user_genres, torso_genres, head_genres, face_genres, accessory_genres, user_id):
-    user_genres = pd.DataFrame([user_genres])  # Make sure it's a DataFrame
-
-    genres = user_genres.columns
-    user_values = user_genres.values.flatten()
-    torso_values = torso_genres.values.flatten()
-    head_values = head_genres.values.flatten()
-    face_values = face_genres.values.flatten()
-    accessory_values = accessory_genres.values.flatten()
-
-    fig, ax = plt.subplots(1, 1, figsize=(12, 6))
-    index = range(len(genres))
-    bar_width = 0.15
-
-    ax.bar(index, user_values, bar_width, label='User', color='b')
-    ax.bar([i + bar_width for i in index], accessory_values, bar_width, label='Torso', color='r')
-    ax.bar([i + 2 * bar_width for i in index], head_values, bar_width, label='Head', color='y')
-    ax.bar([i + 3 * bar_width for i in index], face_values, bar_width, label='Face', color='purple')
-    ax.bar([i + 4 * bar_width for i in index], accessory_values, bar_width, label='Accessories (Avg)', color='g')
-
-    ax.set_xlabel('Genres')
-    ax.set_ylabel('Values')
-    ax.set_title('Comparison of User and Accessory Genres')
-    ax.set_xticks([i + 2 * bar_width for i in index])
-    ax.set_xticklabels(genres, rotation=90)
-    ax.legend()
-
-    plt.tight_layout()
+    chart = chart_for(user_genres.index, SERIES_5)
+    graph = chart.render(user_genres.values, torso_genres.values, head_genres.values,
+                         face_genres.values, accessory_genres.values)
+
     graph_path = f'genre_comparison_{user_id}.png'
-    plt.savefig(graph_path)
+    graph.save(graph_path)
     return graph_path
 
 # ==================================================
 # Bar chart: user genres vs. average accessory vector
 # ==================================================
 def plot_genres_2(user_genres, accessory_genres, user_id):
-    user_genres = pd.DataFrame([user_genres])  # Make sure it's a DataFrame
-
-    genres = user_genres.columns
-    user_values = user_genres.values.flatten()
-    accessory_values = accessory_genres.values.flatten()
-
-    fig, ax = plt.subplots(1, 1, figsize=(10, 6))
-    index = range(len(genres))
-    bar_width = 0.35
-
-    ax.bar(index, user_values, bar_width, label='User', color='b')
-    ax.bar([i + bar_width for i in index], accessory_values, bar_width, label='Accessories', color='r')
-
-    ax.set_xlabel('Genres')
-    ax.set_ylabel('Values')
-    ax.set_title('Comparison of User and Accessory Genres')
-    ax.set_xticks([i + 2 * bar_width for i in index])
-    ax.set_xticklabels(genres, rotation=90)
-    ax.legend()
+    chart = chart_for(user_genres.index, SERIES_2)
+    graph = chart.render(user_genres.values, accessory_genres.values)
 
-    plt.tight_layout()
     graph_path = f'genre_comparison_{user_id}.png'
-    plt.savefig(graph_path)
+    graph.save(graph_path)
     return graph_path
 
 # ================================
@@ -125,28 +92,32 @@ def combine_images(graph_path, pet_image, user_id):
 # ===============================
 # Main loop to process all users
 # ===============================
-for i in range(0, len(df), 4):
-    user_id = df.iloc[i, 0]
-    user_genres = df.iloc[i, 1:]
-    torso_name = df.iloc[i+1, 0]
-    head_name = df.iloc[i+2, 0]
-    face_name = df.iloc[i+3, 0]
-
-    # Generate genre vectors
-    torso_genres = df.iloc[i+1, 1:]
-    head_genres = df.iloc[i+2, 1:]
-    face_genres = df.iloc[i+3, 1:]
-    accessory_genres = df.iloc[i+1:i+4, 1:].mean(axis=0)
-
-    # Print genre values for debugging
-    print(torso_genres)
-    print(head_genres)
-    print(face_genres)
-    print("Accessory avg:", accessory_genres)
-    print("User:", user_genres)
-
-    # To activate image and graph generation, uncomment below:
-    # pet_image_name, pet_image = create_pet_image(user_id, torso_name, head_name, face_name)
-    # graph_path = plot_genres_5(user_genres, torso_genres, head_genres, face_genres, accessory_genres, user_id)
-    # combined_image_path = combine_images(graph_path, pet_image, user_id)
-    # print(f'Combined image for user {user_id} saved as {combined_image_path}')
+for df in iter_results(RESULTS_PATH, 10_000, catalog):
+    accessories = accessory_vectors(df, catalog)
+    user_matrix = user_vectors(df, users, catalog.genres)
+    for i, row in enumerate(df.itertuples(index=False)):
+        user_id = row.UserID
+        user_genres = pd.Series(user_matrix[i], index=catalog.genres)
+        torso_name = row.Torso
+        head_name = row.Head
+        face_name = row.Face
+
+        # Generate genre vectors
+        torso_genres = pd.Series(accessories['Torso'][i], index=catalog.genres)
+        head_genres = pd.Series(accessories['Head'][i], index=catalog.genres)
+        face_genres = pd.Series(accessories['Face'][i], index=catalog.genres)
+        # Mean over the served slots (an unserved one is NaN, see Results.py)
+        accessory_genres = pd.DataFrame([torso_genres, head_genres, face_genres]).mean(axis=0)
+
+        # Print genre values for debugging
+        print(torso_genres)
+        print(head_genres)
+        print(face_genres)
+        print("Accessory avg:", accessory_genres)
+        print("User:", user_genres)
+
+        # To activate image and graph generation, uncomment below:
+        # pet_image_name, pet_image = create_pet_image(user_id, torso_name, head_name, face_name)
+        # graph_path = plot_genres_5(user_genres, torso_genres, head_genres, face_genres, accessory_genres, user_id)
+        # combined_image_path = combine_images(graph_path, pet_image, user_id)
+        # print(f'Combined image for user {user_id} saved as {combined_image_path}')
@@ -0,0 +1,302 @@
+"""
+Lightweight stage instrumentation of the PET scripts.
+
+A `Profiler` is a registry of named stages, timed with a context manager or a decorator:
+
+    with profiler.stage('load_users'):
+        users = open_users(path)
+
+    @profiler.timed('top_n')
+    def top_n_indices(...): ...
+
+Disabled (the default), `stage()` returns a shared no-op context manager and a decorated
+function costs one attribute check per call, so library functions stay decorated. Enabled,
+every stage records wall and CPU time and
+
+- the peak resident set size of the process (its high-water mark at the end of the stage,
+  and how much the stage raised it);
+- with `memory=True`, the peak memory traced by `tracemalloc` while the stage ran and the
+  change in `sys.getallocatedblocks()`. Both are process-wide, so stages running at the same
+  time in other threads share them, and tracemalloc slows allocation-heavy code down.
+
+`dump()` writes a per-run JSON summary (calls, total / mean / max time and memory per stage)
+and optionally a Chrome trace (chrome://tracing or https://ui.perfetto.dev) with one event
+per call, nested by thread.
+
+The module-level `profiler` is shared by the PET modules. Setting the environment variable
+PET_PROFILE to a JSON path (and PET_PROFILE_TRACE to a trace path) enables it at import and
+dumps it at exit; PET_PROFILE_MEMORY=0 skips tracemalloc.
+
+Usage:
+    PET_PROFILE=profile.json PET_PROFILE_TRACE=trace.json python PetGen.py
+    python Profiler.py profile.json    (prints a summary)
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+import functools
+import tracemalloc
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_NULL = contextlib.nullcontext()
+
+
+def peak_rss():
+    # High-water mark of the resident set size in bytes (None where unavailable)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss():
+    # Resident set size in bytes, from /proc on Linux (None elsewhere)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class _Stage:
+    # One running call of a stage
+
+    __slots__ = ('profiler', 'name', 'args', 'start', 'cpu', 'rss_peak', 'blocks', 'traced_peak')
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.rss_peak = peak_rss()
+        if profiler.memory:
+            self.blocks = sys.getallocatedblocks()
+            self.traced_peak = 0
+            profiler._track(self, True)
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        cpu = time.thread_time() - self.cpu
+        profiler = self.profiler
+        blocks = traced = None
+        if profiler.memory:
+            profiler._track(self, False)
+            blocks = sys.getallocatedblocks() - self.blocks
+            traced = self.traced_peak
+        rss_peak = peak_rss()
+        profiler._add(self.name, self.start, end, cpu, rss_peak,
+                      rss_peak - self.rss_peak if rss_peak is not None else None, traced, blocks, self.args)
+        return False
+
+
+class Profiler:
+    """
+    Registry of timed stages.
+
+    Parameters:
+        enabled (bool): Whether stages are recorded.
+        memory (bool): Also trace allocations with tracemalloc (started by `enable()`).
+        max_events (int): Calls kept for the Chrome trace; later ones only count in the summary.
+    """
+
+    def __init__(self, enabled=False, memory=True, max_events=1_000_000):
+        self.enabled = False
+        self.memory = False
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._open = set()
+        self.reset()
+        if enabled:
+            self.enable(memory)
+
+    def reset(self):
+        self.stats = {}
+        self.events = []
+        self.dropped = 0
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+
+    def enable(self, memory=True):
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+        return self
+
+    def disable(self):
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = False
+
+    # ------------------------------------------------------------------
+    # Instrumentation
+    # ------------------------------------------------------------------
+    def stage(self, name, **args):
+        """
+        Context manager timing one call of stage `name`; `args` go to its trace event.
+        """
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name, args)
+
+    def timed(self, name=None):
+        """
+        Decorator timing every call of a function as stage `name` (default: its qualified name).
+        """
+        def decorator(fn):
+            stage_name = name or fn.__qualname__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _Stage(self, stage_name, None):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _track(self, stage, entering):
+        # tracemalloc keeps one peak for the process: fold it into every open stage and reset
+        # it, so each stage ends up with the highest traced memory seen while it was open
+        with self._lock:
+            peak = tracemalloc.get_traced_memory()[1]
+            for other in self._open:
+                other.traced_peak = max(other.traced_peak, peak)
+            if entering:
+                self._open.add(stage)
+                stage.traced_peak = tracemalloc.get_traced_memory()[0]
+            else:
+                stage.traced_peak = max(stage.traced_peak, peak)
+                self._open.discard(stage)
+            tracemalloc.reset_peak()
+
+    def _add(self, name, start, end, cpu, rss_peak, rss_growth, traced, blocks, args):
+        seconds = end - start
+        with self._lock:
+            s = self.stats.get(name)
+            if s is None:
+                s = self.stats[name] = {'calls': 0, 'total_s': 0.0, 'min_s': seconds, 'max_s': seconds,
+                                        'cpu_s': 0.0, 'peak_rss_bytes': None, 'rss_growth_bytes': 0,
+                                        'peak_traced_bytes': None, 'allocated_blocks': 0}
+            s['calls'] += 1
+            s['total_s'] += seconds
+            s['min_s'] = min(s['min_s'], seconds)
+            s['max_s'] = max(s['max_s'], seconds)
+            s['cpu_s'] += cpu
+            if rss_peak is not None:
+                s['peak_rss_bytes'] = max(s['peak_rss_bytes'] or 0, rss_peak)
+                s['rss_growth_bytes'] += rss_growth
+            if traced is not None:
+                s['peak_traced_bytes'] = max(s['peak_traced_bytes'] or 0, traced)
+                s['allocated_blocks'] += blocks
+            if len(self.events) < self.max_events:
+                self.events.append((name, start, seconds, threading.get_ident(), traced, blocks, args))
+            else:
+                self.dropped += 1
+
+    # ------------------------------------------------------------------
+    # Reports
+    # ------------------------------------------------------------------
+    def summary(self):
+        """
+        Per-run profile: run information and the stages by total time.
+
+        Returns:
+            dict: 'run' and 'stages' (name -> calls, times in seconds, memory in bytes).
+        """
+        with self._lock:
+            stages = {name: dict(s, mean_s=s['total_s'] / s['calls'])
+                      for name, s in sorted(self.stats.items(), key=lambda kv: -kv[1]['total_s'])}
+        run = {'argv': sys.argv, 'pid': os.getpid(),
+               'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+               'wall_s': time.perf_counter() - self.started, 'memory_tracing': self.memory,
+               'peak_rss_bytes': peak_rss(), 'rss_bytes': current_rss(),
+               'events': len(self.events), 'dropped_events': self.dropped}
+        if self.memory:
+            run['traced_bytes'] = tracemalloc.get_traced_memory()[0]
+        return {'run': run, 'stages': stages}
+
+    def chrome_trace(self):
+        # Trace Event Format: one complete ('X') event per call, microseconds since the start
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+        trace = []
+        for name, start, seconds, tid, traced, blocks, args in events:
+            event = {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': (start - self.started) * 1e6, 'dur': seconds * 1e6}
+            details = dict(args or {})
+            if traced is not None:
+                details.update(peak_traced_bytes=traced, allocated_blocks=blocks)
+            if details:
+                event['args'] = details
+            trace.append(event)
+        main = threading.main_thread().ident
+        for tid in {event['tid'] for event in trace}:
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                          'args': {'name': 'main' if tid == main else f'thread {tid}'}})
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path=None, trace_path=None):
+        """
+        Write the JSON summary to `path` and the Chrome trace to `trace_path` (either optional).
+
+        Returns:
+            dict: The summary.
+        """
+        summary = self.summary()
+        for out, data in ((path, summary), (trace_path, self.chrome_trace() if trace_path else None)):
+            if out:
+                with open(out + '.tmp', 'w') as f:
+                    json.dump(data, f, indent=1 if data is summary else None, default=str)
+                os.replace(out + '.tmp', out)
+        return summary
+
+
+def format_summary(summary):
+    # Text table of a summary, one line per stage
+    lines = [f"{'stage':<24} {'calls':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9} "
+             f"{'cpu s':>8} {'peak MB':>8} {'traced MB':>9} {'blocks':>9}"]
+    mb = lambda b: f'{b / 2 ** 20:.1f}' if b is not None else '-'
+    for name, s in summary['stages'].items():
+        lines.append(f"{name:<24} {s['calls']:>7} {s['total_s']:>9.3f} {s['mean_s'] * 1e3:>9.2f} "
+                     f"{s['max_s'] * 1e3:>9.2f} {s['cpu_s']:>8.3f} {mb(s['peak_rss_bytes']):>8} "
+                     f"{mb(s['peak_traced_bytes']):>9} {s['allocated_blocks'] if s['peak_traced_bytes'] is not None else '-':>9}")
+    run = summary['run']
+    lines.append(f"wall {run['wall_s']:.3f}s, peak RSS {mb(run['peak_rss_bytes'])} MB")
+    return '\n'.join(lines)
+
+
+# Shared registry of the PET modules
+profiler = Profiler()
+stage = profiler.stage
+timed = profiler.timed
+
+if os.environ.get('PET_PROFILE'):
+    profiler.enable(memory=os.environ.get('PET_PROFILE_MEMORY', '1') != '0')
+    atexit.register(profiler.dump, os.environ['PET_PROFILE'], os.environ.get('PET_PROFILE_TRACE'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print a PET profile summary')
+    parser.add_argument('summary', help='JSON written by Profiler.dump()')
+    opts = parser.parse_args()
+
+    with open(opts.summary) as f:
+        print(format_summary(json.load(f)))
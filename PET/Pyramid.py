@@ -0,0 +1,302 @@
+"""
+Multi-resolution sprite pyramid for rendering pets at display size.
+
+Kiosks and phones show the pet at 256-1024 px, so decoding and compositing the 3780 px
+sources only to throw most pixels away is wasted work. `build_pyramid()` resamples the body
+and every accessory once per level (default 2048/1024/512/256; levels at or above the
+body's size use the full-resolution `PetCompositor`) and stores each layer with
+premultiplied alpha, cropped to its visible bounding box. Layers are scaled by the same
+factor as the body canvas, so sources smaller than the canvas (the 1x1 "Nothing"
+placeholders) keep their place and become empty crops:
+
+    Data/Pyramid/index.json        level -> layer -> offset, shape, source size/mtime
+    Data/Pyramid/<level>.npz       layer -> (h, w, 4) uint8 premultiplied RGBA
+
+Resampling premultiplied pixels keeps transparent edges from bleeding dark fringes.
+`SpritePyramid.compose()` picks the smallest level that is at least the target size,
+composites there with the Porter-Duff "over" operator on the crops and resizes the (small)
+result to the exact target. A pyramid whose sources were added, removed or edited since it
+was built is stale: `SpritePyramid` warns and renders from the full-resolution sources until
+it is rebuilt.
+
+Usage:
+    python Pyramid.py build
+    python Pyramid.py report --size 512
+    python Pyramid.py check
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from PIL import Image
+from Catalog import DATA_DIR
+from Compositor import BODY, LAYER_ORDER, PetCompositor, accessory_file
+from Atlas import ATLAS_PATH, SpriteAtlas, AtlasCompositor
+from Profiler import stage, timed
+
+LEVELS = (4096, 2048, 1024, 512, 256)
+PYRAMID_DIR = os.path.join(DATA_DIR, 'Pyramid')
+FORMAT_VERSION = 2
+
+
+def _key(slot, name):
+    return f'{slot}|{accessory_file(name)}'
+
+
+def _sources(data_dir):
+    # (key, path) of the body and every accessory image
+    yield _key('Body', os.path.basename(BODY)), os.path.join(data_dir, BODY)
+    for slot in LAYER_ORDER:
+        folder = os.path.join(data_dir, slot)
+        for f in sorted(os.listdir(folder)):
+            if f.lower().endswith('.png'):
+                yield _key(slot, f), os.path.join(folder, f)
+
+
+def premultiplied(image, size=None):
+    # (h, w, 4) uint8 premultiplied RGBA, optionally resampled to size x size
+    im = image.convert('RGBA').convert('RGBa')
+    if size is not None and im.size != (size, size):
+        im = im.resize((size, size), Image.LANCZOS, reducing_gap=3.0)
+    return np.asarray(im)
+
+
+def _crop(arr):
+    alpha = arr[..., 3]
+    rows, cols = np.flatnonzero(alpha.any(1)), np.flatnonzero(alpha.any(0))
+    if not len(rows):
+        return arr[:0, :0], (0, 0)
+    return arr[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1], (int(cols[0]), int(rows[0]))
+
+
+def build_pyramid(data_dir=DATA_DIR, out_dir=PYRAMID_DIR, levels=LEVELS):
+    """
+    Precompute every level of every layer.
+
+    Returns:
+        dict: The index written to index.json.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with Image.open(os.path.join(data_dir, BODY)) as im:
+        canvas = im.size[0]
+    levels = [level for level in levels if level < canvas]
+    index = {'version': FORMAT_VERSION, 'canvas': canvas, 'levels': {}}
+    arrays = {}
+    for key, path in _sources(data_dir):
+        with Image.open(path) as im:
+            im.load()
+            source_size = im.size[0]
+            stat = os.stat(path)
+            for level in levels:
+                if im.size == (canvas, canvas):
+                    pixels = premultiplied(im, level)
+                else:
+                    # Same scale as the canvas; offsets are relative to its top-left corner
+                    scaled = tuple(max(1, round(d * level / canvas)) for d in im.size)
+                    pixels = np.asarray(im.convert('RGBA').convert('RGBa').resize(scaled, Image.LANCZOS))
+                crop, offset = _crop(pixels)
+                arrays.setdefault(level, {})[key] = np.ascontiguousarray(crop)
+                index['levels'].setdefault(str(level), {})[key] = {
+                    'offset': offset, 'shape': list(crop.shape[:2]), 'source_size': source_size,
+                    'source_mtime': stat.st_mtime, 'source_bytes': stat.st_size}
+    for level, layers in arrays.items():
+        tmp = os.path.join(out_dir, f'{level}.tmp.npz')
+        np.savez(tmp, **layers)
+        os.replace(tmp, os.path.join(out_dir, f'{level}.npz'))
+    with open(os.path.join(out_dir, 'index.json.tmp'), 'w') as f:
+        json.dump(index, f)
+    os.replace(os.path.join(out_dir, 'index.json.tmp'), os.path.join(out_dir, 'index.json'))
+    return index
+
+
+def _over(dst, src, offset):
+    # Premultiplied "over" of src onto dst at (x, y), in place; both uint8
+    x, y = offset
+    h, w = src.shape[:2]
+    region = dst[y:y + h, x:x + w]
+    inv = 255 - src[..., 3:4].astype(np.uint16)
+    # Lanczos ringing can leave color slightly above alpha, hence the clip
+    region[:] = np.minimum(src + (region * inv + 127) // 255, 255)
+
+
+class SpritePyramid:
+    """
+    Layers of one or more pyramid levels, loaded on first use.
+
+    Parameters:
+        pyramid_dir (str): Output folder of `build_pyramid()`. If it was never built, every
+            size is rendered from the full-resolution sources.
+        data_dir (str): Source images, for the full-resolution fallback (read from the
+            packed atlas of Atlas.py when there is one).
+    """
+
+    def __init__(self, pyramid_dir=PYRAMID_DIR, data_dir=DATA_DIR):
+        self.pyramid_dir = pyramid_dir
+        self.index = {'version': FORMAT_VERSION, 'levels': {}}
+        if os.path.exists(os.path.join(pyramid_dir, 'index.json')):
+            with open(os.path.join(pyramid_dir, 'index.json')) as f:
+                self.index = json.load(f)
+        self.levels = sorted(int(level) for level in self.index['levels'])
+        self.loaded = {}
+        changed = self.stale(data_dir) if self.levels else []
+        if changed:
+            print(f"Sprite pyramid is stale ({len(changed)} changed sources, e.g. {changed[0]}); "
+                  f"rendering full size until it is rebuilt with Pyramid.py build")
+            self.levels = []
+        # Full-resolution layers from the memory-mapped atlas when it is packed and current
+        atlas_path = os.path.join(data_dir, os.path.basename(ATLAS_PATH))
+        atlas = SpriteAtlas(atlas_path) if os.path.exists(atlas_path) else None
+        self.full = AtlasCompositor(atlas, data_dir) if atlas and not atlas.stale(data_dir) else PetCompositor(data_dir)
+
+    def stale(self, data_dir=DATA_DIR):
+        # Sources added, removed or modified since the pyramid was built
+        if self.index.get('version') != FORMAT_VERSION:
+            return ['(format version)']
+        entries = {}
+        for layers in self.index['levels'].values():
+            entries.update(layers)
+        changed = []
+        current = dict(_sources(data_dir))
+        for key, path in current.items():
+            entry = entries.get(key)
+            stat = os.stat(path)
+            if entry is None or entry['source_bytes'] != stat.st_size or entry['source_mtime'] != stat.st_mtime:
+                changed.append(key)
+        changed += [key for key in entries if key not in current]
+        return changed
+
+    def level_for(self, size):
+        # Smallest level that needs no upscaling; None means full resolution
+        for level in self.levels:
+            if level >= size:
+                return level
+        return None
+
+    def layer(self, level, key):
+        layers = self.loaded.get(level)
+        if layers is None:
+            path = os.path.join(self.pyramid_dir, f'{level}.npz')
+            with stage('decode_pyramid', level=level), np.load(path) as data:
+                layers = self.loaded[level] = {k: data[k] for k in data.files}
+        if key not in layers:
+            raise FileNotFoundError(f"{key} is not in the pyramid; rebuild it with Pyramid.py build")
+        return layers[key], tuple(self.index['levels'][str(level)][key]['offset'])
+
+    @timed('compose')
+    def compose(self, head_name, torso_name, face_name, size=None):
+        """
+        Pet image at size x size pixels (full resolution when size is None).
+
+        Returns:
+            PIL.Image.Image: RGBA image.
+        """
+        level = self.level_for(size) if size else None
+        if level is None:
+            pet = self.full.compose(head_name, torso_name, face_name)
+            return pet if not size or pet.size == (size, size) else pet.resize((size, size), Image.LANCZOS)
+
+        body, offset = self.layer(level, _key('Body', os.path.basename(BODY)))
+        canvas = np.zeros((level, level, 4), dtype=np.uint8)
+        _over(canvas, body, offset)
+        names = {'Head': head_name, 'Torso': torso_name, 'Face': face_name}
+        for slot in LAYER_ORDER:
+            if names[slot]:  # unserved slots add no layer
+                _over(canvas, *self.layer(level, _key(slot, names[slot])))
+        pet = Image.fromarray(canvas, 'RGBa')
+        if level != size:
+            pet = pet.resize((size, size), Image.LANCZOS)
+        return pet.convert('RGBA')
+
+    def memory(self):
+        # Bytes of the cropped layers per level
+        return {level: sum(np.prod(entry['shape']) * 4 for entry in self.index['levels'][str(level)].values())
+                for level in self.levels}
+
+
+def report(pyramid, combos, size):
+    """
+    Speed and fidelity of pyramid rendering against downscaling the full composite.
+
+    Returns:
+        dict: Per-pet seconds of both paths, speedup, PSNR (dB) of the premultiplied
+        pixels, and layer memory of the level used against the full-resolution sources.
+    """
+    full_seconds, pyramid_seconds, errors = [], [], []
+    for head, torso, face in combos:
+        t0 = time.perf_counter()
+        reference = pyramid.full.compose(head, torso, face).convert('RGBa').resize((size, size), Image.LANCZOS)
+        t1 = time.perf_counter()
+        pet = pyramid.compose(head, torso, face, size)
+        t2 = time.perf_counter()
+        full_seconds.append(t1 - t0)
+        pyramid_seconds.append(t2 - t1)
+        diff = np.asarray(reference, dtype=np.float64) - premultiplied(pet)
+        errors.append(np.mean(diff ** 2))
+    level = pyramid.level_for(size)
+    full_bytes = sum(e['source_size'] ** 2 * 4 for e in pyramid.index['levels'][str(pyramid.levels[-1])].values())
+    mse = float(np.mean(errors))
+    return {'size': size, 'level': level,
+            'full_s': float(np.mean(full_seconds)), 'pyramid_s': float(np.mean(pyramid_seconds)),
+            'speedup': float(np.mean(full_seconds) / np.mean(pyramid_seconds)),
+            'psnr_db': float(10 * np.log10(255 ** 2 / mse)) if mse > 0 else np.inf,
+            'level_mb': float(pyramid.memory().get(level, 0)) / 2 ** 20, 'full_canvas_mb': full_bytes / 2 ** 20}
+
+
+def check(pyramid, face=None, max_error=2.0):
+    """
+    Check that every layer is indexed at every level and that a pet with the "Nothing" head
+    and torso composes at each level, close to the downscaled full-resolution composite.
+
+    Returns:
+        list: Problems found (empty when the pyramid is usable).
+    """
+    problems = []
+    keys = {level: set(pyramid.index['levels'][str(level)]) for level in pyramid.levels}
+    every = set().union(*keys.values()) if keys else set()
+    for level, present in keys.items():
+        problems += [f"{key} is missing at level {level}" for key in sorted(every - present)]
+    if face is None:
+        face = next((k.split('|')[1] for k in sorted(every) if k.startswith('Face|')), None)
+    if face is None:
+        return problems + ['No face in the pyramid']
+    reference = pyramid.full.compose('Nothing.png', 'Nothing.png', face).convert('RGBa')
+    for level in pyramid.levels:
+        try:
+            pet = pyramid.compose('Nothing.png', 'Nothing.png', face, level)
+        except FileNotFoundError as e:
+            problems.append(f"Level {level}: {e}")
+            continue
+        expected = np.asarray(reference.resize((level, level), Image.LANCZOS), dtype=np.float64)
+        error = float(np.abs(expected - premultiplied(pet)).mean())
+        if error > max_error:
+            problems.append(f"Level {level}: mean error {error:.2f} against the full-resolution pet")
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PET sprite pyramid')
+    parser.add_argument('command', choices=['build', 'report', 'check'])
+    parser.add_argument('--size', type=int, nargs='+', default=[256, 512, 1024])
+    opts = parser.parse_args()
+
+    if opts.command == 'build':
+        t0 = time.perf_counter()
+        index = build_pyramid()
+        print(f"Built levels {sorted(map(int, index['levels']))} in {time.perf_counter() - t0:.1f}s")
+    elif opts.command == 'check':
+        pyramid = SpritePyramid()
+        if not pyramid.levels:
+            raise SystemExit("No usable pyramid; build it with Pyramid.py build")
+        problems = check(pyramid)
+        print('\n'.join(problems) or f"Pyramid OK at levels {pyramid.levels}")
+        if problems:
+            raise SystemExit(1)
+    else:
+        pyramid = SpritePyramid()
+        available = {slot: [k.split('|')[1] for k in pyramid.index['levels'][str(pyramid.levels[0])]
+                            if k.startswith(slot + '|')] for slot in LAYER_ORDER}
+        combos = list(zip(available['Head'][:4], available['Torso'][:4], available['Face'][:4]))
+        for size in opts.size:
+            print(report(pyramid, combos, size))
@@ -0,0 +1,105 @@
+"""
+Memoized recommendations keyed on canonicalized user vectors.
+
+Many attendee vectors are exact or near duplicates (the 'extreme' profile of
+0_Real_dataset_generator.py only has 18 distinct vectors), so PetGen keeps the result of the
+Top-N / exact search in a bounded LRU cache in front of it.
+
+Keys are the user vector quantized to a grid of `step` (NaN as 0, -0.0 as 0.0), so vectors
+that round to the same grid point (step `CACHE_STEP` in PetGen.py) share one entry and get the
+result computed for the first of them.
+`step=0` keys on the exact float64 bytes. The cache can be persisted as JSON; the file
+records the catalog fingerprint, weights and search settings and is ignored if they no
+longer match.
+"""
+
+import os
+import json
+from collections import OrderedDict
+import numpy as np
+
+
+class RecommendationCache:
+    """
+    Bounded LRU cache of (head, torso, face, score) results.
+
+    Parameters:
+        step (float): Quantization step of the user vector; 0 disables quantization.
+        maxsize (int): Maximum number of entries kept.
+        path (str, optional): JSON file to load from and save to.
+        key (dict, optional): Settings the results depend on (see `RecTable.table_key`).
+    """
+
+    def __init__(self, step=0.01, maxsize=100_000, path=None, key=None):
+        self.step = step
+        self.maxsize = maxsize
+        self.path = path
+        self.key = dict(key or {}, step=step)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def canonical(self, user_vector):
+        # Quantized, canonical bytes of a user vector
+        v = np.nan_to_num(np.asarray(user_vector, dtype=np.float64), nan=0.0)
+        if self.step:
+            return (np.rint(v / self.step).astype(np.int64)).tobytes()
+        return (v + 0.0).tobytes()
+
+    def get(self, user_vector):
+        k = self.canonical(user_vector)
+        value = self.entries.get(k)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(k)
+        return value
+
+    def put(self, user_vector, value):
+        k = self.canonical(user_vector)
+        self.entries[k] = tuple(value)
+        self.entries.move_to_end(k)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get_or_compute(self, user_vector, compute):
+        """
+        Cached result for a user vector, calling `compute(user_vector)` on a miss.
+
+        `compute` must return (head, torso, face, score).
+        """
+        value = self.get(user_vector)
+        if value is None:
+            value = tuple(compute(user_vector))
+            self.put(user_vector, value)
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries),
+                'hit_rate': self.hits / total if total else 0.0}
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, path=None):
+        path = path or self.path
+        data = {'key': self.key,
+                'entries': [[k.hex(), [int(v) for v in value[:3]] + [float(value[3])]]
+                            for k, value in self.entries.items()]}
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def load(self, path=None):
+        path = path or self.path
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('key') != self.key:
+            return False  # built for another catalog / weights / step
+        for k, value in data['entries'][-self.maxsize:]:
+            self.entries[bytes.fromhex(k)] = tuple(value)
+        return True
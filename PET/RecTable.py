@@ -0,0 +1,259 @@
+"""
+Precomputed recommendation table for a known user population.
+
+The best (head, torso, face) of every user in 0_Diverse_users_100k.csv is computed once by
+a batch job and stored as a fixed-width binary table (a NumPy structured array saved as
+.npy) sorted by UserID. Opening it with mmap_mode='r' makes a lookup a binary search on the
+mapped UserID column, with nothing to parse.
+
+A JSON sidecar records the catalog fingerprint, score weights and N the table was built
+with, plus the per-slot accessory vectors. When AccessoryDataset.csv changes, only the users
+whose Top-N set of some slot could change are recomputed:
+- an added or changed accessory matters if its cosine with the user reaches the user's
+  N-th best cosine in that slot (it could enter the Top-N);
+- a removed or changed accessory matters if its old cosine reached it (it was in the Top-N).
+Every other user keeps its result, with indices remapped to the new catalog rows.
+
+Usage:
+    python RecTable.py build users.csv table.npy
+    python RecTable.py update users.csv table.npy
+    python RecTable.py lookup table.npy user_42
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+from Catalog import AccessoryCatalog, SLOTS, CATALOG_PATH
+from Scoring import WEIGHTS, best_combinations, similarities
+from UserStore import open_users
+
+FORMAT_VERSION = 1
+
+# Tolerance on the Top-N boundary so float rounding never hides an affected user
+_TOL = 1e-6
+
+
+def _dtype(id_width):
+    return np.dtype([
+        ('user_id', f'S{id_width}'),
+        ('head', np.int32),
+        ('torso', np.int32),
+        ('face', np.int32),
+        ('score', np.float32),
+        ('kth', np.float32, (3,)),   # N-th best cosine per slot (Head, Torso, Face)
+    ])
+
+
+def _meta_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def table_key(catalog, weights=WEIGHTS, N=10):
+    # Everything a stored result depends on besides the user vector
+    return {'catalog': catalog.fingerprint(), 'weights': [float(p) for p in weights], 'N': int(N)}
+
+
+def _kth_similarity(users, slot, N):
+    # N-th best cosine of each user in one slot; -inf when the whole slot fits in the Top-N
+    if len(slot) <= N:
+        return np.full(len(users), -np.inf, dtype=np.float32)
+    sims = similarities(users, slot)
+    return np.partition(sims, -N, axis=1)[:, -N].astype(np.float32)
+
+
+def compute_rows(user_ids, users, catalog, N=10, weights=WEIGHTS, block_size=4096):
+    """
+    Table rows (unsorted) for the given users.
+
+    Parameters:
+        user_ids (array-like): UserID per row of `users`.
+        users (np.ndarray): (U, G) user vectors.
+        catalog (AccessoryCatalog): Accessory catalog.
+        N (int): Top-N candidates per slot.
+        weights (tuple): Score weights.
+        block_size (int): Users per batch.
+
+    Returns:
+        np.ndarray: Structured array with the table dtype.
+    """
+    user_ids = np.asarray(user_ids).astype('S')
+    rows = np.zeros(len(users), dtype=_dtype(max(user_ids.dtype.itemsize, 1)))
+    rows['user_id'] = user_ids
+    for start in range(0, len(users), block_size):
+        block = users[start:start + block_size]
+        sl = slice(start, start + len(block))
+        best = best_combinations(block, *catalog.matrices(), N, weights)
+        for name in ('head', 'torso', 'face', 'score'):
+            rows[name][sl] = best[name]
+        for s, slot in enumerate(SLOTS):
+            rows['kth'][sl, s] = _kth_similarity(block, catalog.slots[slot], N)
+    return rows
+
+
+def write_table(path, rows, catalog, weights=WEIGHTS, N=10):
+    # Sorted by UserID so lookups are a binary search; written atomically
+    rows = np.sort(rows, order='user_id')
+    meta = table_key(catalog, weights, N)
+    meta.update({
+        'version': FORMAT_VERSION,
+        'n_users': int(len(rows)),
+        'genres': catalog.genres,
+        'slots': {slot: {'files': list(catalog.slots[slot].files),
+                         'vectors': catalog.slots[slot].vectors.tolist()} for slot in SLOTS},
+    })
+    tmp = path + '.tmp.npy'
+    np.save(tmp, rows)
+    with open(_meta_path(path) + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, path)
+    os.replace(_meta_path(path) + '.tmp', _meta_path(path))
+
+
+def build_table(path, user_ids, users, catalog, N=10, weights=WEIGHTS):
+    # Batch job: best combination of every user
+    rows = compute_rows(user_ids, users, catalog, N, weights)
+    write_table(path, rows, catalog, weights, N)
+    return len(rows)
+
+
+class RecTable:
+    """
+    Memory-mapped view of a recommendation table.
+
+    Parameters:
+        path (str): Table .npy file (its .json sidecar must sit next to it).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(_meta_path(path)) as f:
+            self.meta = json.load(f)
+        self.rows = np.load(path, mmap_mode='r')
+        self.files = {slot: self.meta['slots'][slot]['files'] for slot in SLOTS}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def is_current(self, catalog, weights=WEIGHTS, N=10):
+        key = table_key(catalog, weights, N)
+        return all(self.meta[k] == v for k, v in key.items())
+
+    def find(self, user_ids):
+        # Row positions of the given users, -1 for users not in the table
+        keys = np.asarray(user_ids).astype(self.rows.dtype['user_id'])
+        ids = self.rows['user_id']
+        pos = np.searchsorted(ids, keys)
+        pos = np.minimum(pos, len(ids) - 1)
+        found = ids[pos] == keys
+        return np.where(found, pos, -1)
+
+    def lookup(self, user_id):
+        """
+        Stored result of one user.
+
+        Returns:
+            dict: 'head', 'torso', 'face' rows and file names, and 'score'; None if the
+            user is not in the table.
+        """
+        pos = self.find([user_id])[0]
+        if pos < 0:
+            return None
+        row = self.rows[pos]
+        result = {'user_id': user_id, 'score': float(row['score'])}
+        for slot in SLOTS:
+            idx = int(row[slot.lower()])
+            result[slot.lower()] = idx
+            result[slot.lower() + '_file'] = self.files[slot][idx]
+        return result
+
+
+# ==========================================
+# Incremental recompute after catalog change
+# ==========================================
+
+def _slot_changes(old_files, old_vectors, slot):
+    # Accessories of one slot that entered or left, and the old -> new row mapping
+    old_index = {f: i for i, f in enumerate(old_files)}
+    new_index = {f: i for i, f in enumerate(slot.files)}
+    remap = np.array([new_index.get(f, -1) for f in old_files], dtype=np.int32)
+
+    entered, left = [], []
+    for f, j in new_index.items():
+        i = old_index.get(f)
+        if i is None or not np.array_equal(old_vectors[i], slot.vectors[j]):
+            entered.append(slot.vectors[j])
+            if i is not None:
+                left.append(old_vectors[i])
+    for f, i in old_index.items():
+        if f not in new_index:
+            left.append(old_vectors[i])
+    return np.array(entered).reshape(-1, slot.vectors.shape[1]), \
+        np.array(left).reshape(-1, slot.vectors.shape[1]), remap
+
+
+def update_table(path, user_ids, users, catalog, N=10, weights=WEIGHTS, block_size=4096):
+    """
+    Bring a table up to date with the current catalog and user list.
+
+    Users missing from the table are computed. If weights, N or the genre columns changed,
+    every user is recomputed; if only accessory rows changed, just the affected users are.
+
+    Returns:
+        dict: Counts of 'recomputed' and 'reused' users.
+    """
+    table = RecTable(path)
+    user_ids = np.asarray(user_ids)
+    pos = table.find(user_ids)
+    old = np.array(table.rows[np.maximum(pos, 0)])
+    known = pos >= 0
+
+    same_scoring = (table.meta['weights'] == [float(p) for p in weights]
+                    and table.meta['N'] == int(N) and table.meta['genres'] == catalog.genres)
+    if table.is_current(catalog, weights, N):
+        affected = ~known
+    elif not same_scoring:
+        affected = np.ones(len(users), dtype=bool)
+    else:
+        affected = ~known
+        for s, slot in enumerate(SLOTS):
+            old_slot = table.meta['slots'][slot]
+            old_vectors = np.array(old_slot['vectors'], dtype=np.float32).reshape(-1, len(catalog.genres))
+            entered, left, remap = _slot_changes(old_slot['files'], old_vectors, catalog.slots[slot])
+            kth = old['kth'][:, s]
+            for start in range(0, len(users), block_size):
+                sl = slice(start, start + block_size)
+                for changed in (entered, left):
+                    if len(changed):
+                        sims = similarities(users[sl], changed)
+                        affected[sl] |= (sims >= kth[sl, None] - _TOL).any(axis=1)
+            # Unaffected users only reference accessories that are still in the catalog
+            old[slot.lower()] = np.where(affected, 0, remap[old[slot.lower()]])
+
+    rows = old.astype(_dtype(max(user_ids.astype('S').dtype.itemsize, old.dtype['user_id'].itemsize)))
+    rows['user_id'] = user_ids.astype('S')
+    if affected.any():
+        rows[affected] = compute_rows(user_ids[affected], users[affected], catalog, N, weights, block_size)
+    write_table(path, rows, catalog, weights, N)
+    return {'recomputed': int(affected.sum()), 'reused': int((~affected).sum())}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precomputed PET recommendation table')
+    parser.add_argument('command', choices=['build', 'update', 'lookup'])
+    parser.add_argument('args', nargs='+', help='users.csv table.npy | table.npy UserID')
+    parser.add_argument('--catalog', default=CATALOG_PATH)
+    parser.add_argument('--N', type=int, default=10)
+    opts = parser.parse_args()
+
+    if opts.command == 'lookup':
+        print(RecTable(opts.args[0]).lookup(opts.args[1]))
+    else:
+        users_path, table_path = opts.args
+        users = open_users(users_path)
+        ids, vectors = users.ids, users.X
+        catalog = AccessoryCatalog.from_csv(opts.catalog)
+        if opts.command == 'build' or not os.path.exists(table_path):
+            print(f"Built table with {build_table(table_path, ids, vectors, catalog, opts.N)} users")
+        else:
+            print(update_table(table_path, ids, vectors, catalog, opts.N))
@@ -0,0 +1,367 @@
+"""
+Compact recommendation results: one row per user.
+
+1_TopN.py used to write four wide rows per user (the user and each accessory with all their
+genre values), which downstream scripts parsed back by position. The vectors are already
+in the catalog and the user store, so a result row only keeps what the search decided:
+
+    UserID, Head, Torso, Face          accessory file names
+    HeadIdx, TorsoIdx, FaceIdx         their rows in the catalog slots
+    Score, sim_global, w_error_score, min_sim, min_corr
+
+Rows of an unserved slot (see Assignment.py) are -1 with an empty name, and components a
+search does not report are NaN.
+
+`ResultWriter` streams chunks of rows to one of three formats, chosen by extension:
+
+- .csv      readable, appended chunk by chunk;
+- .parquet  one row group per chunk (needs `pyarrow`, imported only for Parquet files);
+- .npz      one array per column plus the catalog file names, so names are stored once.
+            Columns are spooled to temporary files and packed into the archive on close,
+            uncompressed, so readers memory-map them instead of loading the archive.
+
+Files appear atomically when the writer closes. `iter_results()` reads any of them back in
+chunks and `read_results()` whole; given a catalog, both check that the stored indices
+point at the stored names. `accessory_vectors()` and `user_vectors()` rejoin the genre
+vectors of a chunk from the catalog and the user store.
+
+Usage:
+    python Results.py 1_DResultados.npz --out 1_DResultados.parquet
+"""
+
+import os
+import shutil
+import zipfile
+import argparse
+import numpy as np
+import pandas as pd
+from Catalog import SLOTS
+from Scoring import COMPONENTS
+
+NAME_COLUMNS = SLOTS
+INDEX_COLUMNS = tuple(f'{slot}Idx' for slot in SLOTS)
+COLUMNS = ('UserID',) + NAME_COLUMNS + INDEX_COLUMNS + ('Score',) + COMPONENTS
+FORMATS = ('.csv', '.parquet', '.npz')
+FORMAT_VERSION = 1
+
+
+def result_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Unknown results format {ext!r}; use one of {FORMATS}")
+    return ext
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet results need pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+
+def result_frame(user_ids, best, catalog):
+    """
+    Result rows of one chunk.
+
+    Parameters:
+        user_ids (array-like): UserIDs of the chunk.
+        best (dict): `best_combinations()`-style output for the same users: 'head', 'torso',
+            'face' rows, 'score' and the component arrays (missing components are NaN).
+        catalog (AccessoryCatalog): Catalog the rows index into.
+
+    Returns:
+        pd.DataFrame: One row per user with `COLUMNS`.
+    """
+    n = len(user_ids)
+    df = pd.DataFrame({'UserID': np.asarray(user_ids, dtype=object)})
+    for slot in SLOTS:
+        # Assignment.py marks sold-out slots with -1: no name
+        idx = np.asarray(best[slot.lower()], dtype=np.intp)
+        df[slot] = np.where(idx >= 0, catalog.slots[slot].files[np.maximum(idx, 0)], '')
+    for slot, idx_col in zip(SLOTS, INDEX_COLUMNS):
+        df[idx_col] = np.asarray(best[slot.lower()], dtype=np.int32)
+    df['Score'] = np.asarray(best['score'], dtype=np.float64)
+    for name in COMPONENTS:
+        df[name] = np.asarray(best[name], dtype=np.float64) if name in best else np.full(n, np.nan)
+    return df
+
+
+class ResultWriter:
+    """
+    Streaming writer of result rows; a context manager.
+
+    Parameters:
+        path (str): Output file; the format follows the extension (.csv, .parquet, .npz).
+        catalog (AccessoryCatalog): Catalog of the accessory rows.
+    """
+
+    def __init__(self, path, catalog):
+        self.path = path
+        self.catalog = catalog
+        self.format = result_format(path)
+        self.tmp = f'{path}.{os.getpid()}.tmp'
+        self.rows = 0
+        self._parquet = None
+        self._spool = None
+        if self.format == '.npz':
+            self._spool = {name: open(f'{self.tmp}.{name}', 'wb') for name in COLUMNS if name not in NAME_COLUMNS}
+            self._id_width = 1
+
+    def write(self, user_ids, best):
+        # Appends the rows of one chunk (see result_frame)
+        self.write_frame(result_frame(user_ids, best, self.catalog))
+
+    def write_frame(self, df):
+        if self.format == '.csv':
+            df.to_csv(self.tmp, mode='a' if self.rows else 'w', header=not self.rows, index=False)
+        elif self.format == '.parquet':
+            pa = _pyarrow()
+            table = pa.Table.from_pandas(df[list(COLUMNS)], preserve_index=False)
+            if self._parquet is None:
+                schema = table.schema.with_metadata({b'pet_results': str(FORMAT_VERSION).encode(),
+                                                     b'catalog': self.catalog.fingerprint().encode()})
+                self._parquet = pa.parquet.ParquetWriter(self.tmp, schema)
+            self._parquet.write_table(table)
+        else:
+            ids = [str(u).encode('utf-8') for u in df['UserID']]
+            self._id_width = max([self._id_width] + [len(u) for u in ids])
+            self._spool['UserID'].write(b'\n'.join(ids) + b'\n' if ids else b'')
+            for name in INDEX_COLUMNS:
+                self._spool[name].write(np.ascontiguousarray(df[name], dtype='<i4').tobytes())
+            for name in ('Score',) + COMPONENTS:
+                self._spool[name].write(np.ascontiguousarray(df[name], dtype='<f8').tobytes())
+        self.rows += len(df)
+
+    def close(self):
+        if not self.rows and self.format != '.npz':
+            # Header / schema only
+            self.write([], {slot.lower(): np.empty(0, dtype=np.intp) for slot in SLOTS} | {'score': np.empty(0)})
+        if self.format == '.parquet':
+            self._parquet.close()
+        elif self.format == '.npz':
+            self._pack_npz()
+        os.replace(self.tmp, self.path)
+
+    def _pack_npz(self):
+        # Writes each spooled column into the archive as a .npy member, without loading it
+        for f in self._spool.values():
+            f.close()
+        try:
+            with zipfile.ZipFile(self.tmp, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+                self._member(zf, 'UserID', np.dtype(f'S{self._id_width}'), self._copy_ids)
+                for name in INDEX_COLUMNS:
+                    self._member(zf, name, np.dtype('<i4'), self._copy_raw(name))
+                for name in ('Score',) + COMPONENTS:
+                    self._member(zf, name, np.dtype('<f8'), self._copy_raw(name))
+                for slot in SLOTS:
+                    files = np.char.encode(self.catalog.slots[slot].files.astype(str), 'utf-8')
+                    with zf.open(f'{slot}_files.npy', 'w', force_zip64=True) as f:
+                        np.lib.format.write_array(f, files)
+                meta = np.array([f'{FORMAT_VERSION}', self.catalog.fingerprint()], dtype='S')
+                with zf.open('meta.npy', 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, meta)
+        finally:
+            for name in self._spool:
+                os.remove(f'{self.tmp}.{name}')
+
+    def _member(self, zf, name, dtype, copy):
+        with zf.open(f'{name}.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                    'fortran_order': False, 'shape': (self.rows,)})
+            copy(f)
+
+    def _copy_raw(self, name):
+        def copy(out):
+            with open(f'{self.tmp}.{name}', 'rb') as f:
+                shutil.copyfileobj(f, out, 2 ** 22)
+        return copy
+
+    def _copy_ids(self, out, chunk=1_000_000):
+        # Newline-separated UserIDs padded to the widest one
+        with open(f'{self.tmp}.UserID', 'rb') as f:
+            lines = []
+            for line in f:
+                lines.append(line[:-1])
+                if len(lines) == chunk:
+                    out.write(np.array(lines, dtype=f'S{self._id_width}').tobytes())
+                    lines = []
+            if lines:
+                out.write(np.array(lines, dtype=f'S{self._id_width}').tobytes())
+
+    def abort(self):
+        # Drops everything written so far
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._spool is not None:
+            for name, f in self._spool.items():
+                f.close()
+                if os.path.exists(f'{self.tmp}.{name}'):
+                    os.remove(f'{self.tmp}.{name}')
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def write_results(path, user_ids, best, catalog, chunk_size=1_000_000):
+    # All rows of a search at once, written chunk by chunk
+    with ResultWriter(path, catalog) as writer:
+        for start in range(0, len(user_ids), chunk_size):
+            sl = slice(start, start + chunk_size)
+            writer.write(user_ids[sl], {k: v[sl] for k, v in best.items() if np.ndim(v) == 1})
+    return path
+
+
+# ----------------------------------------------------------------------
+# Reading
+# ----------------------------------------------------------------------
+def _check(df, catalog):
+    for slot, idx_col in zip(SLOTS, INDEX_COLUMNS):
+        files = np.append(catalog.slots[slot].files, '')  # -1 -> no accessory
+        idx, names = df[idx_col].to_numpy(), df[slot].fillna('').astype(str).to_numpy()
+        if len(idx) and (idx.min() < -1 or idx.max() >= len(files) - 1
+                         or not np.array_equal(files[idx].astype(str), names)):
+            raise ValueError(f"{slot} rows of the results do not match the catalog; "
+                             f"they were written with a different one")
+
+
+def _npz_columns(path):
+    # Members of an .npz as arrays; uncompressed ones are memory-mapped in place, so chunks
+    # are read from disk on demand
+    columns = {}
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+        for info in zf.infolist():
+            name = info.filename[:-len('.npy')]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zf.open(info) as member:
+                    columns[name] = np.lib.format.read_array(member)
+                continue
+            # Local file header: 30 bytes, then the name and extra fields of their stored lengths
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(f.read(4), dtype='<u2')
+            f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) \
+                else np.lib.format.read_array_header_2_0
+            shape, fortran, dtype = read_header(f)
+            if dtype.hasobject or not np.prod(shape):
+                columns[name] = np.empty(shape, dtype=dtype)
+            else:
+                columns[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                          order='F' if fortran else 'C')
+    return columns
+
+
+def _iter_npz(path, chunk_size):
+    columns = _npz_columns(path)
+    # Row -1 (unserved slot) -> no name, as in result_frame()
+    files = {slot: np.append(np.char.decode(np.asarray(columns[f'{slot}_files']), 'utf-8').astype(object), '')
+             for slot in SLOTS}
+    for start in range(0, len(columns['UserID']), chunk_size):
+        sl = slice(start, start + chunk_size)
+        df = pd.DataFrame({'UserID': np.char.decode(np.asarray(columns['UserID'][sl]), 'utf-8').astype(object)})
+        for slot, idx_col in zip(SLOTS, INDEX_COLUMNS):
+            df[slot] = files[slot][np.asarray(columns[idx_col][sl])]
+        for name in INDEX_COLUMNS + ('Score',) + COMPONENTS:
+            df[name] = np.array(columns[name][sl])
+        yield df
+
+
+def iter_results(path, chunk_size=1_000_000, catalog=None):
+    """
+    Result rows in chunks of at most `chunk_size`.
+
+    Raises:
+        ValueError: If `catalog` is given and the stored rows do not match it.
+
+    Yields:
+        pd.DataFrame: `COLUMNS` of the next rows.
+    """
+    fmt = result_format(path)
+    if fmt == '.csv':
+        chunks = pd.read_csv(path, chunksize=chunk_size, dtype={'UserID': str},
+                             converters={slot: str for slot in SLOTS})
+    elif fmt == '.parquet':
+        pa = _pyarrow()
+        chunks = (batch.to_pandas() for batch in pa.parquet.ParquetFile(path).iter_batches(chunk_size))
+    else:
+        chunks = _iter_npz(path, chunk_size)
+    for df in chunks:
+        if catalog is not None:
+            _check(df, catalog)
+        yield df[list(COLUMNS)]
+
+
+def read_results(path, catalog=None):
+    chunks = list(iter_results(path, catalog=catalog))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=list(COLUMNS))
+
+
+def accessory_vectors(df, catalog):
+    """
+    Genre vectors of the chosen accessories of every row, from the catalog.
+
+    Returns:
+        dict: slot -> (n, G) float64 array, rounded like `SlotCatalog.vector()` (NaN rows
+        for unserved slots).
+    """
+    out = {}
+    for slot, idx_col in zip(SLOTS, INDEX_COLUMNS):
+        idx = df[idx_col].to_numpy()
+        vectors = catalog.slots[slot].vectors[np.maximum(idx, 0)].astype(np.float64).round(6)
+        vectors[idx < 0] = np.nan
+        out[slot] = vectors
+    return out
+
+
+def user_vectors(df, users, genres):
+    """
+    Genre vectors of the users of every row, from a UserStore, in `genres` order.
+
+    Raises:
+        KeyError: If a UserID is not in the store.
+    """
+    rows = users.rows(df['UserID'].to_numpy())
+    if (rows < 0).any():
+        raise KeyError(f"{df['UserID'].to_numpy()[rows < 0][0]} is not in {users.path}")
+    return np.asarray(users.X[rows], dtype=np.float64)[:, users.columns(genres)]
+
+
+def convert(src, dst, catalog=None, chunk_size=1_000_000):
+    # Copies results between formats; names and rows are rebuilt from the source
+    from Catalog import AccessoryCatalog
+
+    if catalog is None:
+        catalog = AccessoryCatalog.from_csv()
+    with ResultWriter(dst, catalog) as writer:
+        for df in iter_results(src, chunk_size, catalog):
+            writer.write_frame(df)
+    return writer.rows
+
+
+if __name__ == '__main__':
+    from Catalog import AccessoryCatalog, CATALOG_PATH
+
+    parser = argparse.ArgumentParser(description='Inspect or convert PET result files')
+    parser.add_argument('results', help='.csv, .parquet or .npz results')
+    parser.add_argument('--catalog', default=CATALOG_PATH)
+    parser.add_argument('--out', help='Convert to this file (format from its extension)')
+    opts = parser.parse_args()
+
+    catalog = AccessoryCatalog.from_csv(opts.catalog)
+    if opts.out:
+        print(f"{convert(opts.results, opts.out, catalog)} rows -> {opts.out}")
+    else:
+        df = read_results(opts.results, catalog)
+        print(df.head(10).to_string(index=False))
+        print(f"{len(df)} users, mean score {df['Score'].mean():.4f}")
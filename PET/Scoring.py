@@ -0,0 +1,256 @@
+"""
+Batched scoring engine for PET accessory combinations.
+
+The score of a (head, torso, face) triple for a user is
+
+    p1 * sim_global + p2 * w_error_score + p3 * min_sim + p4 * min_corr
+
+exactly as in the original per-triple `evaluate()`. Instead of calling sklearn and scipy
+once per triple, the terms are computed for all N^3 combinations of a whole block of users
+at once. Cosine and Pearson terms are expanded through dot products (the combo vector is
+the mean of three accessories), so only the weighted error needs the full genre axis.
+"""
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+from scipy.stats import pearsonr
+from Catalog import as_slot
+from Profiler import timed
+
+# Score weights (sim_global, w_error_score, min_sim, min_corr)
+WEIGHTS = (0.5, 0.2, 0.15, 0.15)
+
+COMPONENTS = ('sim_global', 'w_error_score', 'min_sim', 'min_corr')
+
+
+# ========================
+# Reference implementation
+# ========================
+
+def evaluate(user_vector, head, torso, face, p1, p2, p3, p4):
+    # Compute the average vector of the accessory combination
+    combo_vector = (head + torso + face) / 3
+
+    # Global similarity (cosine + Pearson)
+    cos_global = cosine_similarity([user_vector], [combo_vector])[0][0]
+    pearson_global = pearsonr(user_vector, combo_vector)[0]
+    sim_global = (cos_global + pearson_global) / 2
+
+    # Weighted error (gives more importance to genres the user likes)
+    error = np.abs(user_vector - combo_vector)
+    weighted_error = error * user_vector
+    w_error_score = 1 - (weighted_error.sum() / user_vector.sum())
+
+    # Minimum individual cosine similarity (ensures all accessories are at least decent)
+    sim_head = cosine_similarity([user_vector], [head])[0][0]
+    sim_torso = cosine_similarity([user_vector], [torso])[0][0]
+    sim_face = cosine_similarity([user_vector], [face])[0][0]
+    min_sim = min(sim_head, sim_torso, sim_face)
+
+    # Minimum Pearson correlation between each accessory and the user
+    corr_head = pearsonr(user_vector, head)[0]
+    corr_torso = pearsonr(user_vector, torso)[0]
+    corr_face = pearsonr(user_vector, face)[0]
+    min_corr = min(corr_head, corr_torso, corr_face)
+
+    # Final score combining all metrics
+    score = p1 * sim_global + p2 * w_error_score + p3 * min_sim + p4 * min_corr
+    return score
+
+
+# ========================
+# Vector helpers
+# ========================
+
+def _safe_div(num, den):
+    # Zero-norm vectors get similarity 0, like sklearn's cosine_similarity
+    out = np.zeros(np.broadcast(num, den).shape, dtype=np.result_type(num, den))
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+def _centered(X):
+    return X - X.mean(axis=-1, keepdims=True)
+
+
+def _unit_rows(X):
+    norms = np.linalg.norm(X, axis=-1, keepdims=True)
+    return _safe_div(X, norms)
+
+
+# ========================
+# Top-N retrieval
+# ========================
+
+@timed('top_n')
+def top_n_indices(users, candidates, N=10):
+    """
+    Indices of the N candidates most cosine-similar to each user, best first.
+
+    Parameters:
+        users (np.ndarray): (B, G) user vectors.
+        candidates (SlotCatalog or np.ndarray): Accessories of one slot.
+        N (int): Number of candidates to keep.
+
+    Returns:
+        np.ndarray: (B, min(N, M)) integer indices into `candidates`.
+    """
+    sims = similarities(users, candidates)
+    return np.argsort(sims, axis=1)[:, -N:][:, ::-1]
+
+
+def similarities(users, candidates):
+    # (B, M) cosine similarity of every user against every candidate of one slot
+    candidates = as_slot(candidates)
+    return _unit_rows(np.atleast_2d(users).astype(np.float64)) @ candidates.unit.T
+
+
+# ========================
+# Block scoring
+# ========================
+
+@timed('evaluate')
+def score_block(users, head_idx, torso_idx, face_idx, head, torso, face):
+    """
+    Score components for all combinations of the given candidates of a block of users.
+
+    Parameters:
+        users (np.ndarray): (B, G) user vectors.
+        head_idx, torso_idx, face_idx (np.ndarray): (B, Nh), (B, Nt), (B, Nf) candidate
+            indices per user into the corresponding slot.
+        head, torso, face (SlotCatalog or np.ndarray): Accessories per slot.
+
+    Returns:
+        dict: `COMPONENTS` mapped to (B, Nh, Nt, Nf) arrays.
+    """
+    head, torso, face = as_slot(head), as_slot(torso), as_slot(face)
+    U = np.atleast_2d(users).astype(np.float64)
+    Uc = _centered(U)
+    norm_u = np.linalg.norm(U, axis=1)
+    norm_uc = np.linalg.norm(Uc, axis=1)
+
+    # Gather the candidates and their precomputed terms: (B, N, G) and (B, N)
+    slots = ((head, head_idx), (torso, torso_idx), (face, face_idx))
+    X = [s.vectors[idx].astype(np.float64) for s, idx in slots]
+    Xc = [s.centered[idx].astype(np.float64) for s, idx in slots]
+    sq = [s.sq_norms[idx] for s, idx in slots]
+    sq_c = [s.centered_sq_norms[idx] for s, idx in slots]
+
+    def expand(a, b, c):
+        # (B, Nh), (B, Nt), (B, Nf) -> (B, Nh, Nt, Nf) sum
+        return a[:, :, None, None] + b[:, None, :, None] + c[:, None, None, :]
+
+    def combo_similarity(U, A, sq, norm_u):
+        # cos(u, (h + t + f) / 3) expanded through dot products; the 1/3 cancels out
+        H, T, F = A
+        num = expand(*(np.einsum('bg,big->bi', U, M) for M in A))
+        combo_sq = (expand(*sq)
+                    + 2 * np.einsum('big,bjg->bij', H, T)[:, :, :, None]
+                    + 2 * np.einsum('big,bkg->bik', H, F)[:, :, None, :]
+                    + 2 * np.einsum('bjg,bkg->bjk', T, F)[:, None, :, :])
+        return num, norm_u[:, None, None, None] * np.sqrt(np.maximum(combo_sq, 0))
+
+    # Global similarity: cosine on raw vectors, Pearson = cosine on centered vectors
+    cos_global = _safe_div(*combo_similarity(U, X, sq, norm_u))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        num, den = combo_similarity(Uc, Xc, sq_c, norm_uc)
+        pearson_global = num / den
+    sim_global = (cos_global + pearson_global) / 2
+
+    # Weighted error needs the full combo vector: sum(|3u - h - t - f| * u) / 3
+    H, T, F = X
+    diff = (3 * U[:, None, :] - H)[:, :, None, None, :] - (T[:, None, :, None, :] + F[:, None, None, :, :])
+    np.abs(diff, out=diff)
+    weighted_error = np.matmul(diff, U[:, None, None, :, None])[..., 0] / 3
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w_error_score = 1 - weighted_error / U.sum(axis=1)[:, None, None, None]
+
+    # Minimum individual cosine similarity and Pearson correlation
+    sims = [_safe_div(np.einsum('bg,big->bi', U, M), norm_u[:, None] * np.sqrt(q)) for M, q in zip(X, sq)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corrs = [np.einsum('bg,big->bi', Uc, M) / (norm_uc[:, None] * np.sqrt(q)) for M, q in zip(Xc, sq_c)]
+
+    def expand_min(a, b, c):
+        return np.minimum(np.minimum(a[:, :, None, None], b[:, None, :, None]), c[:, None, None, :])
+
+    return {
+        'sim_global': sim_global,
+        'w_error_score': w_error_score,
+        'min_sim': expand_min(*sims),
+        'min_corr': expand_min(*corrs),
+    }
+
+
+def combine(components, weights=WEIGHTS):
+    # Final score combining all metrics
+    return sum(p * components[name] for p, name in zip(weights, COMPONENTS))
+
+
+# ===============================
+# Best combination per user
+# ===============================
+
+def _candidates(users, slot, N, index=None):
+    # Top-N rows of one slot, from a retrieval index when given (see Retrieval.py)
+    if index is None:
+        return top_n_indices(users, slot, N)
+    idx, _ = index.search(users, N)
+    # Approximate indexes may find fewer than N; repeat the best one (ties keep the first)
+    idx = np.where(idx < 0, idx[:, :1], idx)
+    # Users whose probed lists were all empty get the exact Top-N
+    empty = idx[:, 0] < 0
+    if empty.any():
+        idx[empty] = top_n_indices(users[empty], slot, idx.shape[1])
+    return idx
+
+
+def best_combinations(users, head, torso, face, N=10, weights=WEIGHTS, block_size=64, indexes=None):
+    """
+    Best Top-N (head, torso, face) combination for every user.
+
+    Users are processed in blocks of `block_size`; memory grows with block_size * N^3 * G.
+    Ties are resolved like the original triple loop: the first combination in
+    (head, torso, face) Top-N order wins.
+
+    Parameters:
+        users (np.ndarray): (U, G) user vectors.
+        head, torso, face (SlotCatalog or np.ndarray): Accessories per slot.
+        N (int): Top-N candidates per slot.
+        weights (tuple): Score weights (p1, p2, p3, p4).
+        block_size (int): Users scored per block.
+        indexes (tuple, optional): (head, torso, face) retrieval indexes from Retrieval.py
+            used for the Top-N step; exact sorting of all similarities when None.
+
+    Returns:
+        dict: 'head', 'torso', 'face' row indices into the slots, the final 'score' and
+        each of `COMPONENTS`, all arrays of length U.
+    """
+    head, torso, face = as_slot(head), as_slot(torso), as_slot(face)
+    users = np.atleast_2d(users)
+    n_users = len(users)
+    result = {name: np.empty(n_users, dtype=np.intp) for name in ('head', 'torso', 'face')}
+    for name in ('score',) + COMPONENTS:
+        result[name] = np.empty(n_users, dtype=np.float64)
+
+    for start in range(0, n_users, block_size):
+        block = users[start:start + block_size]
+        idx = tuple(_candidates(block, slot, N, index)
+                    for slot, index in zip((head, torso, face), indexes or (None,) * 3))
+        components = score_block(block, *idx, head, torso, face)
+        score = combine(components, weights)
+
+        # NaN scores (constant vectors) never win, as `score > best_score` is False for them
+        flat = np.where(np.isnan(score), -np.inf, score).reshape(len(block), -1)
+        best = flat.argmax(axis=1)
+        i, j, k = np.unravel_index(best, score.shape[1:])
+        rows = np.arange(len(block))
+        sl = slice(start, start + len(block))
+
+        result['head'][sl] = idx[0][rows, i]
+        result['torso'][sl] = idx[1][rows, j]
+        result['face'][sl] = idx[2][rows, k]
+        result['score'][sl] = score[rows, i, j, k]
+        for name in COMPONENTS:
+            result[name][sl] = components[name][rows, i, j, k]
+
+    return result
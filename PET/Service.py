@@ -0,0 +1,295 @@
+"""
+Resident PET recommendation service with micro-batching.
+
+PetGen.py pays a Python start, the catalog CSV load and a single-user search for every pet.
+This asyncio server loads the catalog (and optionally a user store) once and answers
+single-user requests over HTTP on TCP or a Unix socket:
+
+    POST /recommend   {"user_id": "user_42"}                (vector looked up in --users)
+                      {"user_id": "kiosk-7", "vector": [18 affinities, catalog genre order]}
+                   -> {"user_id", "head", "torso", "face", "score", "pet", "batch_size"}
+    GET  /stats       requests, batches, mean batch size, p50 / p99 latency (ms), throughput
+
+Requests wait in a queue; `MicroBatcher` takes the first one and keeps collecting until
+`max_batch` requests or `max_wait` seconds have passed, then scores the whole batch with one
+`best_combinations()` call (array operations over the batch) in a worker thread, so the
+event loop keeps accepting requests meanwhile. Pets of the batch are rendered once per
+distinct triple through the content-addressed `PetCache` (see PetCache.py); "pet" is the path
+of the cached image, or null with an "error" when an accessory image is missing. "score" is
+null when it is undefined (a constant vector has no correlation with any accessory); vectors
+with NaN or infinite values are rejected.
+
+Usage:
+    python Service.py --port 8765 --max-batch 64 --max-wait-ms 5 --size 512
+    python Service.py --unix /tmp/pet.sock --users Diverse_users_100k.npy
+    curl -s localhost:8765/recommend -d '{"user_id": "user_42"}'
+"""
+
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+import numpy as np
+from Catalog import AccessoryCatalog, CATALOG_PATH
+from Scoring import WEIGHTS, best_combinations
+from Pyramid import SpritePyramid
+from PetCache import PetCache
+from UserStore import open_users
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            500: 'Internal Server Error'}
+
+
+class LatencyStats:
+    """
+    Request counters with a sliding window of latencies.
+
+    Parameters:
+        window (int): Latest latencies kept for the percentiles.
+    """
+
+    def __init__(self, window=10_000):
+        self.latencies = deque(maxlen=window)
+        self.finished = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched = 0
+        self.started = time.perf_counter()
+
+    def add_batch(self, size):
+        self.batches += 1
+        self.batched += size
+
+    def add(self, seconds, error=False):
+        self.requests += 1
+        self.errors += bool(error)
+        self.latencies.append(seconds)
+        self.finished.append(time.perf_counter())
+
+    def snapshot(self):
+        lat = np.array(self.latencies) * 1000
+        now = time.perf_counter()
+        recent = (len(self.finished) - 1) / (self.finished[-1] - self.finished[0]) \
+            if len(self.finished) > 1 and self.finished[-1] > self.finished[0] else 0.0
+        return {'requests': self.requests, 'errors': self.errors, 'batches': self.batches,
+                'mean_batch': self.batched / self.batches if self.batches else 0.0,
+                'p50_ms': float(np.percentile(lat, 50)) if len(lat) else None,
+                'p99_ms': float(np.percentile(lat, 99)) if len(lat) else None,
+                'throughput_rps': self.requests / (now - self.started),
+                'recent_rps': recent}
+
+
+class MicroBatcher:
+    """
+    Collects single requests into batches for a blocking batch handler.
+
+    Parameters:
+        handler (callable): handler(list of items) -> list of results, run in a thread.
+        max_batch (int): Largest batch.
+        max_wait (float): Seconds the first request of a batch waits for others.
+        stats (LatencyStats, optional): Batch counters.
+    """
+
+    def __init__(self, handler, max_batch=64, max_wait=0.005, stats=None):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = stats
+        self.queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            if self.stats is not None:
+                self.stats.add_batch(len(batch))
+            try:
+                results = await loop.run_in_executor(None, self.handler, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class PetService:
+    """
+    Catalog, renderer and batcher of the service.
+
+    Parameters:
+        catalog (AccessoryCatalog): Loaded once.
+        users (UserStore, optional): For requests with a UserID and no vector.
+        N (int): Top-N candidates per slot.
+        size (int, optional): Pet size in pixels; None renders the 3780 px sources.
+        render (bool): Whether pets are rendered; "pet" is null otherwise.
+    """
+
+    def __init__(self, catalog, users=None, N=10, weights=WEIGHTS, size=None, render=True,
+                 max_batch=64, max_wait=0.005):
+        self.catalog = catalog
+        self.slots = catalog.matrices()
+        self.users = users
+        self.N = N
+        self.weights = weights
+        self.size = size
+        self.renderer = SpritePyramid() if render else None
+        self.pet_cache = PetCache() if render else None
+        self.stats = LatencyStats()
+        self.batcher = MicroBatcher(self.recommend_batch, max_batch, max_wait, self.stats)
+
+    def vector_of(self, request):
+        # Request vector, or the stored one of its UserID
+        if 'vector' in request:
+            vector = np.asarray(request['vector'], dtype=np.float64)
+            if vector.shape != (len(self.catalog.genres),):
+                raise ValueError(f"Expected {len(self.catalog.genres)} genre values, got {vector.shape}")
+            if not np.isfinite(vector).all():
+                raise ValueError("Genre values must be finite numbers")
+            return vector
+        if self.users is None:
+            raise ValueError("Request has no vector and the service has no user store")
+        return np.asarray(self.users.vector(request['user_id'], self.catalog.genres), dtype=np.float64)
+
+    def recommend_batch(self, requests):
+        # Blocking: score the whole batch at once, then render each distinct triple once
+        users = np.vstack([vector for _, vector in requests])
+        best = best_combinations(users, *self.slots, self.N, self.weights)
+        head, torso, face = (self.catalog.slots[s].files for s in ('Head', 'Torso', 'Face'))
+        pets = {}
+        results = []
+        for i, (user_id, _) in enumerate(requests):
+            triple = (head[best['head'][i]], torso[best['torso'][i]], face[best['face'][i]])
+            score = float(best['score'][i])
+            result = {'user_id': user_id, 'head': triple[0], 'torso': triple[1], 'face': triple[2],
+                      'score': score if np.isfinite(score) else None, 'pet': None,
+                      'batch_size': len(requests)}
+            if self.renderer is not None:
+                if triple not in pets:
+                    try:
+                        pets[triple] = (self.pet_cache.get_or_render(*triple, self.size, self.renderer.compose,
+                                                                     load=False)[0], None)
+                    except FileNotFoundError as e:
+                        pets[triple] = (None, str(e))
+                result['pet'], error = pets[triple]
+                if error:
+                    result['error'] = error
+            results.append(result)
+        return results
+
+    async def recommend(self, request):
+        start = time.perf_counter()
+        try:
+            vector = self.vector_of(request)
+            result = await self.batcher.submit((request.get('user_id'), vector))
+        except Exception:
+            self.stats.add(time.perf_counter() - start, error=True)
+            raise
+        self.stats.add(time.perf_counter() - start)
+        return result
+
+    # ------------------------------------------------------------------
+    # HTTP
+    # ------------------------------------------------------------------
+    async def handle(self, reader, writer):
+        # Minimal HTTP/1.1 with keep-alive: one JSON request and response at a time
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, _ = line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await self.route(method, path, body)
+                data = json.dumps(payload, allow_nan=False).encode()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}"
+                             f"\r\n\r\n".encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        path = path.split('?')[0]
+        if path == '/stats':
+            return 200, self.stats.snapshot()
+        if path != '/recommend':
+            return 404, {'error': f'Unknown path {path}'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}
+        try:
+            return 200, await self.recommend(json.loads(body or b'{}'))
+        except (ValueError, KeyError) as e:
+            return 400, {'error': f'{type(e).__name__}: {e}'}
+        except Exception as e:
+            return 500, {'error': f'{type(e).__name__}: {e}'}
+
+    async def serve(self, host='127.0.0.1', port=8765, unix=None):
+        self.batcher.start()
+        if unix:
+            server = await asyncio.start_unix_server(self.handle, path=unix)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        where = unix or f'http://{host}:{port}'
+        print(f"PET service on {where} (batch <= {self.batcher.max_batch}, "
+              f"wait {self.batcher.max_wait * 1000:g} ms)")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resident PET recommendation service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='Listen on this Unix socket instead of TCP')
+    parser.add_argument('--catalog', default=CATALOG_PATH)
+    parser.add_argument('--users', help='Users CSV or user store .npy, for lookups by UserID')
+    parser.add_argument('--N', type=int, default=10)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--size', type=int, default=None, help='Pet size in pixels (default: full size)')
+    parser.add_argument('--no-render', action='store_true', help='Only recommend, do not render pets')
+    opts = parser.parse_args()
+
+    service = PetService(AccessoryCatalog.from_csv(opts.catalog),
+                         open_users(opts.users) if opts.users else None, opts.N,
+                         size=opts.size, render=not opts.no_render,
+                         max_batch=opts.max_batch, max_wait=opts.max_wait_ms / 1000)
+    try:
+        asyncio.run(service.serve(opts.host, opts.port, opts.unix))
+    except KeyboardInterrupt:
+        pass
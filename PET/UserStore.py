@@ -0,0 +1,255 @@
+"""
+Binary user store: float32 matrix file + UserID index, opened by memory mapping.
+
+Parsing the users CSV (text floats into float64) dominates short PET runs and grows
+linearly with the population. A user store is written once and then opened in
+milliseconds whatever its size:
+
+    users.npy        (users x genres) float32 matrix, C (row) or Fortran (column) order
+    users.json       genres, row count and the UserID scheme
+    users.ids.npy    UserIDs as fixed-width bytes, when they are not 'user_<row + 1>'
+
+0_Real_dataset_generator.py writes this layout directly (column order, implicit IDs);
+`convert_csv()` builds it from any users CSV (row order, so chunks of rows are contiguous).
+`open_users()` accepts either format: a CSV is converted on first use into a store next to
+it and re-converted only when the CSV is newer than the store.
+
+Rows are zero-copy slices of the memory map (`store.X[a:b]`, `store.chunks()`), and
+`row(user_id)` is O(1): arithmetic for implicit IDs, a hash index built on first lookup
+otherwise.
+
+Usage:
+    python UserStore.py convert users.csv [--out users.npy]
+    python UserStore.py lookup users.npy user_42
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from Profiler import timed
+
+FORMAT_VERSION = 1
+
+
+def _meta_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def _ids_path(path):
+    return os.path.splitext(path)[0] + '.ids.npy'
+
+
+def store_path(csv_path):
+    # Store converted from a CSV: same folder and name, .npy extension
+    return os.path.splitext(csv_path)[0] + '.npy'
+
+
+class UserStore:
+    """
+    Memory-mapped users matrix with UserID lookup.
+
+    Parameters:
+        path (str): The .npy matrix; its .json (and .ids.npy) sit next to it.
+
+    Attributes:
+        X (np.memmap): (n, G) float32 user vectors.
+        genres (list): Column names of X.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(_meta_path(path)) as f:
+            self.meta = json.load(f)
+        self.genres = list(self.meta['genres'])
+        self.X = np.load(path, mmap_mode='r')
+        if self.X.shape != (self.meta['rows'], len(self.genres)):
+            raise ValueError(f"{path} has shape {self.X.shape}, its metadata says "
+                             f"{(self.meta['rows'], len(self.genres))}")
+        self.prefix = self.meta.get('id_prefix')
+        self.id_start = self.meta.get('id_start', 1)
+        self._raw_ids = None if self.prefix is not None else np.load(_ids_path(path), mmap_mode='r')
+        self._index = None
+
+    def __len__(self):
+        return len(self.X)
+
+    # ------------------------------------------------------------------
+    # UserIDs
+    # ------------------------------------------------------------------
+    def user_ids(self, start=0, stop=None):
+        # UserIDs of rows [start, stop) as an object array
+        stop = len(self) if stop is None else min(stop, len(self))
+        if self._raw_ids is None:
+            return np.array([f'{self.prefix}{i + self.id_start}' for i in range(start, stop)], dtype=object)
+        return np.char.decode(self._raw_ids[start:stop], 'utf-8').astype(object)
+
+    @property
+    def ids(self):
+        return self.user_ids()
+
+    def row(self, user_id):
+        """
+        Row of one UserID.
+
+        Raises:
+            KeyError: If the UserID is not in the store.
+        """
+        if self._raw_ids is None:
+            user_id = str(user_id)
+            suffix = user_id[len(self.prefix):]
+            if user_id.startswith(self.prefix) and suffix.isdigit():
+                row = int(suffix) - self.id_start
+                if 0 <= row < len(self) and str(row + self.id_start) == suffix:
+                    return row
+            raise KeyError(user_id)
+        if self._index is None:
+            self._index = pd.Index(np.asarray(self._raw_ids))
+        loc = self._index.get_indexer([str(user_id).encode('utf-8')])[0]
+        if loc < 0:
+            raise KeyError(user_id)
+        return int(loc)
+
+    def rows(self, user_ids):
+        # Rows of many UserIDs (-1 for unknown ones), in one vectorized lookup
+        ids = np.asarray(user_ids).astype(str)
+        if not len(ids):
+            return np.empty(0, dtype=np.int64)
+        if self._raw_ids is None:
+            # '<prefix><n>' without sign or leading zeros, for rows in range
+            pre = np.char.startswith(ids, self.prefix)
+            suffix = np.where(pre, np.char.replace(ids, self.prefix, '', count=1), '')
+            digits = np.char.isdigit(suffix) & (np.char.str_len(suffix) <= 18)
+            num = np.zeros(len(ids), dtype=np.int64)
+            num[digits] = suffix[digits].astype(np.int64)
+            canonical = digits & (num.astype(str) == suffix)
+            rows = num - self.id_start
+            ok = canonical & (rows >= 0) & (rows < len(self))
+            return np.where(ok, rows, -1)
+        if self._index is None:
+            self._index = pd.Index(np.asarray(self._raw_ids))
+        return self._index.get_indexer(np.char.encode(ids, 'utf-8')).astype(np.int64)
+
+    def vector(self, user_id, genres=None):
+        vector = self.X[self.row(user_id)]
+        return vector if genres is None else vector[self.columns(genres)]
+
+    # ------------------------------------------------------------------
+    # Vectors
+    # ------------------------------------------------------------------
+    def columns(self, genres):
+        # Column of every genre
+        missing = [g for g in genres if g not in self.genres]
+        if missing:
+            raise ValueError(f"Genres not in the store: {missing}")
+        return [self.genres.index(g) for g in genres]
+
+    def vectors(self, genres=None):
+        # All vectors, with the columns reordered to `genres` when given (a copy then)
+        if genres is None or list(genres) == self.genres:
+            return self.X
+        return self.X[:, self.columns(genres)]
+
+    def chunks(self, chunk_size=1_000_000):
+        # (first row, UserIDs, zero-copy view of the rows) per chunk
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            yield start, self.user_ids(start, stop), self.X[start:stop]
+
+    def to_frame(self, start=0, stop=None):
+        # Users CSV layout: UserID + one column per genre
+        stop = len(self) if stop is None else stop
+        df = pd.DataFrame(np.asarray(self.X[start:stop]), columns=self.genres)
+        df.insert(0, 'UserID', self.user_ids(start, stop))
+        return df
+
+
+def _count_rows(csv_path, block=2 ** 24):
+    # Data rows of a CSV (newlines minus the header), without parsing it
+    lines, last = 0, b'\n'
+    with open(csv_path, 'rb') as f:
+        while True:
+            data = f.read(block)
+            if not data:
+                break
+            lines += data.count(b'\n')
+            last = data[-1:]
+    return lines + (last != b'\n') - 1
+
+
+def convert_csv(csv_path, out_path=None, chunksize=1_000_000):
+    """
+    Write the user store of a users CSV (UserID + one column per genre), in chunks.
+
+    Returns:
+        UserStore: The new store.
+    """
+    out_path = out_path or store_path(csv_path)
+    genres = list(pd.read_csv(csv_path, nrows=0).columns[1:])
+    n = _count_rows(csv_path)
+
+    tmp = out_path + '.tmp'
+    X = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(n, len(genres)))
+    ids, start = [], 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize, dtype={'UserID': str},
+                             float_precision='high'):
+        X[start:start + len(chunk)] = chunk[genres].values
+        ids.append(chunk['UserID'].values)
+        start += len(chunk)
+    if start != n:
+        raise ValueError(f"{csv_path}: counted {n} rows but parsed {start}")
+    X.flush()
+    del X
+
+    # IDs of the generator scheme need no file
+    ids = np.concatenate(ids) if ids else np.array([], dtype=object)
+    meta = {'version': FORMAT_VERSION, 'genres': genres, 'rows': n, 'order': 'C',
+            'source': os.path.abspath(csv_path), 'source_mtime': os.path.getmtime(csv_path)}
+    if n and np.array_equal(ids, [f'user_{i + 1}' for i in range(n)]):
+        meta.update(id_prefix='user_', id_start=1)
+    else:
+        encoded = np.char.encode(ids.astype(str), 'utf-8')
+        np.save(_ids_path(out_path) + '.tmp.npy', encoded)
+        os.replace(_ids_path(out_path) + '.tmp.npy', _ids_path(out_path))
+
+    os.replace(tmp, out_path)
+    with open(_meta_path(out_path) + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(_meta_path(out_path) + '.tmp', _meta_path(out_path))
+    return UserStore(out_path)
+
+
+@timed('load_users')
+def open_users(path):
+    """
+    User store of a .npy store or a users CSV (converted next to it on first use).
+
+    Returns:
+        UserStore: The opened store.
+    """
+    if not path.lower().endswith('.csv'):
+        return UserStore(path)
+    converted = store_path(path)
+    # The metadata is written last, by convert_csv() and by the generator alike
+    if os.path.exists(converted) and os.path.exists(_meta_path(converted)) \
+            and os.path.getmtime(_meta_path(converted)) >= os.path.getmtime(path):
+        return UserStore(converted)
+    return convert_csv(path, converted)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Binary PET user store')
+    parser.add_argument('command', choices=['convert', 'lookup'])
+    parser.add_argument('path', help='Users CSV (convert) or store .npy / CSV (lookup)')
+    parser.add_argument('user_id', nargs='?')
+    parser.add_argument('--out', help='Store path (default: next to the CSV)')
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    opts = parser.parse_args()
+
+    if opts.command == 'convert':
+        store = convert_csv(opts.path, opts.out, opts.chunksize)
+        print(f"{len(store)} users x {len(store.genres)} genres -> {store.path}")
+    else:
+        store = open_users(opts.path)
+        print(dict(zip(store.genres, store.vector(opts.user_id).tolist())))
@@ -0,0 +1,272 @@
+"""
+Score-weight sweeps over cached score components.
+
+The final score is a linear mix of four components,
+
+    p1 * sim_global + p2 * w_error_score + p3 * min_sim + p4 * min_corr
+
+and the Top-N candidate sets do not depend on the weights. So the components are computed
+once per (user, Top-N combination) and cached; re-ranking under any weight vector is then
+a matrix product followed by a per-user max.
+
+For non-negative weights the winner is always a Pareto-optimal candidate (no other
+candidate is at least as good in all four components and better in one), so only those are
+kept. That is a handful of rows per user instead of N^3. The cache is stored as CSR-style
+arrays: `offsets` into a (M, 4) float32 component matrix and a (M, 3) triple matrix, saved
+with the key it was built for (users file size and mtime, catalog fingerprint, N); a cache
+whose key no longer matches is rebuilt.
+
+Usage:
+    python WeightSweep.py users.csv --cache candidates.npz --step 0.05 --out sweep.csv
+"""
+
+import os
+import json
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from Catalog import AccessoryCatalog, CATALOG_PATH
+from Scoring import COMPONENTS, WEIGHTS, top_n_indices, score_block
+from UserStore import open_users
+
+# Pivots per user used to discard dominated candidates before the exact Pareto check
+_PIVOTS = 16
+
+# Component value of the placeholder row of users without any valid candidate
+_INVALID = -1e9
+
+
+class CandidateCache:
+    """
+    Pareto-optimal candidates of every user, with their four score components.
+
+    Attributes:
+        offsets (np.ndarray): (U + 1,) start of each user's rows.
+        components (np.ndarray): (M, 4) float32 components, in `COMPONENTS` order.
+        triples (np.ndarray): (M, 3) int32 (head, torso, face) catalog rows; -1 marks the
+            placeholder row of a user without any valid candidate.
+        slot_sizes (tuple): Number of accessories per slot, for usage statistics.
+        key (dict): What the cache was built from (see `cache_key()`), None if unknown.
+    """
+
+    def __init__(self, offsets, components, triples, slot_sizes, key=None):
+        self.offsets = offsets
+        self.components = components
+        self.triples = triples
+        self.slot_sizes = tuple(int(n) for n in slot_sizes)
+        self.key = key
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def save(self, path):
+        np.savez(path, offsets=self.offsets, components=self.components,
+                 triples=self.triples, slot_sizes=np.array(self.slot_sizes),
+                 key=np.array(json.dumps(self.key, sort_keys=True)))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        key = json.loads(str(data['key'])) if 'key' in data.files else None
+        return cls(data['offsets'], data['components'], data['triples'], data['slot_sizes'], key)
+
+
+def cache_key(users_path, catalog, N=10):
+    # Everything the cached candidates depend on
+    stat = os.stat(users_path)
+    return {'users': os.path.abspath(users_path), 'users_bytes': stat.st_size, 'users_mtime': stat.st_mtime,
+            'catalog': catalog.fingerprint(), 'N': int(N)}
+
+
+def _dominated(P, Q):
+    # (B, n) True where a row of P is strictly dominated by some row of Q: (B, n, 4), (B, m, 4).
+    # Works one component at a time; reducing over a trailing axis of 4 is much slower.
+    ge = gt = None
+    for c in range(P.shape[-1]):
+        q, p = Q[:, :, None, c], P[:, None, :, c]
+        ge = (q >= p) if ge is None else ge & (q >= p)
+        gt = (q > p) if gt is None else gt | (q > p)
+    return (ge & gt).any(1)
+
+
+def _top_rows(X, keys, k):
+    order = np.argsort(-keys, axis=1)[:, :k]
+    return np.take_along_axis(X, order[..., None], axis=1)
+
+
+def pareto_block(X):
+    """
+    Pareto-optimal candidates of a block of users.
+
+    Parameters:
+        X (np.ndarray): (B, C, 4) components per user and candidate; rows with NaN are invalid.
+
+    Returns:
+        np.ndarray: (B, C) boolean mask of the kept candidates.
+    """
+    valid = ~np.isnan(X).any(-1)
+    X = np.where(valid[..., None], X, -np.inf)
+
+    # Cheap pass: drop everything dominated by a few strong candidates (best by component
+    # sum and best by each single component)
+    pivots = [_top_rows(X, X.sum(-1), _PIVOTS // 2)]
+    pivots += [_top_rows(X, X[..., c], _PIVOTS // (2 * X.shape[-1])) for c in range(X.shape[-1])]
+    mask = valid & ~_dominated(X, np.concatenate(pivots, axis=1))
+
+    # Exact pass among the survivors of each user
+    for b in range(len(X)):
+        keep = np.flatnonzero(mask[b])
+        S = X[b, keep][None]
+        mask[b, keep[_dominated(S, S)[0]]] = False
+    return mask
+
+
+def build_cache(users, catalog, N=10, block_size=64):
+    """
+    Compute the component cache for every user.
+
+    Parameters:
+        users (np.ndarray): (U, G) user vectors.
+        catalog (AccessoryCatalog): Accessory catalog.
+        N (int): Top-N candidates per slot.
+        block_size (int): Users scored per block.
+
+    Returns:
+        CandidateCache
+    """
+    head, torso, face = catalog.matrices()
+    counts, components, triples = [], [], []
+    for start in range(0, len(users), block_size):
+        block = users[start:start + block_size]
+        idx = [top_n_indices(block, slot, N) for slot in (head, torso, face)]
+        c = score_block(block, *idx, head, torso, face)
+        X = np.stack([c[name] for name in COMPONENTS], axis=-1)
+        shape = X.shape[1:4]
+        X = X.reshape(len(block), -1, len(COMPONENTS))
+        mask = pareto_block(X)
+
+        for b in range(len(block)):
+            keep = np.flatnonzero(mask[b])
+            if len(keep) == 0:
+                counts.append(1)
+                components.append(np.full((1, len(COMPONENTS)), _INVALID, dtype=np.float32))
+                triples.append(np.full((1, 3), -1, dtype=np.int32))
+                continue
+            i, j, k = np.unravel_index(keep, shape)
+            counts.append(len(keep))
+            components.append(X[b, keep].astype(np.float32))
+            triples.append(np.stack([idx[0][b, i], idx[1][b, j], idx[2][b, k]], axis=1).astype(np.int32))
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return CandidateCache(offsets, np.concatenate(components), np.concatenate(triples),
+                          (len(head), len(torso), len(face)))
+
+
+# ========================
+# Re-ranking
+# ========================
+
+def rerank(cache, weights):
+    """
+    Winning candidate row of every user under each weight vector.
+
+    Parameters:
+        cache (CandidateCache): Cached components.
+        weights (np.ndarray): (W, 4) non-negative weight vectors.
+
+    Returns:
+        tuple: (U, W) winning rows into the cache and (U, W) winning scores.
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float32))
+    if (weights < 0).any():
+        raise ValueError("Only non-negative weights can be re-ranked from the Pareto cache")
+    scores = cache.components @ weights.T                         # (M, W)
+    starts = cache.offsets[:-1]
+    best = np.maximum.reduceat(scores, starts, axis=0)              # (U, W)
+
+    # First row reaching the max of its segment, like argmax would pick
+    counts = np.diff(cache.offsets)
+    is_best = scores == np.repeat(best, counts, axis=0)
+    rows = np.where(is_best, np.arange(len(scores))[:, None], len(scores))
+    return np.minimum.reduceat(rows, starts, axis=0), best
+
+
+def _entropy(counts):
+    p = counts[counts > 0] / counts.sum()
+    return float(-(p * np.log2(p)).sum())
+
+
+def sweep(cache, weights, chunk=32):
+    """
+    Summary statistics of the recommendations under each weight vector.
+
+    Parameters:
+        cache (CandidateCache): Cached components.
+        weights (np.ndarray): (W, 4) non-negative weight vectors.
+        chunk (int): Weight vectors re-ranked together (bounds the (M, chunk) score matrix).
+
+    Returns:
+        pd.DataFrame: One row per weight vector with the weights, the mean/std score, the
+        mean of each winning component, the accessory usage entropy (bits) and number of
+        used accessories per slot, and the number of distinct triples.
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float32))
+    n_h, n_t, n_f = cache.slot_sizes
+    summary = []
+    for start in range(0, len(weights), chunk):
+        rows, scores = rerank(cache, weights[start:start + chunk])
+        for w in range(rows.shape[1]):
+            chosen = cache.triples[rows[:, w]]
+            valid = chosen[:, 0] >= 0
+            chosen = chosen[valid]
+            stats = {f'p_{name}': float(p) for name, p in zip(COMPONENTS, weights[start + w])}
+            stats['mean_score'] = float(scores[valid, w].mean())
+            stats['std_score'] = float(scores[valid, w].std())
+            for c, name in enumerate(COMPONENTS):
+                stats[f'mean_{name}'] = float(cache.components[rows[valid, w], c].mean())
+            for s, slot in enumerate(('head', 'torso', 'face')):
+                usage = np.bincount(chosen[:, s], minlength=cache.slot_sizes[s])
+                stats[f'{slot}_entropy'] = _entropy(usage)
+                stats[f'{slot}_used'] = int((usage > 0).sum())
+            keys = (chosen[:, 0].astype(np.int64) * n_t + chosen[:, 1]) * n_f + chosen[:, 2]
+            stats['distinct_triples'] = int(len(np.unique(keys)))
+            summary.append(stats)
+    return pd.DataFrame(summary)
+
+
+def weight_grid(step=0.05):
+    # All non-negative weight vectors on a grid that sum to 1
+    n = int(round(1 / step))
+    grid = [np.array(c) * step for c in itertools.product(range(n + 1), repeat=3) if sum(c) <= n]
+    return np.array([np.append(g, 1 - g.sum()) for g in grid]).clip(0, 1).round(10)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Grid-search PET score weights from cached components')
+    parser.add_argument('users', help='Users CSV (UserID + one column per genre) or user store .npy')
+    parser.add_argument('--cache', default='candidates.npz')
+    parser.add_argument('--catalog', default=CATALOG_PATH)
+    parser.add_argument('--N', type=int, default=10)
+    parser.add_argument('--step', type=float, default=0.05)
+    parser.add_argument('--out', default='weight_sweep.csv')
+    opts = parser.parse_args()
+
+    catalog = AccessoryCatalog.from_csv(opts.catalog)
+    key = cache_key(opts.users, catalog, opts.N)
+    cache = CandidateCache.load(opts.cache) if os.path.exists(opts.cache) else None
+    if cache is not None and cache.key != key:
+        print(f"{opts.cache} was built from other users, catalog or N; rebuilding it")
+        cache = None
+    if cache is None:
+        users = open_users(opts.users).X
+        cache = build_cache(users, catalog, opts.N)
+        cache.key = key
+        cache.save(opts.cache)
+    print(f"{len(cache)} users, {len(cache.components)} cached candidates")
+
+    grid = np.vstack([WEIGHTS, weight_grid(opts.step)])
+    df = sweep(cache, grid)
+    df.to_csv(opts.out, index=False)
+    print(df.sort_values('mean_score', ascending=False).head(10).to_string(index=False))